@@ -0,0 +1,339 @@
+#! /usr/bin/env python3
+"""Load-tests the API flows offline, against local stand-ins.
+
+Boots the Flask app against the fake OpenAI API of
+:py:mod:`benchmarks.fake_openai`, and runs `--sessions` sessions,
+`--concurrency` at a time. A session creates a thread with a CV, then sends
+`--messages` messages, and for each waits for its response and reads the
+thread history:
+
+    POST /api/threads
+    POST /api/messages
+    GET  /api/messages/<id>/response[?wait=<--response-wait>]
+    GET  /api/threads/<thread_id>/messages
+
+Run from the repository root:
+
+    python -m benchmarks.api_flows [--concurrency 10] [--sessions 50] \\
+        [--run-duration 2] [--message-size 2000] [--output results.json] \\
+        [--baseline previous.json]
+
+Reports p50/p95/p99 latency per endpoint, requests per second, and the calls
+made to OpenAI, MongoDB and Redis. With `--services fake` (the default),
+MongoDB and Redis are replaced by in-process `mongomock` and `fakeredis`
+(which needs `lupa` for its Lua scripts), so their latency is not
+representative, but their call counts are. With `--services env`, the MongoDB
+and Redis configured in the environment are used.
+"""
+
+from benchmarks import fake_openai
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+import argparse
+import httpx
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+FLOWS = ['create_thread', 'send_message', 'get_response', 'thread_messages']
+
+_PROMPT_TEXT = 'Summarize the work experience of the candidates. '
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+class _Recorder:
+    """Latencies and errors of the requests made, per flow."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+
+    def request(self, flow: str, client: httpx.Client, method: str, url: str,
+                **kwargs: Any) -> httpx.Response:
+        started_at = time.perf_counter()
+        try:
+            response = client.request(method, url, **kwargs)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            with self._lock:
+                self.errors[flow] += 1
+            raise
+
+        elapsed = time.perf_counter() - started_at
+        with self._lock:
+            self.latencies[flow].append(elapsed)
+        return response
+
+
+def _configure_environment(openai_url: str, services: str) -> None:
+    # The app reads its configuration from the environment on import.
+    os.environ['OPENAI_BASE_URL'] = openai_url
+    for name, default in [('OPENAI_API_KEY', 'sk-benchmark'),
+                          ('LOG_LEVEL', 'WARNING')]:
+        if not os.environ.get(name):
+            os.environ[name] = default
+    if services == 'fake':
+        os.environ['MONGO_SYNC_INDEXES'] = 'false'
+
+
+def _register_fake_services() -> None:
+    """Registers in-process MongoDB and Redis clients, before the app
+    creates its own."""
+    try:
+        import fakeredis
+        import mongomock
+    except ImportError as e:
+        sys.exit(f'--services fake requires mongomock and fakeredis: {e}')
+
+    from tallkotte.clients import get_client
+    from tallkotte.datastore.mongodb.mongo_wrapper import MongoDB
+    from tallkotte.datastore.redisdb.redisdb import RedisDB
+
+    class _MockMongoDB(MongoDB):
+        def __init__(self) -> None:
+            self._client = mongomock.MongoClient()
+            self._db = self._client['tallkotte']
+
+    class _FakeRedisDB(RedisDB):
+        def __init__(self, server: fakeredis.FakeServer,
+                     decode_responses: bool) -> None:
+            self._connection = fakeredis.FakeRedis(
+                server=server, decode_responses=decode_responses)
+            self._is_connected = True
+
+    server = fakeredis.FakeServer()
+    get_client('mongodb', _MockMongoDB)
+    get_client('redis', lambda: _FakeRedisDB(server, True))
+    get_client('redis_binary', lambda: _FakeRedisDB(server, False))
+
+
+def _serve_app(services: str) -> str:
+    """Serves the app on a free port, in a daemon thread.
+
+    Returns:
+        str: The base URL of the app.
+    """
+    from werkzeug.serving import make_server
+
+    # The app reads the assistant id from `data/assistant.json`.
+    workdir = Path(tempfile.mkdtemp(prefix='tallkotte-benchmark-'))
+    (workdir / 'data').mkdir()
+    (workdir / 'data' / 'assistant.json').write_text(
+        json.dumps({'id': fake_openai.ASSISTANT_ID}))
+    os.chdir(workdir)
+
+    if services == 'fake':
+        _register_fake_services()
+
+    from tallkotte import create_app
+    server = make_server('127.0.0.1', 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name='benchmark-app',
+                     daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def _run_session(client: httpx.Client, recorder: _Recorder, session: int,
+                 messages: int, prompt: str,
+                 response_wait: Optional[float]) -> None:
+    # Each CV is different, so each is uploaded.
+    cv = f'Jane Doe {session}\n'.encode() * 200
+    thread_id = recorder.request(
+        'create_thread', client, 'POST', '/api/threads',
+        files={'file': (f'cv-{session}.txt', cv, 'text/plain')}
+    ).json()['thread_id']
+
+    for _ in range(messages):
+        # To the session's thread, not the active one, which is the last
+        # created by any session.
+        message = recorder.request('send_message', client, 'POST',
+                                   f'/api/threads/{thread_id}/messages',
+                                   json={'text': prompt}).json()
+        params = {'wait': response_wait} if response_wait is not None \
+            else None
+        # Long-polled until the response is saved.
+        while recorder.request('get_response', client, 'GET',
+                               f'/api/messages/{message["id"]}/response',
+                               params=params).status_code == 202:
+            pass
+        recorder.request('thread_messages', client, 'GET',
+                         f'/api/threads/{message["thread_id"]}/messages')
+
+
+def _dependency_calls() -> dict[str, Counter[str]]:
+    from tallkotte.metrics import EXTERNAL_CALL_SECONDS
+
+    calls: dict[str, Counter[str]] = defaultdict(Counter)
+    for (service, operation), count in EXTERNAL_CALL_SECONDS.counts().items():
+        calls[service][operation] += count
+    return calls
+
+
+def _summarize(latencies: list[float], errors: int) -> dict[str, Any]:
+    summary: dict[str, Any] = {'requests': len(latencies), 'errors': errors}
+    if latencies:
+        for percent in (50, 95, 99):
+            summary[f'p{percent}_ms'] = round(
+                _percentile(latencies, percent) * 1000, 2)
+    return summary
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    openai_server, openai_api = fake_openai.start(args.run_duration,
+                                                  args.message_size)
+    _configure_environment(
+        f'http://127.0.0.1:{openai_server.server_address[1]}/v1',
+        args.services)
+    base_url = _serve_app(args.services)
+    calls_before = _dependency_calls()
+
+    recorder = _Recorder()
+    prompt = (_PROMPT_TEXT * (args.prompt_size // len(_PROMPT_TEXT) + 1)
+              )[:args.prompt_size]
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    def run_session(session: int) -> None:
+        try:
+            _run_session(client, recorder, session, args.messages, prompt,
+                         args.response_wait)
+        except httpx.HTTPError as e:
+            _logger.warning(f'Session {session} failed: {e!r}')
+
+    started_at = time.perf_counter()
+    with httpx.Client(base_url=base_url, limits=limits,
+                      timeout=args.timeout) as client, \
+            ThreadPoolExecutor(args.concurrency) as executor:
+        list(executor.map(run_session, range(args.sessions)))
+    elapsed = time.perf_counter() - started_at
+
+    calls_after = _dependency_calls()
+    dependency_calls = {
+        service: {
+            'total': sum(operations.values()) -
+            sum(calls_before[service].values()),
+            'operations': {
+                operation: count - calls_before[service][operation]
+                for operation, count in sorted(operations.items())
+                if count > calls_before[service][operation]
+            },
+        }
+        for service, operations in sorted(calls_after.items())
+    }
+
+    all_latencies = [latency for flow in FLOWS
+                     for latency in recorder.latencies[flow]]
+    total_requests = len(all_latencies) + sum(recorder.errors.values())
+    return {
+        'config': {
+            'services': args.services,
+            'concurrency': args.concurrency,
+            'sessions': args.sessions,
+            'messages': args.messages,
+            'run_duration': args.run_duration,
+            'message_size': args.message_size,
+            'prompt_size': args.prompt_size,
+            'response_wait': args.response_wait,
+        },
+        'elapsed_sec': round(elapsed, 3),
+        'requests_per_sec': round(total_requests / elapsed, 2),
+        'latency': {
+            **{flow: _summarize(recorder.latencies[flow],
+                                recorder.errors[flow])
+               for flow in FLOWS},
+            'all': _summarize(all_latencies, sum(recorder.errors.values())),
+        },
+        'dependency_calls': dependency_calls,
+        'openai_requests': dict(sorted(openai_api.calls.items())),
+    }
+
+
+def _change(current: Optional[float], previous: Optional[float]) -> str:
+    if current is None or not previous:
+        return ''
+    return f'{(current - previous) / previous * 100:+.1f}%'
+
+
+def report(results: dict[str, Any],
+           baseline: Optional[dict[str, Any]] = None) -> None:
+    previous = baseline['latency'] if baseline else {}
+    print(f'{"endpoint":<16} {"requests":>8} {"errors":>6} '
+          f'{"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10}')
+    for flow, summary in results['latency'].items():
+        print(f'{flow:<16} {summary["requests"]:>8} {summary["errors"]:>6}',
+              end='')
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            print(f' {summary.get(key, 0):>10.1f}', end='')
+        print()
+        if flow in previous:
+            print(f'{"  vs baseline":<32}', end='')
+            for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+                print(f' {_change(summary.get(key),
+                                  previous[flow].get(key)):>10}', end='')
+            print()
+
+    rps = results['requests_per_sec']
+    print(f'\n{rps} requests/sec over {results["elapsed_sec"]} sec '
+          + (f'({_change(rps, baseline["requests_per_sec"])} vs baseline)'
+             if baseline else ''))
+
+    print('\nDependency calls:')
+    for service, calls in results['dependency_calls'].items():
+        operations = ', '.join(f'{operation} {count}' for operation, count
+                               in calls['operations'].items())
+        print(f'  {service:<8} {calls["total"]:>6}  ({operations})')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Sessions run at the same time.')
+    parser.add_argument('--sessions', type=int, default=50,
+                        help='Sessions run in total.')
+    parser.add_argument('--messages', type=int, default=3,
+                        help='Messages sent per session.')
+    parser.add_argument('--run-duration', type=float, default=2.0,
+                        help='Seconds until a run completes.')
+    parser.add_argument('--message-size', type=int, default=2000,
+                        help='Characters in each assistant response.')
+    parser.add_argument('--prompt-size', type=int, default=200,
+                        help='Characters in each message sent.')
+    parser.add_argument('--response-wait', type=float,
+                        help='Long-polls responses with `?wait=`, for up to '
+                             'this many seconds per request.')
+    parser.add_argument('--services', choices=['fake', 'env'],
+                        default='fake',
+                        help='MongoDB and Redis to use: in-process fakes, '
+                             'or the ones configured in the environment.')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='Timeout of each request, in seconds.')
+    parser.add_argument('--output', type=Path,
+                        help='Saves the results as JSON.')
+    parser.add_argument('--baseline', type=Path,
+                        help='Results of an earlier run, to compare with.')
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline \
+        else None
+    # The app is run from a temporary directory.
+    output = args.output.resolve() if args.output else None
+    results = run(args)
+    report(results, baseline)
+    if output:
+        output.write_text(json.dumps(results, indent=2) + '\n')
+        print(f'\nResults saved to {output}')
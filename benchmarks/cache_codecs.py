@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+"""Compares the cache codecs on realistic Message and Assistant payloads.
+
+Run from the repository root:
+
+    python -m benchmarks.cache_codecs [--number N]
+
+Codecs whose package is not installed are skipped.
+"""
+
+from tallkotte.assistant.constants import (
+    ASSISTANT_INIT_MESSAGE, ASSISTANT_INSTRUCTION
+)
+from tallkotte.datastore import codecs
+from typing import Any
+
+import argparse
+import timeit
+
+_CV_YAML = '''---
+name: 'Jane Doe'
+phoneNumbers:
+- '+47 123 45 678'
+emails:
+- 'jane.doe@example.com'
+summary: 'Backend engineer with ten years of experience building distributed
+  systems, data pipelines and developer tooling, in Python, Go and Java.'
+workExperience:
+''' + ''.join(
+    f'''- company: 'Company {i}'
+  position: 'Senior Software Engineer'
+  startDate: '20{10 + i}-01'
+  endDate: '20{11 + i}-12'
+  description: 'Designed and operated services handling millions of requests
+    per day. Led the migration to event-driven architecture, mentored
+    engineers, and owned on-call and incident reviews for the team.'
+'''
+    for i in range(12)
+)
+
+
+def _message(i: int, role: str = 'assistant') -> dict[str, Any]:
+    return {
+        'id': f'msg_{i:024d}',
+        'role': role,
+        'created_at': 1711992736 + i,
+        'run_id': 'run_ClD5W2INBdLoiYJGBzWmwDhA',
+        'thread_id': 'thread_uaw30EcQnmQceaXLNaZy9vpT',
+        'content': [_CV_YAML if role == 'assistant' else ASSISTANT_INIT_MESSAGE],
+    }
+
+
+PAYLOADS: dict[str, Any] = {
+    'message': [_message(0)],
+    'thread messages (20)': [
+        _message(i, 'assistant' if i % 2 else 'user') for i in range(20)
+    ],
+    'assistant': {
+        'id': 'asst_5idNKSayD7TnxaXyqxgrLHtU',
+        'name': 'Tallkotte',
+        'instructions': ASSISTANT_INSTRUCTION,
+        'tools': ['retrieval'],
+        'active_thread': f'thread_{999:024d}',
+    },
+}
+
+
+def _available_codecs() -> list[codecs.Codec]:
+    available: list[codecs.Codec] = []
+    for name in ['json', 'orjson', 'msgpack']:
+        try:
+            available.append(codecs.get_codec(name))
+        except ValueError as e:
+            print(f'Skipping {name}: {e}')
+    return available
+
+
+def main(number: int) -> None:
+    available = _available_codecs()
+    print(f'{"payload":<26} {"codec":<8} {"bytes":>8} '
+          f'{"encode µs":>10} {"decode µs":>10}')
+    for payload_name, payload in PAYLOADS.items():
+        for codec in available:
+            data = codecs.encode(payload, codec)
+            assert codecs.decode(data) == payload
+
+            encode_sec = timeit.timeit(
+                lambda: codecs.encode(payload, codec), number=number)
+            decode_sec = timeit.timeit(
+                lambda: codecs.decode(data), number=number)
+            print(f'{payload_name:<26} {codec.name:<8} {len(data):>8} '
+                  f'{encode_sec / number * 1e6:>10.1f} '
+                  f'{decode_sec / number * 1e6:>10.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=2000,
+                        help='Iterations per measurement.')
+    main(parser.parse_args().number)
@@ -0,0 +1,346 @@
+#! /usr/bin/env python3
+"""A local stand-in for the parts of the OpenAI API used by the app.
+
+Serves assistants, threads, messages, runs and files from memory, over HTTP,
+so the app can be run and benchmarked without OpenAI. A run completes
+`--run-duration` seconds after it is created, and then adds an assistant
+message of `--message-size` characters to its thread. Unlike OpenAI, a thread
+accepts messages and runs while a run is active, so concurrent clients can
+share the assistant's active thread.
+
+Run from the repository root:
+
+    python -m benchmarks.fake_openai [--port 8089] [--run-duration 2]
+
+and point the app at it with `OPENAI_BASE_URL=http://127.0.0.1:8089/v1`.
+"""
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+
+__all__ = [
+    'FakeOpenAI',
+    'start',
+]
+
+ASSISTANT_ID = 'asst_fake0000000000000000000'
+
+_TERMINAL_STATUSES = {'completed', 'failed', 'cancelled', 'expired'}
+
+_REPLY_TEXT = ('Jane Doe is a backend engineer with ten years of experience '
+               'building distributed systems and data pipelines. ')
+
+
+def _new_id(prefix: str) -> str:
+    return f'{prefix}_{uuid.uuid4().hex[:24]}'
+
+
+class FakeOpenAI:
+    """In-memory state of the fake API.
+
+    Routes are matched on the path after `/v1`. `calls` counts the requests
+    served per route.
+    """
+
+    def __init__(self, run_duration: float, message_size: int) -> None:
+        self.run_duration = run_duration
+        self.message_size = message_size
+        self.calls: Counter[str] = Counter()
+
+        self._lock = threading.Lock()
+        self._threads: dict[str, dict[str, Any]] = {}
+        self._messages: dict[str, list[dict[str, Any]]] = {}
+        self._runs: dict[str, dict[str, Any]] = {}
+        # Creation time of each run, on the monotonic clock.
+        self._started: dict[str, float] = {}
+
+        self._routes: list[tuple[str, re.Pattern[str], Any]] = [
+            ('GET', re.compile(r'/assistants/(?P<assistant_id>[^/]+)'),
+             self._retrieve_assistant),
+            ('POST', re.compile(r'/files'), self._create_file),
+            ('POST', re.compile(r'/threads'), self._create_thread),
+            ('GET', re.compile(r'/threads/(?P<thread_id>[^/]+)'),
+             self._retrieve_thread),
+            ('POST', re.compile(r'/threads/(?P<thread_id>[^/]+)/messages'),
+             self._create_message),
+            ('GET', re.compile(r'/threads/(?P<thread_id>[^/]+)/messages'),
+             self._list_messages),
+            ('POST', re.compile(r'/threads/(?P<thread_id>[^/]+)/runs'),
+             self._create_run),
+            ('GET', re.compile(r'/threads/(?P<thread_id>[^/]+)/runs'),
+             self._list_runs),
+            ('GET', re.compile(
+                r'/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)'),
+             self._retrieve_run),
+        ]
+
+    def handle(self, method: str, path: str, query: dict[str, str],
+               body: bytes) -> tuple[int, dict[str, Any]]:
+        path = path.removeprefix('/v1')
+        for route_method, pattern, handler in self._routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                # Counted as e.g. `GET /threads/{thread_id}`.
+                route = re.sub(r'\(\?P<(\w+)>[^)]+\)', r'{\1}',
+                               pattern.pattern)
+                with self._lock:
+                    self.calls[f'{method} {route}'] += 1
+                    return handler(query=query, body=body, **match.groupdict())
+
+        return 404, {'error': {'message': f'No route for {method} {path}',
+                               'type': 'invalid_request_error'}}
+
+    def _message(self, thread_id: str, role: str, text: str,
+                 run_id: Optional[str] = None,
+                 file_ids: Optional[list[str]] = None) -> dict[str, Any]:
+        now = int(time.time())
+        message = {
+            'id': _new_id('msg'),
+            'object': 'thread.message',
+            'created_at': now,
+            'completed_at': now,
+            'thread_id': thread_id,
+            'role': role,
+            'content': [{'type': 'text',
+                         'text': {'value': text, 'annotations': []}}],
+            'assistant_id': ASSISTANT_ID if role == 'assistant' else None,
+            'run_id': run_id,
+            'file_ids': file_ids or [],
+            'metadata': {},
+            'status': 'completed',
+            'incomplete_at': None,
+            'incomplete_details': None,
+        }
+        self._messages[thread_id].append(message)
+        return message
+
+    def _advance(self, thread_id: str) -> None:
+        """Completes the runs of the thread that have run long enough."""
+        now = time.monotonic()
+        for run in self._runs.values():
+            if run['thread_id'] != thread_id \
+                    or run['status'] in _TERMINAL_STATUSES \
+                    or now - self._started[run['id']] < self.run_duration:
+                continue
+            run['status'] = 'completed'
+            run['completed_at'] = int(time.time())
+            run['usage'] = {'prompt_tokens': 1000,
+                            'completion_tokens': self.message_size // 4,
+                            'total_tokens': 1000 + self.message_size // 4}
+            reply = (_REPLY_TEXT * (self.message_size // len(_REPLY_TEXT) + 1))
+            self._message(thread_id, 'assistant', reply[:self.message_size],
+                          run_id=run['id'])
+
+    def _thread_or_404(self, thread_id: str) -> Optional[tuple[int, Any]]:
+        if thread_id not in self._threads:
+            return 404, {'error': {'message': f'No thread {thread_id}',
+                                   'type': 'invalid_request_error'}}
+        self._advance(thread_id)
+
+    def _retrieve_assistant(self, assistant_id: str,
+                            **_: Any) -> tuple[int, Any]:
+        return 200, {
+            'id': assistant_id,
+            'object': 'assistant',
+            'created_at': int(time.time()),
+            'name': 'Tallkotte',
+            'description': None,
+            'model': 'gpt-3.5-turbo',
+            'instructions': 'Review the CVs.',
+            'tools': [{'type': 'retrieval'}],
+            'file_ids': [],
+            'metadata': {},
+        }
+
+    def _create_file(self, body: bytes, **_: Any) -> tuple[int, Any]:
+        return 200, {
+            'id': _new_id('file'),
+            'object': 'file',
+            'bytes': len(body),
+            'created_at': int(time.time()),
+            'filename': 'cv.pdf',
+            'purpose': 'assistants',
+            'status': 'processed',
+            'status_details': None,
+        }
+
+    def _create_thread(self, body: bytes, **_: Any) -> tuple[int, Any]:
+        request = json.loads(body or b'{}')
+        thread = {
+            'id': _new_id('thread'),
+            'object': 'thread',
+            'created_at': int(time.time()),
+            'metadata': {},
+        }
+        self._threads[thread['id']] = thread
+        self._messages[thread['id']] = []
+        for message in request.get('messages', []):
+            self._message(thread['id'], message['role'], message['content'],
+                          file_ids=message.get('file_ids'))
+        return 200, thread
+
+    def _retrieve_thread(self, thread_id: str, **_: Any) -> tuple[int, Any]:
+        return self._thread_or_404(thread_id) \
+            or (200, self._threads[thread_id])
+
+    def _create_message(self, thread_id: str, body: bytes,
+                        **_: Any) -> tuple[int, Any]:
+        if error := self._thread_or_404(thread_id):
+            return error
+        request = json.loads(body)
+        return 200, self._message(thread_id, request.get('role', 'user'),
+                                  request['content'],
+                                  file_ids=request.get('file_ids'))
+
+    def _list_messages(self, thread_id: str, query: dict[str, str],
+                       **_: Any) -> tuple[int, Any]:
+        if error := self._thread_or_404(thread_id):
+            return error
+
+        messages = self._messages[thread_id]
+        if query.get('order', 'desc') == 'desc':
+            messages = messages[::-1]
+        ids = [message['id'] for message in messages]
+        if query.get('after') in ids:
+            messages = messages[ids.index(query['after']) + 1:]
+        elif query.get('before') in ids:
+            messages = messages[:ids.index(query['before'])]
+
+        limit = int(query.get('limit', 20))
+        page = messages[:limit]
+        return 200, {
+            'object': 'list',
+            'data': page,
+            'first_id': page[0]['id'] if page else None,
+            'last_id': page[-1]['id'] if page else None,
+            'has_more': len(messages) > limit,
+        }
+
+    def _create_run(self, thread_id: str, body: bytes,
+                    **_: Any) -> tuple[int, Any]:
+        if error := self._thread_or_404(thread_id):
+            return error
+        request = json.loads(body)
+        if request.get('stream'):
+            return 400, {'error': {'message': 'Streaming is not supported',
+                                   'type': 'invalid_request_error'}}
+
+        now = int(time.time())
+        run = {
+            'id': _new_id('run'),
+            'object': 'thread.run',
+            'created_at': now,
+            'started_at': now,
+            'completed_at': None,
+            'cancelled_at': None,
+            'failed_at': None,
+            'expires_at': now + 600,
+            'assistant_id': request['assistant_id'],
+            'thread_id': thread_id,
+            'status': 'in_progress',
+            'model': 'gpt-3.5-turbo',
+            'instructions': request.get('instructions') or '',
+            'tools': [],
+            'file_ids': [],
+            'metadata': {},
+            'last_error': None,
+            'required_action': None,
+            'usage': None,
+        }
+        self._runs[run['id']] = run
+        self._started[run['id']] = time.monotonic()
+        return 200, run
+
+    def _list_runs(self, thread_id: str, **_: Any) -> tuple[int, Any]:
+        if error := self._thread_or_404(thread_id):
+            return error
+        runs = [run for run in reversed(self._runs.values())
+                if run['thread_id'] == thread_id]
+        return 200, {'object': 'list', 'data': runs,
+                     'first_id': runs[0]['id'] if runs else None,
+                     'last_id': runs[-1]['id'] if runs else None,
+                     'has_more': False}
+
+    def _retrieve_run(self, thread_id: str, run_id: str,
+                      **_: Any) -> tuple[int, Any]:
+        if error := self._thread_or_404(thread_id):
+            return error
+        if run_id not in self._runs:
+            return 404, {'error': {'message': f'No run {run_id}',
+                                   'type': 'invalid_request_error'}}
+        return 200, self._runs[run_id]
+
+
+def _handler(api: FakeOpenAI) -> type[BaseHTTPRequestHandler]:
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keeps connections alive, as the OpenAI client pools them.
+        protocol_version = 'HTTP/1.1'
+
+        def _serve(self) -> None:
+            url = urlsplit(self.path)
+            query = {key: values[-1]
+                     for key, values in parse_qs(url.query).items()}
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+
+            status, response = api.handle(self.command, url.path, query, body)
+            data = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = _serve
+        do_POST = _serve
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+def start(run_duration: float = 2.0, message_size: int = 2000,
+          host: str = '127.0.0.1',
+          port: int = 0) -> tuple[ThreadingHTTPServer, FakeOpenAI]:
+    """Serves a fake API in a daemon thread. Port 0 picks a free port.
+
+    Returns:
+        The server, whose `server_address` is the address it listens on, and
+        the API state.
+    """
+    api = FakeOpenAI(run_duration, message_size)
+    server = ThreadingHTTPServer((host, port), _handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-openai',
+                     daemon=True).start()
+    return server, api
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--run-duration', type=float, default=2.0,
+                        help='Seconds until a run completes.')
+    parser.add_argument('--message-size', type=int, default=2000,
+                        help='Characters in each assistant response.')
+    args = parser.parse_args()
+
+    server, _ = start(args.run_duration, args.message_size,
+                      args.host, args.port)
+    print(f'Serving on http://{args.host}:{server.server_address[1]}/v1')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,64 @@
+#! /usr/bin/env python3
+"""Measures the cost of the log records written on the request path.
+
+Compares logging a cached document with an f-string at INFO, as the cache and
+database clients used to, with the lazy, truncated and sampled records of
+:py:mod:`tallkotte.logs`, when they are emitted and when their level is
+disabled. Records are written to /dev/null, with the app's format.
+
+Run from the repository root:
+
+    python -m benchmarks.logging_overhead [--number N]
+
+For the overhead per request, compare runs of `benchmarks.api_flows` with
+`LOG_LEVEL=INFO`.
+"""
+
+from benchmarks.cache_codecs import PAYLOADS
+from tallkotte.logs import LOG_FORMAT, payload, sampled
+from typing import Any, Callable
+
+import argparse
+import logging
+import os
+import timeit
+
+
+def _logger() -> logging.Logger:
+    logger = logging.getLogger('benchmarks.logging_overhead')
+    logger.propagate = False
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(handler)
+    return logger
+
+
+def _cases(logger: logging.Logger,
+           value: Any) -> dict[str, Callable[[], None]]:
+    key = 'messages:thread_uaw30EcQnmQceaXLNaZy9vpT'
+    return {
+        'f-string': lambda: logger.info(f'cache hit: {key} -> {value}'),
+        'lazy payload': lambda: logger.info('cache hit: %s -> %s', key,
+                                            payload(value)),
+        'sampled': lambda: sampled(logger, 'cache hit: %s', key),
+    }
+
+
+def main(number: int) -> None:
+    logger = _logger()
+    print(f'{"payload":<22} {"record":<14} {"INFO µs":>9} {"WARNING µs":>11}')
+    for payload_name, value in PAYLOADS.items():
+        for case_name, case in _cases(logger, value).items():
+            timings = []
+            for level in (logging.INFO, logging.WARNING):
+                logger.setLevel(level)
+                timings.append(timeit.timeit(case, number=number) / number)
+            print(f'{payload_name:<22} {case_name:<14} '
+                  f'{timings[0] * 1e6:>9.2f} {timings[1] * 1e6:>11.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000,
+                        help='Iterations per measurement.')
+    main(parser.parse_args().number)
@@ -1,37 +1,30 @@
-from flask import Flask
+from .logs import configure_logging
+from flask import Flask, Request, current_app
 from pathlib import Path
-from typing import Any, Mapping
+from tempfile import SpooledTemporaryFile
+from typing import IO, Any, Mapping, Optional
 
 import os
 import logging
 
 _SRC_ROOT = Path(__file__).parent
 _APP_ROOT = _SRC_ROOT.parent
-_UPLOAD_FOLDER = _APP_ROOT / 'uploads'
 
-_LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+configure_logging()
 
-logging.basicConfig(
-    level=logging.getLevelName(_LOG_LEVEL),  # if args.debug else logging.INFO,
-    format=(
-        '%(asctime)s %(threadName)s %(filename)s:%(lineno)d %(levelname)s - '
-        '%(message)s'
-    )
-)
 
+class _Request(Request):
 
-def _init_upload_folder(cwd: Path) -> str:
-    def is_writable(dirpath: Path) -> bool:
-        return os.access(dirpath, os.W_OK)
-    
-    upload_folder = cwd / 'uploads'
-    if not os.path.exists(upload_folder):
-        logging.info(f'Creating upload folder: {upload_folder}')
-        os.mkdir(upload_folder)
-
-    if is_writable(upload_folder):
-        return upload_folder.as_posix()
-    raise RuntimeError(f'Upload folder is not writable: {upload_folder}')
+    def _get_file_stream(self,
+                         total_content_length: Optional[int],
+                         content_type: Optional[str],
+                         filename: Optional[str] = None,
+                         content_length: Optional[int] = None) -> IO[bytes]:
+        # Uploads are passed on to OpenAI, so they are kept in memory, rather
+        # than in a temporary file, up to UPLOAD_MEMORY_MAX_BYTES.
+        return SpooledTemporaryFile(  # type: ignore[return-value]
+            max_size=current_app.config['UPLOAD_MEMORY_MAX_BYTES'],
+            mode='rb+')
 
 
 def _create_flask_config() -> Mapping[str, Any]:
@@ -47,7 +40,8 @@ def _create_flask_config() -> Mapping[str, Any]:
     flask_config = {
         'SECRET_KEY': 'dev',
         'ASSISTANT_ID': assistant_id,
-        'UPLOAD_FOLDER': _init_upload_folder(cwd),
+        'UPLOAD_MEMORY_MAX_BYTES': int(
+            os.environ.get('UPLOAD_MEMORY_MAX_BYTES', 10 * 1024 * 1024)),
     }
 
     flask_config.update(openai_config)  # type: ignore
@@ -62,12 +56,22 @@ def create_app():
 
     # create and configure Flask app
     app = Flask(__name__, instance_relative_config=True)
+    app.request_class = _Request
     app.config.from_mapping(_create_flask_config())
 
     with app.app_context():
         from . import api
         app.register_blueprint(api.bp)
 
+        from .datastore.mongodb.indexes import sync_indexes, sync_indexes_command
+        from .datastore.mongodb.mongo_wrapper import get_mongo
+        app.cli.add_command(sync_indexes_command)
+
+        from .assistant.response_worker import worker_command
+        app.cli.add_command(worker_command)
+        if app.config['MONGO_SYNC_INDEXES']:
+            sync_indexes(get_mongo())
+
     # ensure the instance folder exists
     try:
         os.makedirs(app.instance_path)
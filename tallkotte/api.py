@@ -1,11 +1,18 @@
+from . import metrics
 from .assistant.assistant_service import get_assistant
-from flask import Blueprint, current_app, jsonify, request
+from .assistant.background_task_executor import get_executor
+from .assistant.openai.datatypes.run import RunStreamEvent
+from .datastore.cachedstore import cache_stats
+from flask import (
+    Blueprint, Response, current_app, jsonify, request, stream_with_context
+)
 from markupsafe import escape
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
+from typing import IO, Iterator
 
+import json
 import logging
-import os
 import traceback
 
 
@@ -18,15 +25,20 @@ def _file_allowed(filename: str) -> bool:
         filename.rsplit('.', 1)[1].lower() in _ALLOWED_EXTENSIONS
 
 
-def _save_file(file: FileStorage) -> str:
+def _to_upload(file: FileStorage) -> tuple[str, IO[bytes]]:
     filename = file.filename
     if not filename or not _file_allowed(filename):
         raise ValueError(f'Invalid file: {filename}')
-    filepath: str = os.path.join(current_app.config['UPLOAD_FOLDER'],  # type: ignore
-                                 secure_filename(filename))
-    current_app.logger.info(f'Saving file to {filepath}')
-    file.save(filepath)  # type: ignore
-    return filepath
+    return secure_filename(filename), file.stream
+
+
+def _to_server_sent_events(events: Iterator[RunStreamEvent]) -> Iterator[str]:
+    try:
+        for event in events:
+            yield f'event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n'
+    except Exception as e:
+        current_app.logger.error(e)
+        yield f'event: error\ndata: {json.dumps(str(e))}\n\n'
 
 
 @bp.errorhandler(500)
@@ -45,6 +57,21 @@ def home():
     }
 
 
+@bp.route('/cache/stats')
+def get_cache_stats():
+    return jsonify(cache_stats())
+
+
+@bp.route('/executor/stats')
+def get_executor_stats():
+    return jsonify(get_executor().stats())
+
+
+@bp.route('/metrics')
+def get_metrics():
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+
 @bp.route('/openai/threads/<thread_id>/messages')
 def thread_messages(thread_id: str):
     messages = get_assistant().get_messages(
@@ -52,7 +79,8 @@ def thread_messages(thread_id: str):
         after=request.args.get('after'),
         before=request.args.get('before'),
         limit=request.args.get('limit'),  # type: ignore
-        sort=request.args.get('sort'))  # type: ignore
+        sort=request.args.get('sort'),  # type: ignore
+        local=False)
 
     return jsonify(messages)
 
@@ -64,22 +92,33 @@ def assistant():
 
 @bp.route('/threads/<thread_id>/messages', methods=['GET'])
 def get_messages(thread_id: str):
-    after = request.args.get('after')
-
     messages = get_assistant().get_messages(
-        thread_id=escape(thread_id), after=after)
+        thread_id=escape(thread_id),
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        limit=request.args.get('limit', 20, type=int),
+        sort=request.args.get('sort', 'desc'))  # type: ignore
     return jsonify(messages)
 
 
+@bp.route('/threads', methods=['GET'])
+def list_threads():
+    threads = get_assistant().list_threads(
+        after=request.args.get('after'),
+        limit=request.args.get('limit', 20, type=int))
+    return jsonify(threads)
+
+
 @bp.route('/threads', methods=['POST'])
 def create_thread():
-    if 'file' not in request.files or not request.files['file'].filename:
+    files = [file for file in request.files.getlist('file') if file.filename]
+    if not files:
         raise ValueError('A CV file is required to create a thread.')
 
-    filepath = _save_file(request.files['file'])
     init_message = request.args.get('init_message')
-    thread = get_assistant().create_thread(cv_files=[filepath],
-                                           init_message=init_message)
+    thread = get_assistant().create_thread(
+        cv_files=[_to_upload(file) for file in files],
+        init_message=init_message)
 
     return {'thread_id': thread.id}, 201
 
@@ -98,6 +137,35 @@ def messages():  # type: ignore
     return message, 201
 
 
+@bp.route('/threads/<thread_id>/messages', methods=['POST'])
+def send_message(thread_id: str):
+    request_json = request.get_json(silent=True)
+    text = request_json['text'] if request_json \
+        else request.args.get('message')
+    if not text:
+        raise ValueError('No message provided')
+
+    message = get_assistant().send_message(text, escape(thread_id))
+    if '_id' in message.keys():
+        del message['_id']  # type: ignore
+    return message, 201
+
+
+@bp.route('/threads/<thread_id>/messages/stream', methods=['POST'])
+def stream_message(thread_id: str):
+    request_json = request.get_json(silent=True)
+    text = request_json['text'] if request_json \
+        else request.args.get('message')
+    if not text:
+        raise ValueError('No message provided')
+
+    events = get_assistant().stream_message(text, escape(thread_id))
+    return Response(stream_with_context(_to_server_sent_events(events)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+
 @bp.route('/runs/<run_id>', methods=['GET'])
 def run(run_id: str):
     run = get_assistant().get_run(escape(run_id))
@@ -106,6 +174,8 @@ def run(run_id: str):
 
 @bp.route('/messages/<message_id>/response', methods=['GET'])
 def get_response(message_id: str):
-    return jsonify(
-        get_assistant().get_response(escape(message_id))
-    )
+    response = get_assistant().get_response(
+        escape(message_id), wait=request.args.get('wait', type=float))
+    if response is None:
+        return {'status': 'pending'}, 202
+    return jsonify(response)
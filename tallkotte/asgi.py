@@ -0,0 +1,54 @@
+"""Async serving mode, as an ASGI app.
+
+Run with an ASGI server, e.g.:
+
+    hypercorn 'tallkotte.asgi:create_asgi_app()'
+
+Requires the `quart` and `motor` packages.
+"""
+from . import create_app
+from .clients import find_client
+from quart import Quart
+
+import logging
+
+__all__ = [
+    'create_asgi_app',
+]
+
+# Async clients closed when the server stops.
+_ASYNC_CLIENTS = ['async_thread_events', 'async_openai', 'async_redis',
+                  'async_redis_binary']
+
+
+def create_asgi_app() -> Quart:
+    """Creates the ASGI app, serving the API on an event loop.
+
+    The Flask app is created too: its config is shared, and endpoints without
+    an async implementation run its sync code in worker threads. The async
+    clients are created on first use, on the event loop of the server.
+    """
+    flask_app = create_app()
+
+    app = Quart(__name__, instance_relative_config=True)
+    app.config.from_mapping(flask_app.config)
+    app.extensions['flask_app'] = flask_app
+
+    # The async modules share cache settings and DAOs with the sync ones,
+    # which are set up in the Flask app context.
+    with flask_app.app_context():
+        from . import async_api
+        app.register_blueprint(async_api.bp)
+
+    @app.after_serving
+    async def close_clients() -> None:
+        for name in _ASYNC_CLIENTS:
+            client = find_client(name)
+            if client is not None:
+                await client.close()
+        mongo = find_client('async_mongodb')
+        if mongo is not None:
+            mongo.close()
+        logging.info('Async clients closed')
+
+    return app
@@ -9,7 +9,6 @@ __all__ = [
 
 _ASSISTANT_ID_FILENAME = 'assistant.json'
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 
 def get_assistant_id(assistant_data_path: Path) -> str:
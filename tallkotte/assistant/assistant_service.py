@@ -1,14 +1,19 @@
-from . import background_task_executor
 from ..datastore.redisdb.redisdb import get_redis
 from ..datastore.mongodb.mongo_wrapper import MongoDB, get_mongo
-from .assistant_thread import AssistantThread
+from ..logs import payload
+from .assistant_thread import AssistantThread, Thread
 from .constants import ASSISTANT_NAME, ASSISTANT_DESCRIPTION, ASSISTANT_INSTRUCTION
+from .constants import RESPONSE_QUEUE_ENABLED, RESPONSE_WAIT_MAX_SEC
 from .dao import assistants_dao, messages_dao
+from .file_uploader import upload_files
+from .response_worker import enqueue_response
 from .openai.datatypes.assistant import Assistant
 from .openai.datatypes.message import Message
+from .openai.datatypes.run import RunStreamEvent
 from .openai.openai_wrapper import get_openai
 from flask import current_app, g
-from typing import Any, Literal, Mapping, Optional
+from functools import partial
+from typing import IO, Any, Iterator, Literal, Mapping, Optional
 
 import logging
 
@@ -27,23 +32,54 @@ def _create_assistant(name: str = ASSISTANT_NAME,
 
 
 def _retrieve_assistant(assistant_id: str) -> Assistant:
-    def get_thread_ids(assistant_id: str) -> list[str]:
-        results: list[Mapping[str, str]] = mongodb.find(
-            'threads', {'assistant_id': assistant_id}, {'id': 1})
-        logging.info(f'Found {len(results)} threads')
-        return [result['id'] for result in results]
-
     assistant_state = assistants_dao.get(assistant_id)
     if not assistant_state:
         assistant = openai.retrieve_assistant(assistant_id)
         if not assistant:
             raise ValueError(f'No assistant found with id: {assistant_id}')
-        assistant['threads'] = get_thread_ids(assistant['id'])
         return assistants_dao.save(assistant)
 
     return assistant_state
 
 
+def _find_threads(assistant_id: str,
+                  *,
+                  after: Optional[str] = None,
+                  limit: int = 20) -> list[Thread]:
+    """Finds a page of the assistant's threads, newest first."""
+    conditions: list[dict[str, Any]] = [{'assistant_id': assistant_id}]
+    if after:
+        cursor = mongodb.find('threads', {'id': after},
+                              {'created_at': 1}, limit=1)
+        if not cursor:
+            raise ValueError(f'No thread found with id: {after}')
+        created_at, object_id = cursor[0]['created_at'], cursor[0]['_id']
+        conditions.append({'$or': [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, '_id': {'$lt': object_id}},
+        ]})
+
+    results = mongodb.find('threads', {'$and': conditions},
+                           {'_id': 0},
+                           sort={'created_at': -1, '_id': -1},
+                           limit=limit)
+    logging.info(f'Found {len(results)} threads')
+    return [Thread(**result) for result in results]  # type: ignore
+
+
+def collect_response(thread: AssistantThread, message: Message) -> None:
+    """Has the response to the message saved once its run completes."""
+    try:
+        if RESPONSE_QUEUE_ENABLED:
+            # Saved by a worker process, even if this one stops
+            enqueue_response(message['run_id'], thread.id, message['id'])
+        else:
+            # Save the reply once the run watcher sees the run complete
+            thread.watch_response(message['run_id'], message['id'])
+    except Exception as e:
+        logging.error('Failed to save response: %s', e)
+
+
 class AssistantService:
 
     _logger = logging.getLogger(__name__)
@@ -71,40 +107,48 @@ class AssistantService:
     def name(self) -> str | None:
         return self._state['name']
 
-    @property
-    def threads(self) -> list[str]:
-        return self._state['threads']
-
     @property
     def active_thread(self) -> str:
         return self._state['active_thread']
 
-    def _add_thread(self, thread_id: str,
-                    *, set_active: bool = True):
-        self._logger.info(f'About to update state: {self._state}')
-        self._state['threads'].append(thread_id)
-        if set_active:
-            self._state['active_thread'] = thread_id
-
-        assistants_dao.save(self._state)
+    def list_threads(self, *,
+                     after: Optional[str] = None,
+                     limit: Optional[int] = 20) -> list[Thread]:
+        """Lists the assistant's threads, newest first.
+
+        Args:
+            after (str): Thread ID after which to list threads.
+            limit (int): Number of threads, up to 100.
+        """
+        return _find_threads(self.id, after=after,
+                             limit=min(int(limit or 20), 100))
+
+    def _set_active_thread(self, thread_id: str) -> None:
+        # The thread is linked to the assistant by its `assistant_id`.
+        assistants_dao.set_active_thread(self.id, thread_id)
+        self._state['active_thread'] = thread_id
         self._logger.info(
-            f'Added {thread_id} to assistant {self.id}')
+            f'{thread_id} is the active thread of assistant {self.id}')
 
     def create_thread(self,
                       *,
-                      cv_files: list[str] = [],
+                      cv_files: list[tuple[str, IO[bytes]]] = [],
                       init_message: Optional[str] = None,
                       set_active: bool = True) -> AssistantThread:
-        files = [
-            openai.open_file(filename)
-            for filename in cv_files
-        ]
+        """Creates a thread with the CVs.
+
+        Args:
+            cv_files (list[tuple[str, IO[bytes]]]): File names, and seekable
+                streams of the CVs. See :py:func:`file_uploader.upload_files`.
+        """
+        file_ids = upload_files(cv_files)
         thread = AssistantThread(self.id,
-                                 files=files,
+                                 file_ids=file_ids,
                                  init_message=init_message,
                                  create_new=True)
 
-        self._add_thread(thread.id, set_active=set_active)
+        if set_active:
+            self._set_active_thread(thread.id)
 
         return thread
 
@@ -125,34 +169,52 @@ class AssistantService:
                      *, await_response_async: bool = True) -> Message:
         thread = self.get_thread(thread_id)
         message = thread.send_message(text)
-        self._logger.info(f'Sent message: {message}')
+        self._logger.debug('Sent message: %s', payload(message))
 
         if await_response_async:
-            try:
-                # Asynchronously get and save the reply
-                background_task_executor.execute_concurrently(
-                    thread.get_response, message['run_id'], message['id']
-                )
-            except Exception as e:
-                self._logger.error('Failed to save response: %s', e)
+            collect_response(thread, message)
 
         return message
 
+    def stream_message(self, text: str,
+                       thread_id: str = '') -> Iterator[RunStreamEvent]:
+        thread = self.get_thread(thread_id)
+        return thread.stream_message(text)
+
     def get_messages(self,
                      thread_id: str = '',
                      *,
                      after: Optional[str] = None,
                      before: Optional[str] = None,
                      limit: Optional[int] = 20,
-                     sort: Optional[Literal['asc', 'desc']] = 'desc') -> list[Message]:
+                     sort: Optional[Literal['asc', 'desc']] = 'desc',
+                     local: bool = True) -> list[Message]:
         thread = self.get_thread(thread_id)
+        if local:
+            return thread.get_history(
+                after=after, before=before, limit=limit, sort=sort)
         return thread.get_messages(
             after=after, before=before, limit=limit, sort=sort)
 
     def get_run(self, run_id: str):
         return openai.retrieve_run(run_id, self.active_thread)
 
-    def get_response(self, message_id: str) -> list[Message]:
+    def get_response(self, message_id: str,
+                     wait: Optional[float] = None) -> Optional[list[Message]]:
+        """Returns the response to the message.
+
+        Args:
+            message_id (str): ID of the user message.
+            wait (float): Seconds to wait for the response to be saved, up to
+                `RESPONSE_WAIT_MAX_SEC`, without watching the run. If not
+                given, the run is watched until it is done, unless responses
+                are collected by response workers: then it is waited for up
+                to `RESPONSE_WAIT_MAX_SEC`.
+
+        Returns:
+            List of messages from the run, or None if the response was waited
+            for, and was not saved in time.
+        """
         message = messages_dao.find_by_id(message_id)
         if not message:
             raise ValueError(f'No message found with id: {message_id}')
@@ -161,7 +223,16 @@ class AssistantService:
         if not message['run_id']:
             raise ValueError(f'Message has no run_id: {message_id}')
 
-        return self.get_thread().get_response(message['run_id'], message['id'])
+        thread = self.get_thread(message['thread_id'])
+        if wait is None and RESPONSE_QUEUE_ENABLED:
+            # Not watched here, as a response worker collects it.
+            wait = RESPONSE_WAIT_MAX_SEC
+        if wait is not None:
+            return thread.wait_for_response(
+                message['run_id'], message['id'],
+                min(max(wait, 0), RESPONSE_WAIT_MAX_SEC),
+                collect=partial(collect_response, thread, message))
+        return thread.get_response(message['run_id'], message['id'])
 
 
 def get_assistant() -> AssistantService:
@@ -1,4 +1,5 @@
 from ..datastore.redisdb.redisdb import get_redis
+from ..logs import payload
 from typing import Any
 
 import json
@@ -27,7 +28,7 @@ class AssistantState:
 
     def save(self):
         state = json.dumps(self.state)
-        logging.info(f'Saving state {self._id}: {state}')
+        logging.debug('Saving state %s: %s', self._id, payload(self.state))
         redis.write(self._id, state)
 
     def toJSON(self):
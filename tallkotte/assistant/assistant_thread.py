@@ -1,13 +1,23 @@
+from ..datastore.cache_policy import get_policy
 from ..datastore.cachedstore import CachedStore
 from ..datastore.mongodb.mongo_query import MongoQueryBuilder
+from ..datastore.mongodb.mongo_wrapper import MongoDB, get_mongo
 from ..datastore.redisdb.redisdb import get_redis
-from .constants import ASSISTANT_INIT_MESSAGE
+from ..logs import payload
+from . import background_task_executor
+from .constants import ASSISTANT_INIT_MESSAGE, THREAD_SYNC_INTERVAL_SEC
 from .dao import messages_dao
 from .openai.datatypes.message import Message
+from .openai.datatypes.run import RunStreamEvent
 from .openai.openai_wrapper import get_openai
-from openai.types import FileObject
+from .run_events import TERMINAL_STATUSES, get_run_events
+from .run_watcher import MAX_DELAY_SEC, MAX_WAIT_SEC, get_run_watcher
+from .thread_events import run_event
+from concurrent.futures import Future, TimeoutError
+from flask import current_app
+from functools import partial
 from openai.types.beta import Thread as OpenAiThread
-from typing import Literal, Optional, TypedDict
+from typing import Any, Callable, Iterator, Literal, Mapping, Optional, TypedDict
 
 import json
 import logging
@@ -22,10 +32,66 @@ class Thread(TypedDict):
 
 redis = get_redis()
 openai = get_openai()
+mongodb: MongoDB[Mapping[str, Any]] = get_mongo()
 cached_store = CachedStore[Thread](
     'threads', lambda thread_map: Thread(**thread_map))
 
 
+# A process watching a run renews its lease on `watching:{run_id}` at every
+# check, which are at most MAX_DELAY_SEC apart, plus jitter. Once it expires,
+# a request waiting for the run has it watched again.
+RUN_LEASE_TTL_SEC = int(3 * MAX_DELAY_SEC)
+
+# Messages read from OpenAI per request of a thread sync; the most it lists.
+SYNC_PAGE_SIZE = 100
+
+
+class RunFailedError(RuntimeError):
+    """The run ended without completing, so it has no response."""
+
+
+def run_lease_key(run_id: str) -> str:
+    return f'watching:{run_id}'
+
+
+def _renew_lease(run_id: str) -> None:
+    redis.connection.set(run_lease_key(run_id), 1, ex=RUN_LEASE_TTL_SEC)
+
+
+def claim_run(run_id: str) -> bool:
+    """Takes the lease of the run, if no process is watching it.
+
+    Returns:
+        bool: Whether the run was not watched, and should be.
+    """
+    return bool(redis.connection.set(run_lease_key(run_id), 1, nx=True,
+                                     ex=RUN_LEASE_TTL_SEC))
+
+
+def _set_run_status(run_id: str, thread_id: str, status: str) -> None:
+    """Sets the status of the run, and publishes it to the thread's
+    subscribers. A final status is also published for the requests waiting
+    for the run."""
+    redis.write(f'{run_id}:status', status,
+                ttl=get_policy('run_status')['ttl'])
+    redis.publish(*run_event(run_id, thread_id, status))
+    if status in TERMINAL_STATUSES:
+        get_run_events().publish(run_id, status)
+
+
+def sent_records(
+        message: Message) -> tuple[dict[str, str], dict[str, Optional[int]]]:
+    """Redis values, and their TTLs, recording that the message was sent: its
+    run is created, and it is the last message sent in its thread."""
+    return {
+        f'{message['run_id']}:status': 'created',
+        f'last_sent:{message['thread_id']}': json.dumps(message['id']),
+    }, {
+        f'{message['run_id']}:status': get_policy('run_status')['ttl'],
+        f'last_sent:{message['thread_id']}': get_policy('last_sent')['ttl'],
+    }
+
+
 class AssistantThread:
 
     _logger = logging.getLogger(__name__)
@@ -33,7 +99,7 @@ class AssistantThread:
     def __init__(self,
                  assistant_id: str,
                  thread_id: Optional[str] = None,
-                 files: list[FileObject] = [],
+                 file_ids: list[str] = [],
                  init_message: Optional[str] = None,
                  *,
                  create_new: bool = False) -> None:
@@ -44,7 +110,7 @@ class AssistantThread:
             self._state = self._get(assistant_id, thread_id)
         elif create_new:
             init_message = init_message or ASSISTANT_INIT_MESSAGE
-            self._state = self._create(assistant_id, files, init_message)
+            self._state = self._create(assistant_id, file_ids, init_message)
         else:
             raise ValueError(
                 'thread_id must be specified, or create_new must be True')
@@ -63,11 +129,11 @@ class AssistantThread:
                         created_at=opeanai_thread.created_at)
 
         cached_store.write_one(thread)
-        self._logger.info(f'Thread saved: {thread}')
+        self._logger.info('Thread saved: %s', thread['id'])
         return thread
 
     def _get(self, assistant_id: str, thread_id: str) -> Thread:
-        self._logger.info(f'Reading: {thread_id}')
+        self._logger.debug('Reading: %s', thread_id)
         thread = cached_store.read(thread_id,
                                    MongoQueryBuilder(id=thread_id).build())
         if not thread:
@@ -78,23 +144,14 @@ class AssistantThread:
 
     def _create(self,
                 assistant_id: str,
-                files: list[FileObject] = [],
+                file_ids: list[str] = [],
                 init_message: str = ASSISTANT_INIT_MESSAGE) -> Thread:
         return self._save(
             openai.create_thread(
-                files=files, init_message=init_message),
+                file_ids=file_ids, init_message=init_message),
             assistant_id
         )
 
-    def _get_last_message(self, thread_id: str) -> Message | None:
-        """Get last message in thread from Mongo."""
-        results = messages_dao.find(
-            filter={'thread_id': thread_id},
-            sort={'timestamp': -1}
-        )
-
-        return results[0] if results else None
-
     def send_message(self, text: str) -> Message:
         """Send a message to the thread.
 
@@ -112,71 +169,133 @@ class AssistantThread:
 
         run = openai.create_run(self.assistant_id, self.id)
         run_id = run['id']
-        redis.write(f'{run_id}:status', 'created')
         self._logger.info(f'{run_id} created in {self.id}')
 
         # Set run_id in message
         message['run_id'] = run_id
 
-        self._logger.debug(f'Saving message: {message}')
+        self._logger.debug('Saving message: %s', payload(message))
         messages_dao.save([message])
-        redis.write(f'last_sent:{self.id}', json.dumps(message['id']))
+        self._set_sent(message)
 
         return message
 
-    def _await_run_completion(self, run_id: str,
-                              wait_delay: int = 2,
-                              max_wait_sec: int = 60) -> None:
-        """Blocks until run is completed."""
+    def _set_sent(self, message: Message) -> None:
+        """Records the run as created, and the message as the last sent."""
+        redis.write_many(*sent_records(message))
+        redis.publish(*run_event(message['run_id'], self.id, 'created'))
 
-        # Check if the run was previously completed.
-        run_status = redis.read(f'{run_id}:status')
-        if bool(run_status and run_status == 'completed'):
-            return
+    def stream_message(self, text: str) -> Iterator[RunStreamEvent]:
+        """Send a message to the thread, and stream the run's output.
+
+        The created message is saved with the run_id as soon as the run is
+        created, and yielded as a `message` event. The assistant's messages
+        are saved when the run completes.
+
+        Args:
+            text (str): Text to send.
+
+        Yields:
+            RunStreamEvent: Events from the run. See
+                :py:meth:`openai.OpenAIWrapper.stream_run`.
+        """
+        message = openai.create_message(self.id, text)
+        self._logger.info(f'Message {message['id']} added to thread {self.id}')
 
-        def run_incomplete() -> bool:
-            run_status = openai.get_run_status(run_id, self.id)
-            self._logger.info(f'Run status: {run_status}')
-            return run_status in ['queued', 'in_progress', 'cancelling']
+        run_id = run_status = ''
+        for event in openai.stream_run(self.assistant_id, self.id):
+            if event['event'] == 'run':
+                run_status = event['data']['status']
+                if not run_id:
+                    run_id = event['data']['id']
+                    self._logger.info(f'{run_id} created in {self.id}')
+
+                    message['run_id'] = run_id
+                    messages_dao.save([message])
+                    self._set_sent(message)
+                    yield RunStreamEvent(event='message', data=message)
+                elif run_status != 'completed':
+                    _set_run_status(run_id, self.id, run_status)
+            elif event['event'] == 'messages' and run_status == 'completed':
+                response: list[Message] = event['data']
+                for response_message in response:
+                    response_message['run_id'] = run_id
+
+                self._logger.info('Saving %d responses.', len(response))
+                messages_dao.save(response)
+                _set_run_status(run_id, self.id, 'completed')
+            elif event['event'] == 'messages':
+                self._logger.warning('Run %s ended with status %s',
+                                     run_id, run_status)
+
+            yield event
 
-        self._logger.debug(f'Awaiting completion of run [{run_id}]')
-        end = start = time.time()
+    def _get_saved_response(self, run_id: str) -> Optional[list[Message]]:
+        return messages_dao.find_by_run_id_and_role(run_id, 'assistant')
 
-        while run_incomplete() and (end - start) < max_wait_sec:
-            self._logger.info(f'Waiting {wait_delay} seconds')
-            time.sleep(wait_delay)
-            end = time.time()
+    def _save_response(self, run_id: str,
+                       user_message_id: str) -> list[Message]:
+        messages = self.get_messages(after=user_message_id, sort='asc')
+        for message in messages:
+            # Messages of other runs, sent to the thread since, keep theirs.
+            message['run_id'] = message['run_id'] or run_id
 
-        if (end - start) > max_wait_sec:
-            redis.write(f'{run_id}:status', 'timeout')
+        # Some of the messages may have been saved by a thread sync already.
+        saved = messages_dao.save_new(messages)
+        self._logger.info('Response for %s retrieved, %d messages saved',
+                          user_message_id, len(saved))
+        self._logger.debug('Response: %s', payload(messages))
+
+        return messages
+
+    def _on_run_done(self, run_id: str, user_message_id: str,
+                     run_status: str) -> list[Message]:
+        if run_status == 'timeout':
+            _set_run_status(run_id, self.id, 'timeout')
             raise RuntimeError(
-                f'Run not completed after {max_wait_sec} seconds')
+                f'Run not completed after {MAX_WAIT_SEC} seconds')
+        if run_status != 'completed':
+            _set_run_status(run_id, self.id, run_status)
+            raise RunFailedError(f'Run {run_id} ended with status {run_status}')
 
         self._logger.debug('Run completed: %s', run_id)
-        redis.write(f'{run_id}:status', 'completed')
+        response = self._save_response(run_id, user_message_id)
+        _set_run_status(run_id, self.id, 'completed')
+        return response
 
-    def _get_saved_response(self, run_id: str) -> Optional[list[Message]]:
-        return messages_dao.find_by_run_id_and_role(run_id, 'assistant')
+    def watch_response(self, run_id: str,
+                       user_message_id: str) -> Future[list[Message]]:
+        """Saves the response from the run, once the run is complete.
 
-    def _await_run_completion_and_get_response(
-            self, run_id: str, user_message_id: str) -> list[Message]:
-        self._await_run_completion(run_id)
+        The run is polled by the run watcher, so no thread is blocked while
+        the run is in progress.
 
-        messages = self.get_messages(before=user_message_id)
+        Args:
+            run_id (str): Run ID for which to save messages.
+            user_message_id (str): ID of the message that started the run.
 
-        response: list[Message] = []
-        for message in messages:
-            if not messages_dao.find({'id': message['id']}):
-                message['run_id'] = run_id
-                response.append(message)
+        Returns:
+            Future: Resolved with the list of messages from the run.
+        """
+        # Check if the run was previously completed.
+        run_status = redis.read(f'{run_id}:status')
+        if run_status == 'completed':
+            app = current_app._get_current_object()  # type: ignore
 
-        self._logger.info(f'Saving {len(response)} responses.')
-        messages_dao.save(response)
+            def save_in_context() -> list[Message]:
+                with app.app_context():
+                    return self._save_response(run_id, user_message_id)
 
-        self._logger.info('Response for %s retrieved', user_message_id)
-        self._logger.info(response)
+            # Concurrent requests for the same run share one save.
+            return background_task_executor.execute_concurrently(
+                save_in_context, dedup_key=f'save_response:{run_id}')
 
-        return response
+        _renew_lease(run_id)
+        return get_run_watcher().watch(
+            run_id, self.id,
+            partial(self._on_run_done, run_id, user_message_id),
+            on_status=partial(_set_run_status, run_id, self.id),
+            on_check=partial(_renew_lease, run_id))
 
     def get_response(self, run_id: str, user_message_id: str) -> list[Message]:
         """Get response messages from the run, after the given message ID.
@@ -195,8 +314,68 @@ class AssistantThread:
         self._logger.info('Retrieving response for %s', user_message_id)
 
         return self._get_saved_response(run_id) \
-            or self._await_run_completion_and_get_response(
-                run_id, user_message_id)
+            or self.watch_response(run_id, user_message_id).result(
+                timeout=MAX_WAIT_SEC + 5)
+
+    def wait_for_response(
+            self, run_id: str, user_message_id: str, timeout: float,
+            collect: Optional[Callable[[], Any]] = None
+    ) -> Optional[list[Message]]:
+        """Get response messages from the run, once they are saved.
+
+        Unlike :py:meth:`get_response`, the run is not watched: this waits
+        up to `timeout` seconds for the process collecting the response to
+        publish that the run is done, so no call is made to OpenAI. If no
+        process is watching the run, e.g. as the one collecting its response
+        was stopped, it is collected again first.
+
+        Args:
+            run_id (str): Run ID for which to get messages.
+            user_message_id (str): ID of the message that started the run.
+            timeout (float): Seconds to wait for the run.
+            collect (Callable[[], Any]): Has the response collected, if the
+                run is not watched. By default, it is watched here.
+
+        Returns:
+            List of messages from the run, or None if it is not done yet.
+        """
+        saved = self._get_saved_response(run_id)
+        if saved:
+            return saved
+
+        run_events = get_run_events()
+        done = run_events.subscribe(run_id)
+        try:
+            # The run may have been done before subscribing.
+            status = redis.read(f'{run_id}:status')
+            if status not in TERMINAL_STATUSES:
+                if claim_run(run_id):
+                    self._logger.warning('Run %s is not watched', run_id)
+                    (collect or partial(self.watch_response, run_id,
+                                        user_message_id))()
+                status = done.result(timeout=timeout)
+        except TimeoutError:
+            status = None
+        finally:
+            run_events.unsubscribe(run_id, done)
+
+        if status is None:
+            return None
+        return self.response_of(run_id, user_message_id, status)
+
+    def response_of(self, run_id: str, user_message_id: str,
+                    run_status: str) -> list[Message]:
+        """Returns the saved response of a run that is done."""
+        if run_status == 'timeout':
+            raise RuntimeError(
+                f'Run not completed after {MAX_WAIT_SEC} seconds')
+        if run_status != 'completed':
+            raise RunFailedError(f'Run {run_id} ended with status {run_status}')
+
+        # A thread sync may have saved the messages without their run id.
+        return self._get_saved_response(run_id) \
+            or self.watch_response(run_id, user_message_id).result(
+                timeout=MAX_WAIT_SEC + 5)
 
     def get_messages(
             self, *,
@@ -218,3 +397,80 @@ class AssistantThread:
                                         sort=sort)
         self._logger.info(f'{len(messages)} messages retrieved')
         return messages
+
+    def _synced_through(self) -> Optional[str]:
+        """Id of the last message synced, up to which all the messages of
+        the thread are saved."""
+        results = mongodb.find('threads', {'id': self.id},
+                               {'synced_through': 1}, limit=1)
+        return results[0].get('synced_through') if results else None
+
+    def _sync_messages(self) -> None:
+        """Saves the messages created in OpenAI that are not saved yet.
+
+        The thread is read oldest first, page by page, from the last message
+        synced, or from its start on its first sync: the messages saved when
+        sent or answered can be newer than messages that are not saved.
+
+        Messages that are still being written by a run are not saved, and end
+        the sync; they are saved when the run completes.
+        """
+        synced_through = after = self._synced_through()
+        saved = 0
+        while True:
+            messages = openai.list_messages(self.id,
+                                            after=after,
+                                            limit=SYNC_PAGE_SIZE,
+                                            sort='asc',
+                                            completed_only=True)
+            saved += len(messages_dao.save_new(messages))
+            if messages:
+                after = messages[-1]['id']
+            if len(messages) < SYNC_PAGE_SIZE:
+                break
+
+        if after != synced_through:
+            mongodb.set_fields('threads', {'id': self.id},
+                               {'synced_through': after})
+        redis.write(f'synced:{self.id}', time.time(),
+                    ttl=get_policy('synced')['ttl'])
+        self._logger.info(f'{saved} messages synced for {self.id}')
+
+    def _may_be_stale(self) -> bool:
+        synced_at = redis.read(f'synced:{self.id}')
+        return not synced_at \
+            or time.time() - float(synced_at) > THREAD_SYNC_INTERVAL_SEC
+
+    def get_history(
+            self, *,
+            before: Optional[str] = None,
+            after: Optional[str] = None,
+            limit: Optional[int] = None,
+            sort: Optional[Literal['asc', 'desc']] = 'desc') -> list[Message]:
+        """Get messages for the thread from the local store.
+
+        Messages newer than the last saved message are fetched from OpenAI
+        first, if the thread was not synced in the last
+        `THREAD_SYNC_INTERVAL_SEC` seconds. A page whose cursor is not a
+        saved message is read from OpenAI.
+
+        For details of args, refer :py:meth:`openai.OpenAIWrapper.list_messages`.
+        """
+        # Messages buffered for write-behind are not in the local store yet.
+        messages_dao.flush()
+        if self._may_be_stale():
+            self._sync_messages()
+
+        limit = min(int(limit or 20), 100)
+        try:
+            messages = messages_dao.find_page(self.id,
+                                              before=before,
+                                              after=after,
+                                              limit=limit,
+                                              sort=sort or 'desc')
+        except messages_dao.CursorNotFoundError as e:
+            self._logger.info(f'{e}, reading the page from OpenAI')
+            return self.get_messages(before=before, after=after, limit=limit,
+                                     sort=sort)
+        self._logger.info(f'{len(messages)} messages read')
+        return messages
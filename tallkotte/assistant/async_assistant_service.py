@@ -0,0 +1,228 @@
+from ..clients import get_client
+from ..datastore.async_cachedstore import AsyncCachedStore
+from ..datastore.mongodb.mongo_query import MongoQueryBuilder
+from ..datastore.redisdb.async_redisdb import get_async_redis
+from .assistant_service import collect_response
+from .assistant_thread import (
+    RUN_LEASE_TTL_SEC,
+    AssistantThread,
+    Thread,
+    run_lease_key,
+    sent_records,
+)
+from .constants import RESPONSE_QUEUE_ENABLED, RESPONSE_WAIT_MAX_SEC
+from .dao import assistants_dao, async_messages_dao
+from .openai.async_openai_wrapper import get_async_openai
+from .openai.datatypes.assistant import Assistant, to_assistant
+from .openai.datatypes.message import Message
+from .openai.datatypes.run import Run
+from .run_events import TERMINAL_STATUSES, get_run_events
+from .run_watcher import MAX_WAIT_SEC
+from .thread_events import run_event
+from quart import current_app, g
+from typing import Any, Callable, Literal, Optional, TypeVar
+
+import asyncio
+import logging
+
+__all__ = [
+    'AsyncAssistantService',
+    'get_async_assistant',
+    'run_sync',
+]
+
+R = TypeVar('R')
+
+_logger = logging.getLogger(__name__)
+
+
+async def run_sync(fn: Callable[..., R], *args: Any) -> R:
+    """Runs sync code of the Flask app in a worker thread, in its app context.
+
+    For calls without an async implementation, which are short, or do not
+    wait on OpenAI.
+    """
+    flask_app = current_app.extensions['flask_app']
+
+    def call() -> R:
+        with flask_app.app_context():
+            return fn(*args)
+
+    return await asyncio.to_thread(call)
+
+
+def _assistants() -> AsyncCachedStore[Assistant]:
+    return get_client('async_assistants', lambda: AsyncCachedStore[Assistant](
+        'assistants', to_assistant))
+
+
+def _threads() -> AsyncCachedStore[Thread]:
+    return get_client('async_threads', lambda: AsyncCachedStore[Thread](
+        'threads', lambda thread_map: Thread(**thread_map)))
+
+
+def _first(result: Optional[list[Any]] | Optional[Any]) -> Optional[Any]:
+    return result[0] if isinstance(result, list) else result
+
+
+class AsyncAssistantService:
+    """Async counterpart of :py:class:`AssistantService`, for the async API.
+
+    Calls to OpenAI, MongoDB and Redis are awaited on the event loop, so a
+    request waiting on them does not hold a thread. Runs are still polled by
+    the run watcher, whose futures are awaited.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, state: Assistant) -> None:
+        self._state = state
+
+    @classmethod
+    async def load(cls, assistant_id: str) -> 'AsyncAssistantService':
+        state = _first(await _assistants().read(
+            assistant_id, assistants_dao.has_id(assistant_id)))
+        if not state:
+            state = await get_async_openai().retrieve_assistant(assistant_id)
+            await _assistants().upsert(assistant_id, state,
+                                       assistants_dao.has_id(assistant_id))
+        return cls(state)
+
+    @property
+    def state(self) -> Assistant:
+        return self._state
+
+    @property
+    def id(self) -> str:
+        return self._state['id']
+
+    @property
+    def active_thread(self) -> str:
+        return self._state['active_thread']
+
+    async def get_thread(self, thread_id: str = '') -> Thread:
+        """Returns the active or specified thread."""
+        thread_id = thread_id or self.active_thread
+        if not thread_id:
+            raise ValueError(f'No thread found with id: {thread_id}')
+
+        thread = _first(await _threads().read(
+            thread_id, MongoQueryBuilder(id=thread_id).build()))
+        if thread:
+            return thread
+
+        openai_thread = await get_async_openai().retrieve_thread(thread_id)
+        thread = Thread(id=openai_thread.id,
+                        assistant_id=self.id,
+                        created_at=openai_thread.created_at)
+        await _threads().write_one(thread)
+        self._logger.info('Thread saved: %s', thread['id'])
+        return thread
+
+    async def send_message(self, text: str, thread_id: str = '') -> Message:
+        """Sends the message, like :py:meth:`AssistantService.send_message`."""
+        thread = await self.get_thread(thread_id)
+        openai = get_async_openai()
+
+        message = await openai.create_message(thread['id'], text)
+        run = await openai.create_run(self.id, thread['id'])
+        message['run_id'] = run['id']
+        self._logger.info(f'{run['id']} created in {thread['id']}')
+
+        await async_messages_dao.save([message])
+        await get_async_redis().write_many(*sent_records(message))
+        await get_async_redis().publish(
+            *run_event(run['id'], thread['id'], 'created'))
+
+        await run_sync(lambda: collect_response(
+            AssistantThread(self.id, thread['id']), message))
+        return message
+
+    async def get_messages(
+            self,
+            thread_id: str = '',
+            *,
+            after: Optional[str] = None,
+            before: Optional[str] = None,
+            limit: Optional[int] = 20,
+            sort: Optional[Literal['asc', 'desc']] = 'desc') -> list[Message]:
+        """Reads a page of messages of the thread from OpenAI."""
+        thread = await self.get_thread(thread_id)
+        return await get_async_openai().list_messages(
+            thread['id'], after=after, before=before, limit=limit, sort=sort)
+
+    async def get_run(self, run_id: str) -> Run:
+        return await get_async_openai().retrieve_run(run_id,
+                                                     self.active_thread)
+
+    async def get_response(
+            self, message_id: str,
+            wait: Optional[float] = None) -> Optional[list[Message]]:
+        """Returns the response to the message, waiting for its run to
+        complete, like :py:meth:`AssistantService.get_response`."""
+        message = await async_messages_dao.find_by_id(message_id)
+        if not message:
+            raise ValueError(f'No message found with id: {message_id}')
+        if message['role'] != 'user':
+            raise ValueError(f'Message is not from user: {message_id}')
+        if not message['run_id']:
+            raise ValueError(f'Message has no run_id: {message_id}')
+
+        run_id = message['run_id']
+        saved = await async_messages_dao.find_by_run_id_and_role(
+            run_id, 'assistant')
+        if saved:
+            return saved
+        if wait is None and RESPONSE_QUEUE_ENABLED:
+            # Not watched here, as a response worker collects it.
+            wait = RESPONSE_WAIT_MAX_SEC
+        if wait is not None:
+            return await self._wait_for_response(
+                message, min(max(wait, 0), RESPONSE_WAIT_MAX_SEC))
+
+        future = await run_sync(lambda: AssistantThread(
+            self.id, message['thread_id']).watch_response(run_id, message_id))
+        # Shielded, as the future is shared by every request for the run.
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                      timeout=MAX_WAIT_SEC + 5)
+
+    async def _claim_run(self, run_id: str) -> bool:
+        """Takes the lease of the run, like :py:func:`claim_run`."""
+        return bool(await get_async_redis().connection.set(
+            run_lease_key(run_id), 1, nx=True, ex=RUN_LEASE_TTL_SEC))
+
+    async def _wait_for_response(self, message: Message,
+                                 timeout: float) -> Optional[list[Message]]:
+        """Waits for the run of the message to be published as done, like
+        :py:meth:`AssistantThread.wait_for_response`, without holding a
+        thread."""
+        run_id = message['run_id']
+        run_events = await run_sync(get_run_events)
+        # Only waits the first time, for the subscription to be confirmed.
+        done = await run_sync(run_events.subscribe, run_id)
+        try:
+            status = await get_async_redis().read(f'{run_id}:status')
+            if status not in TERMINAL_STATUSES:
+                if await self._claim_run(run_id):
+                    self._logger.warning(f'Run {run_id} is not watched')
+                    await run_sync(lambda: collect_response(AssistantThread(
+                        self.id, message['thread_id']), message))
+                status = await asyncio.wait_for(asyncio.wrap_future(done),
+                                                timeout=timeout)
+        except asyncio.TimeoutError:
+            status = None
+        finally:
+            run_events.unsubscribe(run_id, done)
+
+        if status is None:
+            return None
+        return await run_sync(lambda: AssistantThread(
+            self.id, message['thread_id']).response_of(
+                run_id, message['id'], status))
+
+
+async def get_async_assistant() -> AsyncAssistantService:
+    if 'assistant' not in g:
+        assistant_id = current_app.config['ASSISTANT_ID']  # type: ignore
+        g.assistant = await AsyncAssistantService.load(assistant_id)
+    return g.assistant
@@ -0,0 +1,128 @@
+from ..clients import get_client
+from ..datastore.redisdb.async_redisdb import AsyncRedisDB, get_async_redis
+from .thread_events import THREAD_EVENTS_CHANNEL, ThreadEvent
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import asyncio
+import json
+import logging
+
+__all__ = [
+    'AsyncThreadEvents',
+    'get_thread_events',
+]
+
+# Events kept for a subscriber that is not reading them. Older ones are
+# dropped.
+THREAD_EVENTS_QUEUE_SIZE = 100
+
+# How long a subscriber waits for the subscription to be confirmed.
+_SUBSCRIBE_TIMEOUT_SEC = 5
+
+
+class AsyncThreadEvents:
+    """Relays the events published on `thread_events:{thread_id}` to the
+    subscribers of the thread in this process, such as WebSockets.
+
+    The process has a single pattern subscription, read by one task on the
+    event loop, however many threads and subscribers there are. Each
+    subscriber has a queue of up to `queue_size` events; one that falls
+    behind loses the oldest. If the subscription is lost, subscribers get a
+    `resync` event once it is back, as events may have been missed.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, redis: AsyncRedisDB,
+                 queue_size: int = THREAD_EVENTS_QUEUE_SIZE) -> None:
+        self._redis = redis
+        self._queue_size = queue_size
+        self._subscribers: dict[str, set[asyncio.Queue[str]]] = {}
+        self._subscribed = asyncio.Event()
+        self._listener: Optional[asyncio.Task[None]] = None
+
+    @property
+    def subscribers(self) -> int:
+        return sum(map(len, self._subscribers.values()))
+
+    @asynccontextmanager
+    async def subscribe(self, thread_id: str) -> AsyncIterator[asyncio.Queue[str]]:
+        """Yields a queue of the thread's events, as JSON
+        :py:class:`ThreadEvent`, until the context exits.
+
+        Events published before the subscription are not received, so the
+        thread should be read after subscribing.
+        """
+        queue: asyncio.Queue[str] = asyncio.Queue(self._queue_size)
+        self._subscribers.setdefault(thread_id, set()).add(queue)
+        try:
+            self._start_listener()
+            try:
+                await asyncio.wait_for(self._subscribed.wait(),
+                                       _SUBSCRIBE_TIMEOUT_SEC)
+            except asyncio.TimeoutError:
+                self._logger.warning('Thread events subscription not '
+                                     'confirmed')
+            yield queue
+        finally:
+            queues = self._subscribers.get(thread_id, set())
+            queues.discard(queue)
+            if not queues:
+                self._subscribers.pop(thread_id, None)
+
+    async def close(self) -> None:
+        if self._listener:
+            self._listener.cancel()
+
+    def _relay(self, thread_id: Optional[str], event: str) -> None:
+        """Queues the event for the subscribers of the thread, or all of
+        them."""
+        if thread_id is None:
+            queues = [queue for queues in self._subscribers.values()
+                      for queue in queues]
+        else:
+            queues = list(self._subscribers.get(thread_id, ()))
+
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def _start_listener(self) -> None:
+        if self._listener and not self._listener.done():
+            return
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        prefix = f'{THREAD_EVENTS_CHANNEL}:'
+        resync = json.dumps(ThreadEvent(event='resync', data=None))
+        lost = False
+        while True:
+            pubsub = self._redis.connection.pubsub()
+            try:
+                await pubsub.psubscribe(f'{prefix}*')
+                async for message in pubsub.listen():
+                    if message['type'] == 'psubscribe':
+                        if lost:
+                            self._relay(None, resync)
+                            lost = False
+                        self._subscribed.set()
+                    elif message['type'] == 'pmessage':
+                        self._relay(message['channel'].removeprefix(prefix),
+                                    message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._logger.error(f'Thread events subscription lost: {e}')
+                self._subscribed.clear()
+                lost = True
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()  # type: ignore[attr-defined]
+
+
+def get_thread_events() -> AsyncThreadEvents:
+    redis = get_async_redis()
+    return get_client('async_thread_events',
+                      lambda: AsyncThreadEvents(redis))
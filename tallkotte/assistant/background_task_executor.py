@@ -1,12 +1,244 @@
-from typing import Any, Callable
-import concurrent.futures
+from ..clients import get_client
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Literal, Optional
 
-MAX_WORKERS = 5
+import logging
+import os
+import threading
+import time
 
+__all__ = [
+    'BackgroundTaskExecutor',
+    'RejectedTaskError',
+    'execute_concurrently',
+    'get_executor',
+]
 
-_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
+MAX_WORKERS = int(os.environ.get('BACKGROUND_MAX_WORKERS', 5))
+# Tasks waiting for a worker, beyond which the rejection policy applies.
+MAX_QUEUE = int(os.environ.get('BACKGROUND_MAX_QUEUE', 100))
+REJECTION_POLICY = os.environ.get('BACKGROUND_REJECTION_POLICY', 'block')
+# With the `block` policy, how long to wait for room before rejecting.
+BLOCK_TIMEOUT_SEC = float(os.environ.get('BACKGROUND_BLOCK_TIMEOUT_SEC', 5))
 
+RejectionPolicy = Literal['block', 'reject', 'caller_runs']
 
-def execute_concurrently(
-        func: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
-    _executor.submit(func, *args, **kwargs)
+
+class RejectedTaskError(RuntimeError):
+    """The task was not accepted, as the queue is full."""
+
+
+class _Timing:
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            'avg': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+        }
+
+
+class BackgroundTaskExecutor:
+    """Thread pool with a bounded queue, and deduplication of tasks by key.
+
+    When `max_queue` tasks are waiting, new tasks are handled according to
+    `rejection_policy`: `block` waits up to `block_timeout` for room, then
+    rejects; `reject` raises `RejectedTaskError` right away; `caller_runs`
+    runs the task in the submitting thread, which slows the caller down.
+
+    A task submitted with the key of a task that is queued or running is not
+    submitted again; the future of the existing task is returned.
+
+    Exceptions raised by tasks are logged, and set on their futures.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self,
+                 max_workers: int = MAX_WORKERS,
+                 max_queue: int = MAX_QUEUE,
+                 rejection_policy: RejectionPolicy = 'block',
+                 block_timeout: float = BLOCK_TIMEOUT_SEC) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='background')
+        self._max_workers = max_workers
+        self._rejection_policy = rejection_policy
+        self._block_timeout = block_timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+
+        self._lock = threading.Lock()
+        self._tasks: dict[str, Future[Any]] = {}
+        self._queued = 0
+        self._running = 0
+        self._counts = {'submitted': 0, 'completed': 0, 'failed': 0,
+                        'rejected': 0, 'deduplicated': 0, 'caller_runs': 0}
+        self._wait = _Timing()
+        self._run = _Timing()
+
+    def _acquire_slot(self, rejection_policy: RejectionPolicy) -> bool:
+        """Returns whether the task can be queued; False to run it here."""
+        if self._slots.acquire(blocking=False):
+            return True
+
+        if rejection_policy == 'caller_runs':
+            return False
+        if rejection_policy == 'block' \
+                and self._slots.acquire(timeout=self._block_timeout):
+            return True
+
+        with self._lock:
+            self._counts['rejected'] += 1
+        raise RejectedTaskError(
+            f'Background queue is full ({self._queued} tasks queued)')
+
+    def submit(self,
+               func: Callable[..., Any],
+               *args: Any,
+               dedup_key: Optional[str] = None,
+               **kwargs: Any) -> Future[Any]:
+        return self._submit(self._rejection_policy, func, args, kwargs,
+                            dedup_key)
+
+    def try_submit(self,
+                   func: Callable[..., Any],
+                   *args: Any,
+                   dedup_key: Optional[str] = None,
+                   **kwargs: Any) -> Future[Any]:
+        """Submits the task if there is room, whatever the rejection policy:
+        the calling thread is neither blocked nor used to run the task.
+
+        Raises:
+            RejectedTaskError: If the queue is full.
+        """
+        return self._submit('reject', func, args, kwargs, dedup_key)
+
+    def _submit(self,
+                rejection_policy: RejectionPolicy,
+                func: Callable[..., Any],
+                args: tuple[Any, ...],
+                kwargs: dict[str, Any],
+                dedup_key: Optional[str]) -> Future[Any]:
+        existing = self._find(dedup_key)
+        if existing:
+            return existing
+
+        queued = self._acquire_slot(rejection_policy)
+        future: Future[Any] = Future()
+        with self._lock:
+            # Checked again, as the slot may have been waited for.
+            existing = self._find(dedup_key, locked=True)
+            if existing:
+                if queued:
+                    self._slots.release()
+                return existing
+
+            self._counts['submitted'] += 1
+            if queued:
+                self._queued += 1
+            else:
+                self._counts['caller_runs'] += 1
+            if dedup_key:
+                self._tasks[dedup_key] = future
+
+        if dedup_key:
+            future.add_done_callback(
+                lambda _: self._forget(dedup_key, future))
+
+        if queued:
+            self._executor.submit(self._run_task, future, time.monotonic(),
+                                  func, args, kwargs)
+        else:
+            self._run_task(future, time.monotonic(), func, args, kwargs,
+                           queued=False)
+        return future
+
+    def _find(self, dedup_key: Optional[str],
+              locked: bool = False) -> Optional[Future[Any]]:
+        if not dedup_key:
+            return None
+        if not locked:
+            with self._lock:
+                return self._find(dedup_key, locked=True)
+
+        future = self._tasks.get(dedup_key)
+        if future is not None:
+            self._counts['deduplicated'] += 1
+        return future
+
+    def _forget(self, dedup_key: str, future: Future[Any]) -> None:
+        with self._lock:
+            if self._tasks.get(dedup_key) is future:
+                del self._tasks[dedup_key]
+
+    def _run_task(self,
+                  future: Future[Any],
+                  submitted_at: float,
+                  func: Callable[..., Any],
+                  args: tuple[Any, ...],
+                  kwargs: dict[str, Any],
+                  queued: bool = True) -> None:
+        started_at = time.monotonic()
+        with self._lock:
+            if queued:
+                self._queued -= 1
+            self._running += 1
+            self._wait.add(started_at - submitted_at)
+
+        failed = False
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            failed = True
+            name = getattr(func, '__name__', repr(func))
+            self._logger.error(f'Background task {name} failed: {e}')
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._counts['failed' if failed else 'completed'] += 1
+                self._run.add(time.monotonic() - started_at)
+            if queued:
+                self._slots.release()
+
+    def stats(self) -> dict[str, Any]:
+        """Queue depth, task counts, and wait and run times in seconds."""
+        with self._lock:
+            return {
+                'workers': self._max_workers,
+                'queued': self._queued,
+                'running': self._running,
+                **self._counts,
+                'wait_sec': self._wait.as_dict(),
+                'run_sec': self._run.as_dict(),
+            }
+
+
+def get_executor() -> BackgroundTaskExecutor:
+    return get_client('background_task_executor', lambda: BackgroundTaskExecutor(
+        rejection_policy=REJECTION_POLICY))  # type: ignore[arg-type]
+
+
+def execute_concurrently(func: Callable[..., Any],
+                         *args: Any,
+                         dedup_key: Optional[str] = None,
+                         **kwargs: Any) -> Future[Any]:
+    """Runs the function in the background.
+
+    See :py:class:`BackgroundTaskExecutor`.
+
+    Returns:
+        Future: Resolved with the result of the function.
+
+    Raises:
+        RejectedTaskError: If the queue is full.
+    """
+    return get_executor().submit(func, *args, dedup_key=dedup_key, **kwargs)
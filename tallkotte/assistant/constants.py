@@ -5,10 +5,34 @@ __all__ = [
     'ASSISTANT_DESCRIPTION',
     'ASSISTANT_INSTRUCTION',
     'ASSISTANT_TOOLS',
-    'ASSISTANT_INIT_MESSAGE'
+    'ASSISTANT_INIT_MESSAGE',
+    'THREAD_SYNC_INTERVAL_SEC',
+    'RESPONSE_QUEUE_ENABLED',
+    'RESPONSE_JOB_CLAIM_IDLE_SEC',
+    'RESPONSE_JOB_MAX_ATTEMPTS',
+    'RESPONSE_WORKER_CONCURRENCY',
+    'RESPONSE_WAIT_MAX_SEC',
 ]
 
 ASSISTANT_NAME: str = os.environ.get('ASSISTANT_NAME', "Tallkotte")
+# Messages of a thread are fetched from OpenAI at most once in this interval.
+THREAD_SYNC_INTERVAL_SEC: int = int(
+    os.environ.get('THREAD_SYNC_INTERVAL_SEC', 30))
+# Responses are collected by `flask worker` processes, from a Redis queue.
+RESPONSE_QUEUE_ENABLED: bool = os.environ.get(
+    'RESPONSE_QUEUE_ENABLED', 'false').lower() == 'true'
+# A job not acknowledged in this time is taken over by another worker. Must be
+# longer than a run can be watched for.
+RESPONSE_JOB_CLAIM_IDLE_SEC: int = int(
+    os.environ.get('RESPONSE_JOB_CLAIM_IDLE_SEC', 120))
+RESPONSE_JOB_MAX_ATTEMPTS: int = int(
+    os.environ.get('RESPONSE_JOB_MAX_ATTEMPTS', 3))
+# Runs watched at the same time by a worker process.
+RESPONSE_WORKER_CONCURRENCY: int = int(
+    os.environ.get('RESPONSE_WORKER_CONCURRENCY', 20))
+# Longest a request may wait for a response with `?wait=`. Should be shorter
+# than the timeouts of proxies in front of the app.
+RESPONSE_WAIT_MAX_SEC: int = int(os.environ.get('RESPONSE_WAIT_MAX_SEC', 30))
 ASSISTANT_DESCRIPTION: str = """Pyyne CV Assistant is a bot that helps you 
 review CVs."""
 ASSISTANT_INSTRUCTION: str = """You are a CV reviewer.
@@ -1,28 +1,45 @@
 from ...datastore.cachedstore import CachedStore
+from ...logs import payload
 from ...datastore.mongodb.mongo_query import MongoQuery, MongoQueryBuilder
+from ...datastore.mongodb.mongo_wrapper import MongoDB, get_mongo
 from ..openai.datatypes.assistant import Assistant, to_assistant
 from openai.types.beta.assistant import Assistant as OpenAiAssistant
 from typing import Optional
 
 import logging
 
+_logger = logging.getLogger(__name__)
+
 cached_store = CachedStore[Assistant]('assistants', to_assistant)
+mongodb: MongoDB[Assistant] = get_mongo()
 
 
-def _has_id(id: str) -> MongoQuery:
-    return MongoQueryBuilder(id=id).build()
+def has_id(id: str) -> MongoQuery:
+    query = MongoQueryBuilder(id=id).build()
+    query['projection'] = {'threads': 0}
+    return query
 
 
 def save(assistant: Assistant | OpenAiAssistant) -> Assistant:
     if isinstance(assistant, OpenAiAssistant):
         assistant = to_assistant(assistant)
 
-    logging.info(f'save: {assistant['id']} -> {assistant}')
-    cached_store.upsert(assistant['id'], assistant, _has_id(assistant['id']))
+    _logger.debug('save: %s -> %s', assistant['id'], payload(assistant))
+    cached_store.upsert(assistant['id'], assistant, has_id(assistant['id']))
     return assistant
 
 
 def get(assistant_id: str) -> Optional[Assistant]:
-    result = cached_store.read(assistant_id, _has_id(assistant_id))
+    result = cached_store.read(assistant_id, has_id(assistant_id))
     if result:
         return result[0] if isinstance(result, list) else result
+
+
+def set_active_thread(assistant_id: str, thread_id: str) -> None:
+    """Sets the active thread, without rewriting the rest of the assistant."""
+    if not mongodb.set_fields('assistants', {'id': assistant_id},
+                              {'active_thread': thread_id}):
+        raise ValueError(f'No assistant found with id: {assistant_id}')
+
+    cached_store.invalidate(assistant_id)
+    _logger.info('Active thread of %s: %s', assistant_id, thread_id)
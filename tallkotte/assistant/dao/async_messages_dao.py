@@ -0,0 +1,73 @@
+from ...clients import get_client
+from ...datastore.async_cachedstore import AsyncCachedStore
+from ...datastore.mongodb.async_mongo_wrapper import get_async_mongo
+from ...datastore.mongodb.mongo_query import mongo_query
+from ...datastore.redisdb.async_redisdb import get_async_redis
+from ...datastore.sorted_cache import AsyncSortedCache
+from ..openai.datatypes.message import Message
+from ..thread_events import message_events
+from . import messages_dao
+from typing import Literal
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def _cached_store() -> AsyncCachedStore[Message]:
+    return get_client('async_messages', lambda: AsyncCachedStore[Message](
+        'messages', messages_dao.to_message))
+
+
+def _thread_cache() -> AsyncSortedCache[Message]:
+    redis = get_async_redis(binary=True)
+    return get_client('async_thread_messages', lambda: AsyncSortedCache(
+        messages_dao.thread_cache, redis.connection))
+
+
+async def save(messages: list[Message]) -> list[str]:
+    """Saves the messages, like :py:func:`messages_dao.save`.
+
+    Messages are always written before returning; write-behind only applies
+    to the sync API.
+    """
+    messages_dao.set_seq(messages)
+    try:
+        inserted = await get_async_mongo().insert_missing(
+            'messages', messages, overwrite=messages_dao.SENT_FIELDS)
+    except Exception as e:
+        _logger.error(f'Error while saving messages: {e}')
+        raise RuntimeError('Error while saving messages') from e
+
+    await _cached_store().invalidate(*messages_dao.cached_keys(messages))
+    thread_cache = _thread_cache()
+    for thread_id, thread_messages in messages_dao.by_thread(messages).items():
+        await thread_cache.append(thread_id, thread_messages)
+    try:
+        await get_async_redis().publish_many(message_events(messages))
+    except Exception as e:
+        _logger.warning(f'Messages not published: {e}')
+
+    _logger.debug('%d of %d messages inserted', len(inserted), len(messages))
+    return [messages[i]['id'] for i in inserted]
+
+
+async def find_by_id(message_id: str) -> Message | None:
+    result = await _cached_store().read(message_id,
+                                        mongo_query(filter={'id': message_id}))
+    if result:
+        if isinstance(result, list):
+            return result[0]
+        return result
+
+
+async def find_by_run_id_and_role(
+        run_id: str, role: Literal['user', 'assistant']) -> list[Message]:
+    query = mongo_query(filter={
+        '$and': [
+            {'run_id': run_id},
+            {'role': role}
+        ]
+    })
+    result = await _cached_store().read(f'run:{run_id}:role:{role}', query)
+    return messages_dao._as_list(result)
@@ -0,0 +1,52 @@
+from ...datastore.cachedstore import CachedStore
+from ...datastore.mongodb.mongo_query import mongo_query
+from ...datastore.mongodb.mongo_wrapper import MongoDB, get_mongo
+from typing import Any, Mapping, Optional, TypedDict
+
+import logging
+
+
+class UploadedFile(TypedDict):
+    # OpenAI file ID
+    id: str
+    sha256: str
+    filename: str
+    bytes: int
+
+
+def _to_uploaded_file(document: Mapping[str, Any]) -> UploadedFile:
+    return UploadedFile(
+        id=document['id'],
+        sha256=document['sha256'],
+        filename=document['filename'],
+        bytes=document['bytes'],
+    )
+
+
+cached_store = CachedStore[UploadedFile](
+    'files', _to_uploaded_file, id_mapper=lambda file: file['sha256'])
+mongodb: MongoDB[UploadedFile] = get_mongo()
+
+
+def find_by_hash(sha256: str) -> Optional[UploadedFile]:
+    result = cached_store.read(sha256, mongo_query(filter={'sha256': sha256}))
+    if result:
+        return result[0] if isinstance(result, list) else result
+
+
+def find_by_hashes(hashes: list[str]) -> dict[str, Optional[UploadedFile]]:
+    return cached_store.read_many(
+        hashes, lambda missing: mongo_query(filter={'sha256': {'$in': missing}}))
+
+
+def save(file: UploadedFile) -> bool:
+    """Saves the file, unless a file with the same content is saved already.
+
+    Returns:
+        bool: Whether the file was saved.
+    """
+    inserted = mongodb.insert_missing('files', [file], key='sha256')
+    cached_store.invalidate(file['sha256'])
+    if not inserted:
+        logging.warning(f'File {file['id']} is a duplicate of a saved file')
+    return bool(inserted)
@@ -1,23 +1,25 @@
 from ...datastore.cachedstore import CachedStore
 from ...datastore.mongodb.mongo_wrapper import get_mongo, MongoDB
 from ...datastore.mongodb.mongo_query import mongo_query
+from ...datastore.mongodb.write_behind import WriteBehindBuffer, get_write_behind
+from ...datastore.redisdb.redisdb import get_redis
+from ...datastore.sorted_cache import SortedCache
 from ..openai.datatypes.message import Message
+from ..thread_events import message_events
 from flask import current_app
 from typing import Any, Literal, Mapping, Optional
 
+import logging
+import time
 
-def _to_message(message_document: Message) -> Message:
-    return Message(
-        id=message_document['id'],
-        role=message_document['role'],
-        created_at=message_document['created_at'],
-        run_id=message_document['run_id'],
-        thread_id=message_document['thread_id'],
-        content=message_document['content']
-    )
+_logger = logging.getLogger(__name__)
+
+
+class CursorNotFoundError(ValueError):
+    """A message used as a page cursor is not saved."""
 
 
-def _convert_to_message(message_dict: dict[str, Any] | Mapping[str, Any]) -> Message:
+def to_message(message_dict: dict[str, Any] | Mapping[str, Any]) -> Message:
     return Message(
         id=message_dict['id'],
         role=message_dict['role'],
@@ -28,17 +30,149 @@ def _convert_to_message(message_dict: dict[str, Any] | Mapping[str, Any]) -> Mes
     )
 
 
-cached_store = CachedStore[Message]('messages', _convert_to_message)
+# Fields of a sent message set by `save`, even if a sync saved it first. The
+# sequence is set too, as the message is added to its thread's cache with it.
+SENT_FIELDS = ('run_id', 'seq')
+
+cached_store = CachedStore[Message]('messages', to_message)
 mongodb: MongoDB[Message] = get_mongo()
 
+# Latest messages of each thread, for paged reads.
+thread_cache = SortedCache[Message](
+    'thread_messages',
+    score=lambda message: message['created_at'],
+    tiebreak=lambda message: message.get('seq', 0),
+    max_length=int(current_app.config['CACHE_THREAD_MESSAGES_MAX']))  # type: ignore
+
+
+def set_seq(messages: list[Message]) -> None:
+    """Sets the sequence of the messages that have none.
+
+    OpenAI orders messages created in the same second in the order they are
+    created, which `created_at` does not record. Messages are sequenced in
+    the order they are saved, and in the order given, which is the order
+    OpenAI lists them in, oldest first. Pages sort on (created_at, seq).
+    """
+    first = time.time_ns()
+    for i, message in enumerate(messages):
+        message.setdefault('seq', first + i)
+
+
+def cached_keys(messages: list[Message]) -> set[str]:
+    """Keys of the cached lookups, including misses, that the messages
+    change."""
+    keys: set[str] = set()
+    for message in messages:
+        keys.add(message['id'])
+        if message['run_id']:
+            keys.add(message['run_id'])
+            keys.add(f'run:{message['run_id']}:role:{message['role']}')
+    return keys
+
+
+def _invalidate_cached(messages: list[Message]) -> None:
+    cached_store.invalidate(*cached_keys(messages))
+
+
+def by_thread(messages: list[Message]) -> dict[str, list[Message]]:
+    grouped: dict[str, list[Message]] = {}
+    for message in messages:
+        grouped.setdefault(message['thread_id'], []).append(message)
+    return grouped
+
+
+def _append_to_threads(messages: list[Message]) -> None:
+    for thread_id, thread_messages in by_thread(messages).items():
+        thread_cache.append(thread_id, thread_messages)
+
+
+def _publish_to_threads(messages: list[Message]) -> None:
+    """Publishes the saved messages to the subscribers of their threads."""
+    if not messages:
+        return
+    try:
+        get_redis().publish_many(message_events(messages))
+    except Exception as e:
+        # Also called by the write-behind thread, outside the app context.
+        _logger.warning(f'Messages not published: {e}')
+
 
 def save(messages: list[Message]) -> list[str]:
+    """Saves the messages, setting the run id of those already saved.
+
+    A thread sync can save a sent message before it is saved with its run id,
+    so the messages are upserted by id.
+
+    With write-behind enabled, the messages are cached under their ids, and
+    buffered to be written in the background; lookups by run, and pages of
+    the thread, include them once they are written, and they are published
+    to the subscribers of the thread then.
+
+    Messages are given in the order OpenAI lists them, oldest first. See
+    :py:func:`set_seq`.
+
+    Returns:
+        list[str]: Ids of the messages that were not saved yet. Empty if
+            buffered.
+    """
+    set_seq(messages)
+    write_behind = _get_write_behind()
+    if write_behind:
+        _invalidate_cached(messages)
+        cached_store.cache_many(messages)
+        _append_to_threads(messages)
+        write_behind.add(messages)
+        current_app.logger.debug('%d messages buffered', len(messages))
+        return []
+
     try:
-        object_ids = mongodb.insert('messages', messages)
-        insert_ids = [str(id) for id in object_ids]
-        current_app.logger.info(
-            f'{len(insert_ids)} messages inserted: {insert_ids}')
-        return insert_ids
+        inserted = mongodb.insert_missing('messages', messages,
+                                          overwrite=SENT_FIELDS)
+        _invalidate_cached(messages)
+        _append_to_threads(messages)
+        _publish_to_threads(messages)
+        current_app.logger.debug('%d of %d messages inserted',
+                                 len(inserted), len(messages))
+        return [messages[i]['id'] for i in inserted]
+    except Exception as e:
+        current_app.logger.error(f'Error while saving messages: {e}')
+        raise RuntimeError('Error while saving messages') from e
+
+
+def _on_flush(messages: list[Message]) -> None:
+    """Runs once buffered messages are written."""
+    _invalidate_cached(messages)
+    _publish_to_threads(messages)
+
+
+def _get_write_behind() -> Optional[WriteBehindBuffer[Message]]:
+    return get_write_behind('messages', on_flush=_on_flush,
+                            overwrite=SENT_FIELDS)
+
+
+def flush() -> None:
+    """Writes the buffered messages, if write-behind is enabled."""
+    write_behind = _get_write_behind()
+    if write_behind and write_behind.pending:
+        write_behind.flush(raise_errors=True)
+
+
+def save_new(messages: list[Message]) -> list[Message]:
+    """Saves the messages that are not already saved, in the order OpenAI
+    lists them, oldest first.
+
+    Returns:
+        list[Message]: The messages that were saved.
+    """
+    set_seq(messages)
+    try:
+        inserted = mongodb.insert_missing('messages', messages)
+        _invalidate_cached([messages[i] for i in inserted])
+        _append_to_threads([messages[i] for i in inserted])
+        _publish_to_threads([messages[i] for i in inserted])
+        current_app.logger.debug('%d of %d messages inserted',
+                                 len(inserted), len(messages))
+        return [messages[i] for i in inserted]
     except Exception as e:
         current_app.logger.error(f'Error while saving messages: {e}')
         raise RuntimeError('Error while saving messages') from e
@@ -49,7 +183,96 @@ def find(filter: Optional[dict[str, Any]] = None,
          sort: Optional[dict[str, Any]] = None,
          limit: Optional[int] = None) -> list[Message]:
     result = mongodb.find('messages', filter, projection, sort, limit)
-    return [_to_message(document) for document in result]
+    return [to_message(document) for document in result]
+
+
+def _cursor_filter(message_id: str, operator: Literal['$lt', '$gt']) -> dict[str, Any]:
+    """Filter for messages before or after the given message.
+
+    Messages are ordered by `created_at`, and by `seq` for messages created
+    in the same second.
+    """
+    cursor = mongodb.find('messages', {'id': message_id},
+                          {'created_at': 1, 'seq': 1}, limit=1)
+    if not cursor:
+        raise CursorNotFoundError(f'No message found with id: {message_id}')
+
+    created_at, seq = cursor[0]['created_at'], cursor[0].get('seq', 0)
+    return {'$or': [
+        {'created_at': {operator: created_at}},
+        {'created_at': created_at, 'seq': {operator: seq}},
+    ]}
+
+
+def _fill_thread_cache(thread_id: str) -> None:
+    latest = mongodb.find('messages', {'thread_id': thread_id},
+                          sort={'created_at': -1, 'seq': -1},
+                          limit=thread_cache.max_length)
+    thread_cache.fill(thread_id, latest,
+                      truncated=len(latest) == thread_cache.max_length)
+
+
+def find_page(thread_id: str,
+              *,
+              after: Optional[str] = None,
+              before: Optional[str] = None,
+              limit: int = 20,
+              sort: Literal['asc', 'desc'] = 'desc') -> list[Message]:
+    """Finds a page of messages in a thread.
+
+    `after` and `before` are message IDs, with the same semantics as in
+    :py:meth:`openai.OpenAIWrapper.list_messages`.
+
+    Pages within the latest `CACHE_THREAD_MESSAGES_MAX` messages are read
+    from the thread's cache, which is filled from the DB on first read.
+
+    Raises:
+        CursorNotFoundError: If `after` or `before` is not a saved message.
+    """
+    def read_cached() -> Optional[list[Any]]:
+        return thread_cache.page(thread_id, after=after, before=before,
+                                 limit=limit, sort=sort)
+
+    cached = read_cached()
+    if cached is None and not thread_cache.is_filled(thread_id):
+        _fill_thread_cache(thread_id)
+        cached = read_cached()
+    if cached is not None:
+        return [to_message(message) for message in cached]
+
+    return _find_page_in_db(thread_id, after=after, before=before,
+                            limit=limit, sort=sort)
+
+
+def _find_page_in_db(thread_id: str,
+                     *,
+                     after: Optional[str],
+                     before: Optional[str],
+                     limit: int,
+                     sort: Literal['asc', 'desc']) -> list[Message]:
+    later, earlier = '$gt', '$lt'
+    if sort == 'desc':
+        later, earlier = earlier, later
+
+    conditions: list[dict[str, Any]] = [{'thread_id': thread_id}]
+    if after:
+        conditions.append(_cursor_filter(after, later))  # type: ignore
+    if before:
+        conditions.append(_cursor_filter(before, earlier))  # type: ignore
+
+    # A page before the cursor is the one adjacent to it, so it is read in
+    # reverse order.
+    reverse = bool(before and not after)
+    direction = -1 if sort == 'desc' else 1
+    if reverse:
+        direction = -direction
+
+    result = mongodb.find('messages', {'$and': conditions},
+                          sort={'created_at': direction, 'seq': direction},
+                          limit=limit)
+    if reverse:
+        result.reverse()
+    return [to_message(document) for document in result]
 
 
 def find_by_id(message_id: str) -> Message | None:
@@ -81,7 +304,7 @@ def find_by_run_id_and_role(
     query = mongo_query(filter={
         '$and': [
             {'run_id': run_id},
-            {'role': 'assistant'}
+            {'role': role}
         ]
     })
     results = cached_store.read(f'run:{run_id}:role:{role}', query)
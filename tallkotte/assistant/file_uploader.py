@@ -0,0 +1,81 @@
+from ..clients import get_client
+from .dao import files_dao
+from .dao.files_dao import UploadedFile
+from .openai.openai_wrapper import get_openai
+from concurrent.futures import Future, ThreadPoolExecutor
+from flask import current_app
+from typing import IO
+
+import hashlib
+import logging
+
+__all__ = [
+    'upload_files',
+]
+
+_logger = logging.getLogger(__name__)
+
+openai = get_openai()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    max_uploads = int(current_app.config['OPENAI_MAX_UPLOADS'])  # type: ignore
+    return get_client('upload_executor', lambda: ThreadPoolExecutor(
+        max_workers=max_uploads, thread_name_prefix='upload'))
+
+
+def _upload(sha256: str, filename: str, stream: IO[bytes]) -> str:
+    stream.seek(0)
+    file = openai.upload_file(stream, filename)
+    if not files_dao.save(UploadedFile(id=file.id, sha256=sha256,
+                                       filename=filename, bytes=file.bytes)):
+        # Uploaded concurrently by another request.
+        saved = files_dao.find_by_hash(sha256)
+        if saved:
+            return saved['id']
+    return file.id
+
+
+def upload_files(files: list[tuple[str, IO[bytes]]]) -> list[str]:
+    """Uploads the files to OpenAI, at most `OPENAI_MAX_UPLOADS` at a time.
+
+    Files are identified by the SHA-256 of their content. A file that was
+    uploaded before is not uploaded again, and its existing file ID is used.
+
+    Args:
+        files (list[tuple[str, IO[bytes]]]): File names, and seekable streams
+            of their content.
+
+    Returns:
+        list[str]: OpenAI file IDs, in the order of `files`.
+    """
+    if not files:
+        return []
+
+    hashes = [hashlib.file_digest(stream, 'sha256').hexdigest()  # type: ignore
+              for _, stream in files]
+
+    file_ids: dict[str, str | Future[str]] = {}
+    executor = _get_executor()
+    app = current_app._get_current_object()  # type: ignore
+
+    def upload_in_context(*args: str | IO[bytes]) -> str:
+        with app.app_context():
+            return _upload(*args)  # type: ignore
+
+    uploaded = files_dao.find_by_hashes(list(set(hashes)))
+    for sha256, (filename, stream) in zip(hashes, files):
+        if sha256 in file_ids:
+            continue
+        saved = uploaded[sha256]
+        if saved:
+            _logger.info(f'{filename} was uploaded as {saved['id']}')
+            file_ids[sha256] = saved['id']
+        else:
+            file_ids[sha256] = executor.submit(
+                upload_in_context, sha256, filename, stream)
+
+    return [
+        file_id.result() if isinstance(file_id, Future) else file_id
+        for file_id in (file_ids[sha256] for sha256 in hashes)
+    ]
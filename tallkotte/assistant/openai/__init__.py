@@ -7,8 +7,22 @@ __all__ = [
 
 OPENAI_API_KEY: str = os.environ.get('OPENAI_API_KEY', '')
 OPENAI_MODEL: str = os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo')
+OPENAI_MAX_CONNECTIONS: int = int(
+    os.environ.get('OPENAI_MAX_CONNECTIONS', 20))
+# Files uploaded at the same time, per process.
+OPENAI_MAX_UPLOADS: int = int(os.environ.get('OPENAI_MAX_UPLOADS', 4))
+# Records the calls to OpenAI to this file, or replays them from it.
+OPENAI_CASSETTE: str = os.environ.get('OPENAI_CASSETTE', '')
+OPENAI_CASSETTE_MODE: str = os.environ.get('OPENAI_CASSETTE_MODE', 'replay')
+OPENAI_CASSETTE_LATENCY_SCALE: float = float(
+    os.environ.get('OPENAI_CASSETTE_LATENCY_SCALE', 1.0))
 
 openai_config = {
     'OPENAI_API_KEY': OPENAI_API_KEY,
     'OPENAI_MODEL': OPENAI_MODEL,
+    'OPENAI_MAX_CONNECTIONS': OPENAI_MAX_CONNECTIONS,
+    'OPENAI_MAX_UPLOADS': OPENAI_MAX_UPLOADS,
+    'OPENAI_CASSETTE': OPENAI_CASSETTE,
+    'OPENAI_CASSETTE_MODE': OPENAI_CASSETTE_MODE,
+    'OPENAI_CASSETTE_LATENCY_SCALE': OPENAI_CASSETTE_LATENCY_SCALE,
 }
@@ -0,0 +1,133 @@
+from .datatypes.assistant import Assistant, to_assistant
+from .datatypes.message import Message
+from .datatypes.run import Run
+from . import converters
+from .cassette import Cassette, get_cassette
+from ...clients import get_client
+from ...metrics import timed
+from openai import AsyncOpenAI
+from openai.types.beta import Thread
+from quart import current_app
+from typing import Literal, Optional
+import httpx
+import logging
+
+__all__ = [
+    'AsyncOpenAIWrapper',
+    'get_async_openai',
+]
+
+
+class AsyncOpenAIWrapper:
+    """Async counterpart of :py:class:`OpenAIWrapper`, on `AsyncOpenAI`.
+
+    Only has the calls made by the async API.
+    """
+
+    _logger: logging.Logger = logging.getLogger(__name__)
+    _client: AsyncOpenAI
+
+    def __init__(self, api_key: str, model: str,
+                 max_connections: int = 20,
+                 cassette: Optional[Cassette] = None) -> None:
+        if not api_key:
+            raise ValueError('OPENAI API key is required.')
+
+        self._model = model
+
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_connections)
+        transport: httpx.AsyncBaseTransport = httpx.AsyncHTTPTransport(
+            limits=limits)
+        if cassette:
+            transport = cassette.async_transport(transport)
+        self._client = AsyncOpenAI(
+            api_key=api_key,
+            http_client=httpx.AsyncClient(transport=transport))
+        self._logger.info(f"Client initialized")
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        return self._client
+
+    @property
+    def threads(self):
+        return self.client.beta.threads
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    @timed('openai')
+    async def retrieve_assistant(self, assistant_id: str) -> Assistant:
+        assistant = await self.client.beta.assistants.retrieve(assistant_id)
+        return to_assistant(assistant)
+
+    @timed('openai')
+    async def retrieve_thread(self, thread_id: str) -> Thread:
+        return await self.threads.retrieve(thread_id)
+
+    @timed('openai')
+    async def create_message(self, thread_id: str, text: str) -> Message:
+        message = await self.threads.messages.create(
+            thread_id=thread_id, content=text, role='user')
+        self._logger.info('Message %s created in thread %s',
+                          message.id, thread_id)
+        return converters.to_message(message)
+
+    @timed('openai')
+    async def create_run(self,
+                         assistant_id: str,
+                         thread_id: str,
+                         instructions: str = '') -> Run:
+        run = await self.threads.runs.create(assistant_id=assistant_id,
+                                             thread_id=thread_id,
+                                             instructions=instructions)
+        self._logger.info('Run %s created in thread %s', run.id, thread_id)
+        return converters.to_run(run)
+
+    @timed('openai')
+    async def retrieve_run(self, run_id: str, thread_id: str) -> Run:
+        run = await self.threads.runs.retrieve(
+            run_id=run_id, thread_id=thread_id)
+        self._logger.debug('Run %s: %s', run_id, run.status)
+        return converters.to_run(run)
+
+    @timed('openai')
+    async def list_messages(
+            self,
+            thread: str,
+            *,
+            after: Optional[str] = None,
+            before: Optional[str] = None,
+            limit: Optional[int] = None,
+            sort: Optional[Literal['asc', 'desc']] = None) -> list[Message]:
+        """Retrieves a page of messages from a thread.
+
+        See :py:meth:`OpenAIWrapper.list_messages`.
+        """
+        list_args: dict[str, str | int] = {'thread_id': thread}
+        if after:
+            list_args['after'] = after
+        if before:
+            list_args['before'] = before
+        if limit:
+            list_args['limit'] = limit
+        if sort:
+            list_args['order'] = sort
+
+        page = await self.threads.messages.list(**list_args)  # type: ignore
+        self._logger.debug('%d messages retrieved [%s]',
+                           len(page.data), list_args)
+        return [converters.to_message(message) for message in page.data]
+
+
+def get_async_openai() -> AsyncOpenAIWrapper:
+    """Returns the process-wide async OpenAI client."""
+    config = current_app.config
+
+    return get_client('async_openai', lambda: AsyncOpenAIWrapper(
+        api_key=config['OPENAI_API_KEY'],  # type: ignore
+        model=config['OPENAI_MODEL'],  # type: ignore
+        max_connections=config['OPENAI_MAX_CONNECTIONS'],  # type: ignore
+        cassette=get_cassette(config),
+    ))
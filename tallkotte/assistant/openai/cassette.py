@@ -0,0 +1,319 @@
+from ...clients import get_client
+from collections import deque
+from typing import (
+    Any, AsyncIterator, Iterator, Literal, Mapping, Optional, TypedDict
+)
+from urllib.parse import urlencode
+
+import asyncio
+import httpx
+import json
+import logging
+import threading
+import time
+
+__all__ = [
+    'Cassette',
+    'CassetteError',
+    'Interaction',
+    'get_cassette',
+]
+
+CassetteMode = Literal['record', 'replay']
+
+# Response headers kept in the cassette. Others, such as the content length
+# and encoding, don't apply to the replayed body.
+_KEPT_HEADERS = ('content-type', 'openai-processing-ms', 'x-request-id')
+
+
+class CassetteError(Exception):
+    """A request has no recorded response."""
+
+
+class Interaction(TypedDict):
+    method: str
+    # Path and sorted query, without the host.
+    url: str
+    # JSON request body. File uploads are not kept.
+    request: Optional[str]
+    status: int
+    headers: dict[str, str]
+    response: str
+    # Seconds from sending the request to reading the whole response.
+    elapsed: float
+    recorded_at: float
+
+
+def _request_url(request: httpx.Request) -> str:
+    query = sorted(request.url.params.multi_items())
+    return request.url.path + (f'?{urlencode(query)}' if query else '')
+
+
+def _key(method: str, url: str) -> str:
+    return f'{method} {url}'
+
+
+class Cassette:
+    """Requests made to OpenAI, and their responses, in a JSON Lines file.
+
+    In `record` mode, each response is appended to the file, with the time it
+    took. In `replay` mode, requests are answered from the file, without
+    calling OpenAI. The responses to the same method and URL are served in
+    the order they were recorded, and the last one is repeated after that,
+    e.g. the final status of a polled run. Each is served after its recorded
+    latency, multiplied by `latency_scale`: 1 to replay at the recorded
+    speed, 0.1 ten times faster, 0 without waiting.
+
+    Responses are recorded as they are read, so streamed ones still reach the
+    client as they arrive, and are written to the file once the client has
+    read them to the end. They are replayed as a whole.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, path: str, mode: CassetteMode = 'replay',
+                 latency_scale: float = 1.0) -> None:
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'Unknown cassette mode: {mode}')
+
+        self._path = path
+        self._mode = mode
+        self._latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._queued: dict[str, deque[Interaction]] = {}
+        self._last: dict[str, Interaction] = {}
+
+        if mode == 'replay':
+            with open(path) as file:
+                for line in file:
+                    if line.strip():
+                        interaction: Interaction = json.loads(line)
+                        self._queued.setdefault(
+                            _key(interaction['method'], interaction['url']),
+                            deque()).append(interaction)
+            self._logger.info(f'Replaying OpenAI from {path}: '
+                              f'{sum(map(len, self._queued.values()))} '
+                              f'responses')
+        else:
+            self._logger.info(f'Recording OpenAI to {path}')
+
+    @property
+    def mode(self) -> CassetteMode:
+        return self._mode
+
+    def record(self, request: httpx.Request, response: httpx.Response,
+               content: bytes, elapsed: float) -> None:
+        """Appends the response to the file.
+
+        Args:
+            request (httpx.Request): Request sent.
+            response (httpx.Response): Response, whose body is not read.
+            content (bytes): Body of the response, as received.
+            elapsed (float): Seconds from sending the request to reading the
+                whole response.
+        """
+        is_json = request.headers.get('content-type', '').startswith(
+            'application/json')
+        # Decoded according to the content encoding of the response.
+        body = httpx.Response(response.status_code, headers=response.headers,
+                              content=content)
+        interaction = Interaction(
+            method=request.method,
+            url=_request_url(request),
+            request=(request.content.decode() or None) if is_json else None,
+            status=response.status_code,
+            headers={name: response.headers[name]
+                     for name in _KEPT_HEADERS if name in response.headers},
+            response=body.text,
+            elapsed=round(elapsed, 6),
+            recorded_at=time.time())
+        line = json.dumps(interaction) + '\n'
+        with self._lock:
+            with open(self._path, 'a') as file:
+                file.write(line)
+
+    def play(self, request: httpx.Request) -> Interaction:
+        """Returns the next recorded response to the request."""
+        key = _key(request.method, _request_url(request))
+        with self._lock:
+            queued = self._queued.get(key)
+            if queued:
+                self._last[key] = queued.popleft()
+            elif key not in self._last:
+                raise CassetteError(f'No recorded response for {key}')
+            return self._last[key]
+
+    def delay(self, interaction: Interaction) -> float:
+        return interaction['elapsed'] * self._latency_scale
+
+    @staticmethod
+    def to_response(request: httpx.Request,
+                    interaction: Interaction) -> httpx.Response:
+        return httpx.Response(interaction['status'],
+                              headers=interaction['headers'],
+                              content=interaction['response'].encode(),
+                              request=request)
+
+    def transport(self, transport: httpx.BaseTransport) -> httpx.BaseTransport:
+        """Wraps the transport of a client, to record or replay its calls."""
+        return _CassetteTransport(self, transport)
+
+    def async_transport(
+            self,
+            transport: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+        """Like `transport`, for async clients."""
+        return _AsyncCassetteTransport(self, transport)
+
+
+def _with_stream(request: httpx.Request, response: httpx.Response,
+                 stream: httpx.SyncByteStream | httpx.AsyncByteStream
+                 ) -> httpx.Response:
+    """The response, with its stream replaced by one recording it."""
+    return httpx.Response(response.status_code,
+                          headers=response.headers,
+                          stream=stream,
+                          extensions=response.extensions,
+                          request=request)
+
+
+class _Recording:
+    """Body of a response being read, recorded once it is read to the end."""
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, cassette: Cassette, request: httpx.Request,
+                 response: httpx.Response, started_at: float) -> None:
+        self._cassette = cassette
+        self._request = request
+        self._response = response
+        self._started_at = started_at
+        self._chunks: list[bytes] = []
+        self.complete = False
+        self._finished = False
+
+    def add(self, chunk: bytes) -> None:
+        self._chunks.append(chunk)
+
+    def finish(self) -> None:
+        """Records the response, if it was read to the end. Called once it
+        is closed."""
+        if self._finished:
+            return
+        self._finished = True
+        if not self.complete:
+            self._logger.warning(
+                f'Response to {self._request.method} '
+                f'{_request_url(self._request)} closed before its end, not '
+                f'recorded')
+            return
+        self._cassette.record(self._request, self._response,
+                              b''.join(self._chunks),
+                              time.perf_counter() - self._started_at)
+
+
+class _RecordingStream(httpx.SyncByteStream):
+
+    def __init__(self, stream: httpx.SyncByteStream,
+                 recording: _Recording) -> None:
+        self._stream = stream
+        self._recording = recording
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._stream:
+            self._recording.add(chunk)
+            yield chunk
+        self._recording.complete = True
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._recording.finish()
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+
+    def __init__(self, stream: httpx.AsyncByteStream,
+                 recording: _Recording) -> None:
+        self._stream = stream
+        self._recording = recording
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self._recording.add(chunk)
+            yield chunk
+        self._recording.complete = True
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            # Appending a line to the file is short enough to do on the loop.
+            self._recording.finish()
+
+
+class _CassetteTransport(httpx.BaseTransport):
+
+    def __init__(self, cassette: Cassette,
+                 transport: httpx.BaseTransport) -> None:
+        self._cassette = cassette
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self._cassette.mode == 'replay':
+            interaction = self._cassette.play(request)
+            time.sleep(self._cassette.delay(interaction))
+            return Cassette.to_response(request, interaction)
+
+        started_at = time.perf_counter()
+        response = self._transport.handle_request(request)
+        recording = _Recording(self._cassette, request, response, started_at)
+        return _with_stream(
+            request, response,
+            _RecordingStream(response.stream,  # type: ignore[arg-type]
+                             recording))
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class _AsyncCassetteTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self, cassette: Cassette,
+                 transport: httpx.AsyncBaseTransport) -> None:
+        self._cassette = cassette
+        self._transport = transport
+
+    async def handle_async_request(self,
+                                   request: httpx.Request) -> httpx.Response:
+        if self._cassette.mode == 'replay':
+            interaction = self._cassette.play(request)
+            await asyncio.sleep(self._cassette.delay(interaction))
+            return Cassette.to_response(request, interaction)
+
+        started_at = time.perf_counter()
+        response = await self._transport.handle_async_request(request)
+        recording = _Recording(self._cassette, request, response, started_at)
+        return _with_stream(
+            request, response,
+            _AsyncRecordingStream(response.stream,  # type: ignore[arg-type]
+                                  recording))
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def get_cassette(config: Mapping[str, Any]) -> Optional[Cassette]:
+    """Returns the process-wide cassette, if `OPENAI_CASSETTE` is set.
+
+    The sync and async clients share it, so each recorded response is
+    replayed once.
+    """
+    path: str = config['OPENAI_CASSETTE']
+    if not path:
+        return None
+
+    return get_client('openai_cassette', lambda: Cassette(
+        path,
+        mode=config['OPENAI_CASSETTE_MODE'],
+        latency_scale=float(config['OPENAI_CASSETTE_LATENCY_SCALE'])))
@@ -20,7 +20,7 @@ def to_message(message: ThreadMessage) -> Message:
         'id': message.id,
         'role': message.role,
         'created_at': message.created_at,
-        'run_id': '',
+        'run_id': message.run_id or '',
         'thread_id': message.thread_id,
         'content': message_content
     }
@@ -2,7 +2,6 @@ from openai.types.beta.assistant import Assistant as OpenAiAssistant
 from typing import Any, Mapping, Optional, TypedDict, Union
 
 import json
-import logging
 
 
 class Assistant(TypedDict):
@@ -11,7 +10,6 @@ class Assistant(TypedDict):
     name: str | None
     instructions: str | None
     tools: list[str]
-    threads: list[str]
     active_thread: str
 
 
@@ -42,22 +40,17 @@ def to_assistant(convert_from: OpenAiAssistant | dict[str, Any] | Mapping[str, A
 
 
 def _from_openai_assistant(openai_assistant: OpenAiAssistant) -> Assistant:
-    logging.info(f'Converting from OpenAiAssistant: {openai_assistant}')
     assistant = Assistant(
         id=openai_assistant.id,
         name=openai_assistant.name,
         instructions=openai_assistant.instructions,
         tools=[tool.type for tool in openai_assistant.tools],
-        threads=[],
         active_thread=''
     )
-    logging.info(f'Created Assistant: {assistant}')
     return assistant
 
 
 def _from_dict(assistant_object: dict[str, Any] | Mapping[str, Any]) -> Assistant:
-    logging.info(f'Converting from {type(assistant_object)}: '
-                 f'{assistant_object}')
     assistant_attributes = {
         'id': assistant_object['id'],
         'name': assistant_object['name'],
@@ -65,13 +58,11 @@ def _from_dict(assistant_object: dict[str, Any] | Mapping[str, Any]) -> Assistan
         'tools': assistant_object['tools'],
     }
 
-    assistant_attributes['threads'] = assistant_object['threads'] \
-        if 'threads' in assistant_object \
-        else []
+    # Documents saved by earlier versions also have a `threads` list, which is
+    # not read; threads are listed from the threads collection.
     assistant_attributes['active_thread'] = assistant_object['active_thread'] \
         if 'active_thread' in assistant_object \
         else ''
 
     assistant = Assistant(**assistant_attributes)
-    logging.info(f'Created Assistant: {assistant}')
     return assistant
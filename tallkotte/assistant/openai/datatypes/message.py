@@ -1,4 +1,4 @@
-from typing import Dict, List, Literal, TypedDict, Union
+from typing import Dict, List, Literal, NotRequired, TypedDict, Union
 
 _Message = Dict[str, Union[str, int, List[str], None]]
 
@@ -10,3 +10,5 @@ class Message(TypedDict):
     run_id: str
     thread_id: str
     content: list[str]
+    # Order among the messages created in the same second, set when saved.
+    seq: NotRequired[int]
@@ -1,4 +1,4 @@
-from typing import TypedDict
+from typing import Any, Literal, TypedDict
 
 
 class Usage(TypedDict):
@@ -41,3 +41,17 @@ class Run(TypedDict):
     status: str
     thread_id: str
     usage: Usage | None
+
+
+class RunStreamEvent(TypedDict):
+    """An event relayed from a streaming run.
+
+    `event` is one of:
+        - `message`: The user message that started the run. `data` is a Message.
+        - `run`: The run changed state. `data` is a Run.
+        - `delta`: Text produced by the assistant. `data` is a str.
+        - `messages`: The messages produced by the run, sent once the run is
+            done. `data` is a list of Message.
+    """
+    event: Literal['message', 'run', 'delta', 'messages']
+    data: Any
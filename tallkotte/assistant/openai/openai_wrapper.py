@@ -1,14 +1,21 @@
 from .datatypes.assistant import Assistant, to_assistant
-from .datatypes.run import Run
+from .datatypes.run import Run, RunStreamEvent
 from . import converters
+from .cassette import Cassette, get_cassette
 from .datatypes.message import Message
-from flask import current_app, g
+from ...clients import get_client
+from ...logs import payload
+from ...metrics import timed
+from flask import current_app
 from openai import OpenAI
 from openai.types import FileObject
 from openai.types.beta import Thread
 from openai.types.beta.threads import Run as OpenAIRun
-from typing import Literal, Optional
+from openai.types.beta.threads.text_delta_block import TextDeltaBlock
+from typing import IO, Iterator, Literal, Optional
+import httpx
 import logging
+import os
 
 
 class OpenAIWrapper:
@@ -16,14 +23,22 @@ class OpenAIWrapper:
     _logger: logging.Logger = logging.getLogger(__name__)
     _client: OpenAI
 
-    def __init__(self, api_key: str, model: str) -> None:
+    def __init__(self, api_key: str, model: str,
+                 max_connections: int = 20,
+                 cassette: Optional[Cassette] = None) -> None:
         if not api_key:
             raise ValueError('OPENAI API key is required.')
 
         self._api_key = api_key
         self._model = model
 
-        self._client = OpenAI(api_key=self._api_key)
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_connections)
+        transport: httpx.BaseTransport = httpx.HTTPTransport(limits=limits)
+        if cassette:
+            transport = cassette.transport(transport)
+        self._client = OpenAI(api_key=self._api_key,
+                              http_client=httpx.Client(transport=transport))
         self._logger.info(f"Client initialized")
 
     @property
@@ -38,6 +53,7 @@ class OpenAIWrapper:
     def messages(self):
         return self.client.beta.threads.messages
 
+    @timed('openai')
     def create_assistant(self,
                          name: str,
                          description: str,
@@ -48,68 +64,110 @@ class OpenAIWrapper:
                                                        description=description,
                                                        instructions=instructions,
                                                        model=self._model)
-        self._logger.info(f'Assistant created: {assistant.id}')
+        self._logger.info('Assistant created: %s', assistant.id)
         return to_assistant(assistant)
 
+    @timed('openai')
     def retrieve_assistant(self, assistant_id: str) -> Assistant:
-        self._logger.info(f"Retrieving assistant [{assistant_id}]...")
         assistant = self.client.beta.assistants.retrieve(assistant_id)
-        self._logger.info(f"Assistant: {assistant}")
+        self._logger.debug('Assistant: %s', payload(assistant))
         return to_assistant(assistant)
 
-    def open_file(self, filename: str) -> FileObject:
-        file = self.client.files.create(
-            file=open(filename, "rb"),
+    @timed('openai')
+    def upload_file(self, file: IO[bytes], filename: str) -> FileObject:
+        """Uploads the file, streaming it from its current position."""
+        uploaded = self.client.files.create(
+            file=(filename, file),
             purpose='assistants'
         )
-        self._logger.info(f"File created: {file.id}")
-        return file
+        self._logger.info('File created: %s', uploaded.id)
+        return uploaded
+
+    def open_file(self, filename: str) -> FileObject:
+        with open(filename, "rb") as file:
+            return self.upload_file(file, os.path.basename(filename))
 
+    @timed('openai')
     def create_thread(
-            self, init_message: str, files: list[FileObject] = []) -> Thread:
+            self, init_message: str, file_ids: list[str] = []) -> Thread:
         self._logger.info("Creating thread")
         thread = self.threads.create(
             messages=[
                 {
                     "role": "user",
                     "content": init_message,
-                    "file_ids": [file.id for file in files]
+                    "file_ids": file_ids
                 }
             ]
         )
-        self._logger.info(f"Thread created: {thread.id}")
+        self._logger.info('Thread created: %s', thread.id)
         return thread
 
+    @timed('openai')
     def retrieve_thread(self, thread_id: str) -> Thread:
-        self._logger.info(f"Retrieving thread [{thread_id}]")
         thread = self.threads.retrieve(thread_id)
-        self._logger.info(f"Thread: {thread}")
+        self._logger.debug('Thread: %s', payload(thread))
         return thread
 
+    @timed('openai')
     def create_message(self, thread_id: str, text: str) -> Message:
-        self._logger.info(f"Creating message in thread {thread_id}: {text}")
         message = self.client.beta.threads.messages.create(
             thread_id=thread_id, content=text, role='user')
-        self._logger.info(f'Message ID: {message.id}')
+        self._logger.info('Message %s created in thread %s',
+                          message.id, thread_id)
         return converters.to_message(message)
 
+    @timed('openai')
     def create_run(self,
                    assistant_id: str,
                    thread_id: str,
                    instructions: str = '') -> Run:
-        self._logger.info(f'Creating run in thread {thread_id} '
-                          f'in assistant {assistant_id}')
         run = self.threads.runs.create(assistant_id=assistant_id,
                                        thread_id=thread_id,
                                        instructions=instructions)
-        self._logger.info(f"Run ID: {run.id}")
+        self._logger.info('Run %s created in thread %s', run.id, thread_id)
         return converters.to_run(run)
 
+    @timed('openai')
+    def stream_run(self,
+                   assistant_id: str,
+                   thread_id: str,
+                   instructions: str = '') -> Iterator[RunStreamEvent]:
+        """Creates a run, and yields its events as they are produced.
+
+        Run state changes are yielded as `run` events, and text generated by
+        the assistant as `delta` events. When the stream ends, a `messages`
+        event with the messages created by the run is yielded.
+        """
+        self._logger.info('Streaming run in thread %s in assistant %s',
+                          thread_id, assistant_id)
+        with self.threads.runs.create_and_stream(
+                assistant_id=assistant_id,
+                thread_id=thread_id,
+                instructions=instructions) as stream:
+            for event in stream:
+                if event.event == 'thread.message.delta':
+                    for content in event.data.delta.content or []:  # type: ignore
+                        if isinstance(content, TextDeltaBlock) \
+                                and content.text and content.text.value:
+                            yield RunStreamEvent(event='delta',
+                                                 data=content.text.value)
+                elif event.event.startswith('thread.run.') \
+                        and not event.event.startswith('thread.run.step.'):
+                    yield RunStreamEvent(event='run',
+                                         data=converters.to_run(event.data))  # type: ignore
+
+            messages = [
+                converters.to_message(message)
+                for message in stream.get_final_messages()
+            ]
+            yield RunStreamEvent(event='messages', data=messages)
+
+    @timed('openai')
     def retrieve_run(self, run_id: str, thread_id: str) -> Run:
-        self._logger.info(f'Retrieving run [{run_id}] in thread [{thread_id}]')
         run = self.threads.runs.retrieve(
             run_id=run_id, thread_id=thread_id)
-        self._logger.info(f'Run: {run}')
+        self._logger.debug('Run %s: %s', run_id, run.status)
         return converters.to_run(run)
 
     def get_run_status(self, run_id: str, thread_id: str) -> str:
@@ -135,12 +193,14 @@ class OpenAIWrapper:
             self._logger.debug(f'\ttotal_tokens: {usage.total_tokens}')
         self._logger.debug('=========================')
 
+    @timed('openai')
     def list_runs(self, thread_id: str) -> list[Run]:
         return [
             converters.to_run(run)
             for run in self.threads.runs.list(thread_id=thread_id)
         ]
 
+    @timed('openai')
     def list_messages(
             self,
             thread: str,
@@ -148,7 +208,8 @@ class OpenAIWrapper:
             after: Optional[str] = None,
             before: Optional[str] = None,
             limit: Optional[int] = None,
-            sort: Optional[Literal['asc', 'desc']] = None) -> list[Message]:
+            sort: Optional[Literal['asc', 'desc']] = None,
+            completed_only: bool = False) -> list[Message]:
         """
         Retrieve a list of messages from a thread.
 
@@ -174,6 +235,9 @@ class OpenAIWrapper:
                 timestamp of the objects. `asc` for ascending order and `desc` 
                 (the default) for descending order.
 
+            completed_only (bool, optional): Return only the messages before the
+                first message that is still being written by a run.
+
         Returns:
             list[Message]: Messages in the thread.
         """
@@ -187,25 +251,30 @@ class OpenAIWrapper:
         if sort:
             list_args['order'] = sort
 
-        self._logger.info(f"Retrieving messages [{list_args}]")
         try:
             message_list = self.messages.list(**list_args)  # type: ignore
 
-            print(message_list)
-
-            for message in message_list:
-                self._logger.info(message)
-            return [converters.to_message(message) for message in message_list]
+            messages: list[Message] = []
+            # The page only; iterating the list would read the next pages.
+            for message in message_list.data:
+                if completed_only and message.status == 'in_progress':
+                    break
+                messages.append(converters.to_message(message))
+            self._logger.debug('%d messages retrieved [%s]',
+                               len(messages), list_args)
+            return messages
         except Exception as e:
-            self._logger.error(f"Error retrieving messages: {e}")
+            self._logger.error('Error retrieving messages: %s', e)
             return []
 
 
 def get_openai() -> OpenAIWrapper:
-    if 'openai' not in g:
-        g.openai = OpenAIWrapper(
-            api_key=current_app.config['OPENAI_API_KEY'],  # type: ignore
-            model=current_app.config['OPENAI_MODEL'],  # type: ignore
-        )
-
-    return g.openai
+    """Returns the process-wide OpenAI client."""
+    config = current_app.config
+
+    return get_client('openai', lambda: OpenAIWrapper(
+        api_key=config['OPENAI_API_KEY'],  # type: ignore
+        model=config['OPENAI_MODEL'],  # type: ignore
+        max_connections=config['OPENAI_MAX_CONNECTIONS'],  # type: ignore
+        cassette=get_cassette(config),
+    ))
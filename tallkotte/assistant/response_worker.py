@@ -0,0 +1,174 @@
+from ..clients import get_client
+from ..datastore.redisdb.job_queue import Job, JobQueue
+from ..datastore.redisdb.redisdb import get_redis
+from .assistant_thread import AssistantThread, RunFailedError
+from .constants import (
+    RESPONSE_JOB_CLAIM_IDLE_SEC,
+    RESPONSE_JOB_MAX_ATTEMPTS,
+    RESPONSE_WORKER_CONCURRENCY,
+)
+from .dao import messages_dao
+from .run_watcher import INCOMPLETE_STATUSES
+from flask import current_app
+from flask.cli import with_appcontext
+from typing import Optional
+
+import click
+import logging
+import threading
+
+__all__ = [
+    'ResponseWorker',
+    'enqueue_response',
+    'get_response_queue',
+    'recover_runs',
+    'worker_command',
+]
+
+RESPONSE_QUEUE = 'jobs:collect_response'
+
+_logger = logging.getLogger(__name__)
+
+
+def get_response_queue() -> JobQueue:
+    redis = get_redis()
+    return get_client('response_queue', lambda: JobQueue(
+        redis,
+        RESPONSE_QUEUE,
+        claim_idle_sec=RESPONSE_JOB_CLAIM_IDLE_SEC,
+        max_attempts=RESPONSE_JOB_MAX_ATTEMPTS))
+
+
+def enqueue_response(run_id: str,
+                     thread_id: str,
+                     user_message_id: str) -> Optional[str]:
+    """Queues a job to save the response of the run, once it completes."""
+    return get_response_queue().enqueue(run_id, {
+        'run_id': run_id,
+        'thread_id': thread_id,
+        'user_message_id': user_message_id,
+    })
+
+
+def recover_runs() -> int:
+    """Queues jobs for the runs that were still in progress, according to
+    their `{run_id}:status` keys.
+
+    Jobs already queued for a run are not queued again, so this is safe to
+    run from every worker.
+
+    Returns:
+        int: Number of jobs queued.
+    """
+    redis = get_redis()
+    keys: list[str] = list(
+        redis.connection.scan_iter(match='*:status', count=1000))  # type: ignore
+    statuses = redis.read_many(keys)
+
+    queued = 0
+    for key, status in zip(keys, statuses):
+        if status not in INCOMPLETE_STATUSES + ['created']:
+            continue
+
+        run_id = key.removesuffix(':status')
+        user_messages = messages_dao.find_by_run_id_and_role(run_id, 'user')
+        if not user_messages:
+            _logger.warning(f'No message found for run {run_id}')
+            continue
+
+        message = user_messages[0]
+        if enqueue_response(run_id, message['thread_id'], message['id']):
+            queued += 1
+
+    _logger.info(f'{queued} of {len(keys)} runs recovered')
+    return queued
+
+
+class ResponseWorker:
+    """Receives response jobs, and watches their runs until they are done.
+
+    Runs are watched by the run watcher, so one process can watch
+    `concurrency` runs at a time. A job is acknowledged once the response
+    is saved, and retried if the run was not done in time, or its response
+    could not be saved.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self,
+                 queue: JobQueue,
+                 assistant_id: str,
+                 concurrency: int = RESPONSE_WORKER_CONCURRENCY) -> None:
+        self._queue = queue
+        self._assistant_id = assistant_id
+        self._concurrency = concurrency
+        self._slots = threading.Semaphore(concurrency)
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> None:
+        self._logger.info(f'Worker started, watching up to '
+                          f'{self._concurrency} runs')
+        while not self._stopped.is_set():
+            self._slots.acquire()
+            try:
+                jobs = self._queue.receive(count=1)
+            except Exception as e:
+                self._logger.error(f'Jobs not received: {e}')
+                jobs = []
+
+            if not jobs:
+                self._slots.release()
+                continue
+            self._start(jobs[0])
+
+    def _start(self, job: Job) -> None:
+        data = job['data']
+        self._logger.info(f'Collecting response of run {data['run_id']} '
+                          f'(attempt {job['attempts']})')
+        try:
+            thread = AssistantThread(self._assistant_id, data['thread_id'])
+            future = thread.watch_response(data['run_id'],
+                                           data['user_message_id'])
+        except Exception as e:
+            self._finish(job, e)
+            return
+
+        future.add_done_callback(
+            lambda future: self._finish(job, future.exception()))
+
+    def _finish(self, job: Job, error: Optional[BaseException]) -> None:
+        try:
+            if error is None:
+                self._queue.ack(job)
+            elif isinstance(error, RunFailedError):
+                self._queue.fail(job, str(error))
+            else:
+                self._queue.retry(job, str(error))
+        except Exception as e:
+            # Left pending, to be claimed again.
+            self._logger.error(f'Job {job['key']} not updated: {e}')
+        finally:
+            self._slots.release()
+
+
+@click.command('worker')
+@click.option('--concurrency', type=int, default=RESPONSE_WORKER_CONCURRENCY,
+              show_default=True, help='Runs watched at the same time.')
+@click.option('--recover/--no-recover', default=True,
+              help='Queue jobs for runs left in progress, at startup.')
+@with_appcontext
+def worker_command(concurrency: int, recover: bool) -> None:
+    """Collect run responses from the job queue."""
+    if recover:
+        recover_runs()
+
+    worker = ResponseWorker(get_response_queue(),
+                            current_app.config['ASSISTANT_ID'],  # type: ignore
+                            concurrency)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
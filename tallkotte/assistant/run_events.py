@@ -0,0 +1,127 @@
+from ..clients import get_client
+from ..datastore.redisdb.redisdb import RedisDB, get_redis
+from concurrent.futures import Future, InvalidStateError
+from typing import Optional
+
+import logging
+import threading
+import time
+
+__all__ = [
+    'RUN_DONE_CHANNEL',
+    'TERMINAL_STATUSES',
+    'RunEvents',
+    'get_run_events',
+]
+
+RUN_DONE_CHANNEL = 'run_done'
+
+# Statuses a run does not leave. `timeout` is set when the run watcher stops
+# watching a run.
+TERMINAL_STATUSES = ['completed', 'failed', 'cancelled', 'expired',
+                     'incomplete', 'timeout']
+
+# How long a waiter waits for the subscription to be confirmed.
+_SUBSCRIBE_TIMEOUT_SEC = 5
+
+
+class RunEvents:
+    """Completion events of runs, published on Redis.
+
+    The process that saves the response of a run publishes its final status
+    on `run_done:{run_id}`, so requests waiting for it, in any process,
+    return as soon as it is saved. Each process has a single pattern
+    subscription, read by one thread, which resolves the futures of the
+    requests waiting for the run.
+
+    If the subscription is lost, the waiting futures are resolved with None,
+    as events may have been missed.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, redis: RedisDB) -> None:
+        self._redis = redis
+        self._lock = threading.Lock()
+        self._waiters: dict[str, set[Future[Optional[str]]]] = {}
+        self._subscribed = threading.Event()
+        self._listener: Optional[threading.Thread] = None
+
+    def publish(self, run_id: str, status: str) -> None:
+        self._redis.publish(f'{RUN_DONE_CHANNEL}:{run_id}', status)
+
+    def subscribe(self, run_id: str) -> Future[Optional[str]]:
+        """Returns a future resolved with the final status of the run, once it
+        is published.
+
+        Events published before this call are not received, so the status of
+        the run should be checked after it. The future must be passed to
+        `unsubscribe` once it is no longer waited for.
+        """
+        future: Future[Optional[str]] = Future()
+        with self._lock:
+            self._waiters.setdefault(run_id, set()).add(future)
+        self._start_listener()
+        if not self._subscribed.wait(_SUBSCRIBE_TIMEOUT_SEC):
+            self._logger.warning('Run events subscription not confirmed')
+        return future
+
+    def unsubscribe(self, run_id: str, future: Future[Optional[str]]) -> None:
+        with self._lock:
+            waiters = self._waiters.get(run_id)
+            if waiters is None:
+                return
+            waiters.discard(future)
+            if not waiters:
+                del self._waiters[run_id]
+
+    def _resolve(self, run_id: Optional[str], status: Optional[str]) -> None:
+        """Resolves the futures waiting for the run, or all of them."""
+        with self._lock:
+            if run_id is None:
+                futures = [future for waiters in self._waiters.values()
+                           for future in waiters]
+            else:
+                futures = list(self._waiters.get(run_id, ()))
+
+        for future in futures:
+            try:
+                future.set_result(status)
+            except InvalidStateError:
+                # Cancelled by its waiter, or resolved already.
+                pass
+
+    def _start_listener(self) -> None:
+        if self._listener and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen,
+                                              name='run-events-listener',
+                                              daemon=True)
+            self._listener.start()
+
+    def _listen(self) -> None:
+        prefix = f'{RUN_DONE_CHANNEL}:'
+        while True:
+            try:
+                pubsub = self._redis.connection.pubsub()
+                pubsub.psubscribe(f'{prefix}*')
+                for message in pubsub.listen():
+                    if message['type'] == 'psubscribe':
+                        self._subscribed.set()
+                    elif message['type'] == 'pmessage':
+                        self._resolve(
+                            message['channel'].removeprefix(prefix),
+                            message['data'])
+            except Exception as e:
+                self._logger.error(f'Run events subscription lost: {e}')
+                self._subscribed.clear()
+                self._resolve(None, None)
+                time.sleep(1)
+
+
+def get_run_events() -> RunEvents:
+    redis = get_redis()
+    return get_client('run_events', lambda: RunEvents(redis))
@@ -0,0 +1,304 @@
+from . import background_task_executor
+from ..clients import get_client
+from .openai.openai_wrapper import get_openai
+from collections import deque
+from concurrent.futures import Future
+from flask import Flask, current_app, has_app_context
+from typing import Any, Callable, Optional
+
+import heapq
+import logging
+import random
+import statistics
+import threading
+import time
+
+__all__ = [
+    'RunWatcher',
+    'get_run_watcher',
+]
+
+INCOMPLETE_STATUSES = ['queued', 'in_progress', 'cancelling']
+
+MIN_DELAY_SEC = 0.5
+MAX_DELAY_SEC = 10.0
+MAX_WAIT_SEC = 60
+EXPECTED_RUN_DURATION_SEC = 5.0
+JITTER = 0.2
+# Times `on_done` is submitted to the background task executor, with
+# backoff, while its queue is full.
+DISPATCH_ATTEMPTS = 5
+
+
+class _PendingRun:
+
+    def __init__(self,
+                 run_id: str,
+                 thread_id: str,
+                 on_done: Callable[[str], Any],
+                 on_status: Optional[Callable[[str], Any]],
+                 on_check: Optional[Callable[[], Any]],
+                 app: Optional[Flask]) -> None:
+        self.run_id = run_id
+        self.thread_id = thread_id
+        self.on_done = on_done
+        self.on_status = on_status
+        self.on_check = on_check
+        self.app = app
+        self.status: Optional[str] = None
+        # Terminal status, once reached, while `on_done` is not dispatched.
+        self.done_status: Optional[str] = None
+        self.dispatch_attempts = 0
+        self.future: Future[Any] = Future()
+        self.started = time.monotonic()
+        self.checks = 0
+        self.overdue_checks = 0
+
+
+class RunWatcher:
+    """Tracks all pending runs, and polls them from a single thread.
+
+    Runs are polled in order of when they are due. The first checks are
+    spaced towards the median duration of previously completed runs; once a
+    run takes longer than that, checks back off exponentially. Jitter is
+    added so that runs created together are not polled together.
+
+    When a run reaches a terminal status, its `on_done` callback is
+    dispatched to the background task executor, and its future is resolved
+    with the callback's result. The watcher thread never waits for room in
+    the executor's queue: while it is full, the dispatch is retried with
+    backoff, and if it never fits, the terminal status is reported to
+    `on_status` instead, so the run is still seen to be done.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self,
+                 get_run_status: Callable[[str, str], str],
+                 *,
+                 min_delay: float = MIN_DELAY_SEC,
+                 max_delay: float = MAX_DELAY_SEC,
+                 max_wait_sec: float = MAX_WAIT_SEC,
+                 expected_duration: float = EXPECTED_RUN_DURATION_SEC) -> None:
+        self._get_run_status = get_run_status
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._max_wait_sec = max_wait_sec
+        self._expected_duration = expected_duration
+
+        self._condition = threading.Condition()
+        self._runs: dict[str, _PendingRun] = {}
+        self._schedule: list[tuple[float, str]] = []
+        self._durations: deque[float] = deque(maxlen=100)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._runs)
+
+    def watch(self,
+              run_id: str,
+              thread_id: str,
+              on_done: Callable[[str], Any],
+              *,
+              on_status: Optional[Callable[[str], Any]] = None,
+              on_check: Optional[Callable[[], Any]] = None) -> Future[Any]:
+        """Watches a run until it reaches a terminal status.
+
+        If the run is already being watched, the existing future is returned,
+        and the callbacks are not registered.
+
+        Args:
+            run_id (str): Run to watch.
+            thread_id (str): Thread the run belongs to.
+            on_done (Callable[[str], Any]): Called with the terminal status of
+                the run, or `timeout`. Runs in the app context of the caller.
+            on_status (Callable[[str], Any]): Called on the watcher thread,
+                in the app context of the caller, when the run moves to
+                another status that is not terminal, or with the terminal
+                status if `on_done` could not be dispatched. Should be short.
+            on_check (Callable[[], Any]): Called on the watcher thread, in
+                the app context of the caller, before each check of the run,
+                e.g. to show that the run is watched. Should be short.
+
+        Returns:
+            Future: Resolved with the return value of `on_done`.
+        """
+        app = current_app._get_current_object() \
+            if has_app_context() else None  # type: ignore
+        with self._condition:
+            pending = self._runs.get(run_id)
+            if pending:
+                return pending.future
+
+            pending = _PendingRun(run_id, thread_id, on_done, on_status,
+                                  on_check, app)  # type: ignore
+            self._runs[run_id] = pending
+            self._schedule_check(pending)
+            self._start()
+            self._condition.notify()
+
+        self._logger.info(f'Watching run {run_id} '
+                          f'({len(self._runs)} pending)')
+        return pending.future
+
+    def _start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._watch_runs,
+                                        name='run-watcher',
+                                        daemon=True)
+        self._thread.start()
+
+    def _expected_run_duration(self) -> float:
+        if self._durations:
+            return statistics.median(self._durations)
+        return self._expected_duration
+
+    def _next_delay(self, pending: _PendingRun) -> float:
+        elapsed = time.monotonic() - pending.started
+        remaining = self._expected_run_duration() - elapsed
+        if remaining > self._min_delay:
+            delay = remaining / 2
+        else:
+            delay = self._min_delay * (2 ** pending.overdue_checks)
+            pending.overdue_checks += 1
+
+        delay = min(max(delay, self._min_delay), self._max_delay)
+        delay *= random.uniform(1 - JITTER, 1 + JITTER)
+
+        # Check once more at the deadline, rather than after it.
+        return max(min(delay, self._max_wait_sec - elapsed), 0)
+
+    def _schedule_check(self, pending: _PendingRun) -> None:
+        due = time.monotonic() + self._next_delay(pending)
+        heapq.heappush(self._schedule, (due, pending.run_id))
+
+    def _next_due(self) -> _PendingRun:
+        with self._condition:
+            while True:
+                if not self._schedule:
+                    self._condition.wait()
+                    continue
+
+                due, run_id = self._schedule[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+
+                heapq.heappop(self._schedule)
+                return self._runs[run_id]
+
+    def _watch_runs(self) -> None:
+        while True:
+            pending = self._next_due()
+            try:
+                if pending.done_status:
+                    self._finish(pending, pending.done_status)
+                else:
+                    self._check(pending)
+            except Exception as e:
+                self._logger.error(f'Failed to check run {pending.run_id}: {e}')
+                self._finish(pending, None, e)
+
+    def _check(self, pending: _PendingRun) -> None:
+        pending.checks += 1
+        self._call_back(pending, pending.on_check)
+        try:
+            status = self._get_run_status(pending.run_id, pending.thread_id)
+        except Exception as e:
+            self._logger.warning(f'Run status not retrieved: {e}')
+            status = None
+
+        elapsed = time.monotonic() - pending.started
+        self._logger.debug(f'Run {pending.run_id}: {status} '
+                           f'after {elapsed:.1f}s ({pending.checks} checks)')
+
+        if status in INCOMPLETE_STATUSES and status != pending.status:
+            pending.status = status
+            self._call_back(pending, pending.on_status, status)
+
+        if status and status not in INCOMPLETE_STATUSES:
+            if status == 'completed':
+                self._durations.append(elapsed)
+            self._logger.info(f'Run {pending.run_id} finished: {status}')
+            self._finish(pending, status)
+        elif elapsed >= self._max_wait_sec:
+            self._logger.info(f'Run {pending.run_id} finished: timeout')
+            self._finish(pending, 'timeout')
+        else:
+            with self._condition:
+                self._schedule_check(pending)
+
+    def _call_back(self, pending: _PendingRun,
+                   callback: Optional[Callable[..., Any]], *args: Any) -> None:
+        """Calls `on_status` or `on_check`, logging its errors."""
+        if not callback:
+            return
+        try:
+            if pending.app:
+                with pending.app.app_context():
+                    callback(*args)
+            else:
+                callback(*args)
+        except Exception as e:
+            self._logger.warning(f'Run {pending.run_id} callback failed: {e}')
+
+    def _finish(self,
+                pending: _PendingRun,
+                status: Optional[str],
+                error: Optional[Exception] = None) -> None:
+        if error:
+            self._forget(pending)
+            pending.future.set_exception(error)
+            return
+
+        try:
+            background_task_executor.get_executor().try_submit(
+                self._dispatch, pending, status,
+                dedup_key=f'run_done:{pending.run_id}')
+        except background_task_executor.RejectedTaskError as e:
+            pending.dispatch_attempts += 1
+            if pending.dispatch_attempts < DISPATCH_ATTEMPTS:
+                self._logger.warning(f'Run {pending.run_id} not dispatched, '
+                                     f'retrying: {e}')
+                self._retry_dispatch(pending, status)
+                return
+
+            self._logger.error(f'Run {pending.run_id} not handled: {e}')
+            self._forget(pending)
+            self._call_back(pending, pending.on_status, status)
+            pending.future.set_exception(e)
+            return
+
+        self._forget(pending)
+
+    def _retry_dispatch(self, pending: _PendingRun, status: str) -> None:
+        pending.done_status = status
+        delay = self._min_delay * (2 ** pending.dispatch_attempts)
+        with self._condition:
+            heapq.heappush(self._schedule,
+                           (time.monotonic() + delay, pending.run_id))
+
+    def _forget(self, pending: _PendingRun) -> None:
+        with self._condition:
+            self._runs.pop(pending.run_id, None)
+
+    def _dispatch(self, pending: _PendingRun, status: str) -> None:
+        try:
+            if pending.app:
+                with pending.app.app_context():
+                    result = pending.on_done(status)
+            else:
+                result = pending.on_done(status)
+            pending.future.set_result(result)
+        except Exception as e:
+            self._logger.error(f'Run {pending.run_id} not handled: {e}')
+            pending.future.set_exception(e)
+
+
+def get_run_watcher() -> RunWatcher:
+    openai = get_openai()
+    return get_client('run_watcher',
+                      lambda: RunWatcher(openai.get_run_status))
@@ -0,0 +1,52 @@
+from .openai.datatypes.message import Message
+from typing import Any, Literal, TypedDict
+
+import json
+
+__all__ = [
+    'THREAD_EVENTS_CHANNEL',
+    'ThreadEvent',
+    'message_events',
+    'run_event',
+    'thread_channel',
+]
+
+THREAD_EVENTS_CHANNEL = 'thread_events'
+
+
+class ThreadEvent(TypedDict):
+    """An event of a thread, published on `thread_events:{thread_id}`.
+
+    `event` is one of:
+        - `message`: A message of the thread was saved. `data` is a Message.
+        - `run`: A run of the thread changed status, as written to
+            `{run_id}:status`. `data` has the `id`, `thread_id` and `status`
+            of the run.
+        - `resync`: Events may have been missed, and the thread should be
+            read again. `data` is None. Only sent to subscribers.
+    """
+    event: Literal['message', 'run', 'resync']
+    data: Any
+
+
+def thread_channel(thread_id: str) -> str:
+    return f'{THREAD_EVENTS_CHANNEL}:{thread_id}'
+
+
+def message_events(messages: list[Message]) -> list[tuple[str, str]]:
+    """Channels and payloads publishing the saved messages to their threads."""
+    return [
+        (thread_channel(message['thread_id']), json.dumps(ThreadEvent(
+            event='message',
+            # Inserted messages have their ObjectId.
+            data={key: value for key, value in message.items()
+                  if key != '_id'})))
+        for message in messages
+    ]
+
+
+def run_event(run_id: str, thread_id: str, status: str) -> tuple[str, str]:
+    """Channel and payload publishing the status of the run to its thread."""
+    return thread_channel(thread_id), json.dumps(ThreadEvent(
+        event='run',
+        data={'id': run_id, 'thread_id': thread_id, 'status': status}))
@@ -0,0 +1,222 @@
+from . import metrics
+from .api import _to_server_sent_events, _to_upload
+from .assistant.assistant_service import get_assistant
+from .assistant.async_assistant_service import get_async_assistant, run_sync
+from .assistant.async_thread_events import get_thread_events
+from .assistant.background_task_executor import get_executor
+from .datastore.cachedstore import cache_stats
+from markupsafe import escape
+from quart import Blueprint, current_app, jsonify, request, websocket
+from typing import Any, AsyncIterator, Callable, Iterator
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import traceback
+
+bp = Blueprint('async_api', __name__, url_prefix='/api')
+
+# Events of a stream buffered for a slow client. The worker thread waits
+# while the buffer is full.
+_STREAM_BUFFER_SIZE = 100
+
+# How often a waiting worker thread checks whether the client is gone.
+_STREAM_STOP_CHECK_SEC = 1
+
+
+async def _iterate_sync(events: Callable[[], Iterator[str]]) -> AsyncIterator[str]:
+    """Iterates over a sync generator of the Flask app, in a worker thread.
+
+    Once the iteration is closed, e.g. when the client disconnects, the
+    thread stops at the next event, closing the generator.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[Any] = asyncio.Queue(_STREAM_BUFFER_SIZE)
+    stop = threading.Event()
+    end = object()
+    flask_app = current_app.extensions['flask_app']
+
+    def put(item: Any) -> None:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while not stop.is_set():
+            try:
+                future.result(_STREAM_STOP_CHECK_SEC)
+                return
+            except concurrent.futures.TimeoutError:
+                pass
+        future.cancel()
+
+    def produce() -> None:
+        try:
+            with flask_app.app_context():
+                for event in events():
+                    if stop.is_set():
+                        break
+                    put(event)
+        finally:
+            put(end)
+
+    producer = asyncio.ensure_future(asyncio.to_thread(produce))
+    try:
+        while (event := await queue.get()) is not end:
+            yield event
+    finally:
+        stop.set()
+    await producer
+
+
+@bp.errorhandler(500)
+@bp.errorhandler(Exception)
+async def internal_server_error(e: Exception):
+    current_app.logger.error(e)
+    if current_app.logger.isEnabledFor(logging.DEBUG):
+        traceback.print_exc()
+    return jsonify(error=str(e)), 500  # type: ignore
+
+
+@bp.route('/')
+async def home():
+    return {
+        'status': 'ok'
+    }
+
+
+@bp.route('/cache/stats')
+async def get_cache_stats():
+    return jsonify(await run_sync(cache_stats))
+
+
+@bp.route('/executor/stats')
+async def get_executor_stats():
+    return jsonify(get_executor().stats())
+
+
+@bp.route('/metrics')
+async def get_metrics():
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+
+@bp.route('/openai/threads/<thread_id>/messages')
+async def thread_messages(thread_id: str):
+    assistant = await get_async_assistant()
+    messages = await assistant.get_messages(
+        thread_id,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        limit=request.args.get('limit'),  # type: ignore
+        sort=request.args.get('sort'))  # type: ignore
+    return jsonify(messages)
+
+
+@bp.route('/assistant')
+async def assistant():
+    return (await get_async_assistant()).state
+
+
+@bp.route('/threads/<thread_id>/messages', methods=['GET'])
+async def get_messages(thread_id: str):
+    args = request.args
+    messages = await run_sync(lambda: get_assistant().get_messages(
+        thread_id=escape(thread_id),
+        after=args.get('after'),
+        before=args.get('before'),
+        limit=args.get('limit', 20, type=int),
+        sort=args.get('sort', 'desc')))  # type: ignore
+    return jsonify(messages)
+
+
+@bp.route('/threads', methods=['GET'])
+async def list_threads():
+    args = request.args
+    threads = await run_sync(lambda: get_assistant().list_threads(
+        after=args.get('after'),
+        limit=args.get('limit', 20, type=int)))
+    return jsonify(threads)
+
+
+@bp.route('/threads', methods=['POST'])
+async def create_thread():
+    files = [file for file in (await request.files).getlist('file')
+             if file.filename]
+    if not files:
+        raise ValueError('A CV file is required to create a thread.')
+
+    init_message = request.args.get('init_message')
+    thread = await run_sync(lambda: get_assistant().create_thread(
+        cv_files=[_to_upload(file) for file in files],
+        init_message=init_message))
+
+    return {'thread_id': thread.id}, 201
+
+
+@bp.route('/messages', methods=['POST'])  # type: ignore
+async def messages():  # type: ignore
+    request_json = await request.get_json()
+    text = request_json['text'] if request_json \
+        else request.args.get('message')
+    if not text:
+        raise ValueError('No message provided')
+
+    message = await (await get_async_assistant()).send_message(text)
+    if '_id' in message.keys():
+        del message['_id']  # type: ignore
+    return message, 201
+
+
+@bp.route('/threads/<thread_id>/messages', methods=['POST'])
+async def send_message(thread_id: str):
+    request_json = await request.get_json(silent=True)
+    text = request_json['text'] if request_json \
+        else request.args.get('message')
+    if not text:
+        raise ValueError('No message provided')
+
+    assistant = await get_async_assistant()
+    message = await assistant.send_message(text, escape(thread_id))
+    if '_id' in message.keys():
+        del message['_id']  # type: ignore
+    return message, 201
+
+
+@bp.route('/threads/<thread_id>/messages/stream', methods=['POST'])
+async def stream_message(thread_id: str):
+    request_json = await request.get_json(silent=True)
+    text = request_json['text'] if request_json \
+        else request.args.get('message')
+    if not text:
+        raise ValueError('No message provided')
+
+    # The stream is read by a worker thread, for the duration of the run.
+    events = _iterate_sync(lambda: _to_server_sent_events(
+        get_assistant().stream_message(text, escape(thread_id))))
+    return events, 200, {'Content-Type': 'text/event-stream',
+                         'Cache-Control': 'no-cache',
+                         'X-Accel-Buffering': 'no'}
+
+
+@bp.websocket('/threads/<thread_id>/ws')
+async def thread_events(thread_id: str):
+    """Pushes the events of the thread as they are saved, as JSON
+    :py:class:`ThreadEvent`: its new messages, and the status changes of its
+    runs. The sockets of a thread share the process's subscription."""
+    thread = await (await get_async_assistant()).get_thread(escape(thread_id))
+    async with get_thread_events().subscribe(thread['id']) as events:
+        await websocket.accept()
+        while True:
+            await websocket.send(await events.get())
+
+
+@bp.route('/runs/<run_id>', methods=['GET'])
+async def run(run_id: str):
+    run = await (await get_async_assistant()).get_run(escape(run_id))
+    return jsonify(run)
+
+
+@bp.route('/messages/<message_id>/response', methods=['GET'])
+async def get_response(message_id: str):
+    response = await (await get_async_assistant()).get_response(
+        escape(message_id), wait=request.args.get('wait', type=float))
+    if response is None:
+        return {'status': 'pending'}, 202
+    return jsonify(response)
@@ -0,0 +1,84 @@
+from typing import Any, Callable, Optional, TypeVar
+
+import logging
+import os
+import threading
+
+__all__ = [
+    'find_client',
+    'get_client',
+    'reset_clients',
+]
+
+C = TypeVar('C')
+
+_logger = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+    """Process-wide registry of long-lived clients.
+
+    Clients (MongoClient, Redis connection pools, OpenAI httpx clients) are
+    expensive to create, and are safe to share between threads. They are not
+    safe to share across a fork, so the registry is emptied in forked children,
+    and each process builds its own clients on first use.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._clients: dict[str, Any] = {}
+        self._pid = os.getpid()
+
+    def _check_pid(self) -> None:
+        if self._pid != os.getpid():
+            _logger.info(f'Fork detected, discarding clients of {self._pid}')
+            self._clients = {}
+            self._pid = os.getpid()
+
+    def get(self, name: str, factory: Callable[[], C]) -> C:
+        self._check_pid()
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+
+        with self._lock:
+            self._check_pid()
+            if name not in self._clients:
+                _logger.info(f'Creating client: {name}')
+                self._clients[name] = factory()
+            return self._clients[name]
+
+    def find(self, name: str) -> Optional[Any]:
+        self._check_pid()
+        return self._clients.get(name)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._clients = {}
+            self._pid = os.getpid()
+
+    def _after_fork(self) -> None:
+        # The lock may have been held by another thread at fork time.
+        self._lock = threading.RLock()
+        self._clients = {}
+        self._pid = os.getpid()
+
+
+_registry = ClientRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_registry._after_fork)
+
+
+def get_client(name: str, factory: Callable[[], C]) -> C:
+    """Returns the client registered as `name`, creating it if needed."""
+    return _registry.get(name, factory)
+
+
+def find_client(name: str) -> Optional[Any]:
+    """Returns the client registered as `name`, if it was created."""
+    return _registry.find(name)
+
+
+def reset_clients() -> None:
+    _registry.reset()
@@ -0,0 +1,294 @@
+from . import codecs
+from ..logs import sampled
+from ..metrics import record_cache_lookup
+from .cache_policy import CachePolicy, NEGATIVE_TTL, get_policy
+from .cachedstore import RedisResult, decode_value, encode_value, tombstone
+from .local_cache import INVALIDATION_CHANNEL
+from .mongodb.async_mongo_wrapper import AsyncMongoDB, get_async_mongo
+from .mongodb.mongo_query import MongoQuery
+from .redisdb.async_redisdb import get_async_redis
+from .single_flight import AsyncSingleFlight
+from contextlib import asynccontextmanager
+from quart import current_app
+from typing import (
+    Any, AsyncIterator, Callable, Generic, Mapping, Optional, TypeVar
+)
+
+import asyncio
+import copy
+import json
+import logging
+import time
+import uuid
+
+__all__ = [
+    'AsyncCache',
+    'AsyncCachedStore',
+]
+
+T = TypeVar('T', bound=Mapping[str, Any])
+
+# How often a key being refilled by another worker is checked.
+_REFILL_POLL_SEC = 0.05
+
+
+class AsyncCache(Generic[T]):
+    """Async counterpart of :py:class:`Cache`, sharing its Redis keys.
+
+    Values are not kept in the in-process cache. Writes to prefixes that use
+    it are published on the invalidation channel, so the processes that do
+    drop their copies.
+    """
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(self, key_prefix: str,
+                 policy: Optional[CachePolicy] = None,
+                 codec: Optional[codecs.Codec] = None) -> None:
+        config = current_app.config
+        self._key_prefix = key_prefix
+        self._policy = policy
+        self._codec = codec or codecs.get_codec(config['CACHE_CODEC'])
+        self._redis = get_async_redis(binary=True)
+        self._local_enabled: bool = config['CACHE_LOCAL_ENABLED']
+        self._origin = uuid.uuid4().hex
+
+        self._refill_lock_ttl: Optional[float] = None
+        if config['CACHE_REFILL_LOCK_ENABLED']:
+            self._refill_lock_ttl = float(
+                config['CACHE_REFILL_LOCK_TTL'])  # type: ignore
+        self._refill_wait = float(config['CACHE_REFILL_WAIT'])  # type: ignore
+
+    @property
+    def policy(self) -> CachePolicy:
+        return self._policy or get_policy(self._key_prefix)
+
+    def _cache_key(self, key: str) -> str:
+        return f'{self._key_prefix}:{key}'
+
+    def _read_ttl(self) -> Optional[int]:
+        policy = self.policy
+        return policy['ttl'] if policy['sliding'] else None
+
+    async def _invalidate_local(self, *cache_keys: str) -> None:
+        if self._local_enabled and self.policy.get('local', False):
+            await self._redis.publish(INVALIDATION_CHANNEL, json.dumps(
+                {'origin': self._origin, 'keys': list(cache_keys)}))
+
+    async def get(self, key: str) -> Optional[RedisResult]:
+        """Returns the cached value, or an empty list for a cached miss."""
+        result = decode_value(await self._redis.read(self._cache_key(key),
+                                                     ttl=self._read_ttl()))
+        record_cache_lookup(self._key_prefix, result)
+        return result
+
+    async def get_many(self,
+                       keys: list[str]) -> dict[str, Optional[RedisResult]]:
+        """Like `get`, for several keys, in one round trip."""
+        values = await self._redis.read_many(
+            [self._cache_key(key) for key in keys], ttl=self._read_ttl())
+        results: dict[str, Optional[RedisResult]] = {}
+        for key, value in zip(keys, values):
+            results[key] = decode_value(value)
+            record_cache_lookup(self._key_prefix, results[key])
+        return results
+
+    async def put(self, key: str, value: T | list[T]) -> None:
+        cache_key = self._cache_key(key)
+        await self._redis.write(cache_key, encode_value(value, self._codec),
+                                ttl=self.policy['ttl'])
+        await self._invalidate_local(cache_key)
+
+    async def put_many(self, values: Mapping[str, T | list[T]]) -> None:
+        """Like `put`, for several keys, in one round trip."""
+        if not values:
+            return
+        cache_data = {
+            self._cache_key(key): encode_value(value, self._codec)
+            for key, value in values.items()
+        }
+        await self._redis.write_many(cache_data, ttl=self.policy['ttl'])
+        await self._invalidate_local(*cache_data.keys())
+
+    async def put_miss(self, key: str) -> None:
+        """Records that there is no value for the key, for a short while."""
+        ttl = self.policy.get('negative_ttl', NEGATIVE_TTL)
+        if ttl:
+            await self._redis.write(self._cache_key(key), tombstone(ttl),
+                                    ttl=ttl)
+
+    async def put_misses(self, keys: list[str]) -> None:
+        """Like `put_miss`, for several keys, in one round trip."""
+        ttl = self.policy.get('negative_ttl', NEGATIVE_TTL)
+        if not ttl or not keys:
+            return
+        data = tombstone(ttl)
+        cache_data = {self._cache_key(key): data for key in keys}
+        await self._redis.write_many(cache_data, ttl=ttl)
+        await self._invalidate_local(*cache_data.keys())
+
+    async def delete(self, *keys: str) -> None:
+        cache_keys = [self._cache_key(key) for key in keys]
+        await self._redis.delete(*cache_keys)
+        await self._invalidate_local(*cache_keys)
+
+    @asynccontextmanager
+    async def refill_lease(self, key: str) -> AsyncIterator[bool]:
+        """Holds the lease to refill the key, across workers.
+
+        See :py:meth:`Cache.refill_lease`.
+        """
+        if self._refill_lock_ttl is None:
+            yield True
+            return
+
+        lock = self._redis.connection.lock(
+            f'lock:{self._cache_key(key)}', timeout=self._refill_lock_ttl)
+        if not await lock.acquire(blocking=False):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            try:
+                await lock.release()
+            except Exception as e:
+                # The lease expired, and may have been taken by another worker.
+                self._log.warning('Refill lease for %s not released: %s',
+                                  key, e)
+
+    async def wait_for(self, key: str) -> Optional[RedisResult]:
+        """Waits up to `CACHE_REFILL_WAIT` seconds for the key to be filled."""
+        deadline = time.monotonic() + self._refill_wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(_REFILL_POLL_SEC)
+            result = decode_value(await self._redis.read(self._cache_key(key)))
+            if result is not None:
+                return result
+
+
+class AsyncCachedStore(Generic[T]):
+    """Async counterpart of :py:class:`CachedStore`, sharing its collections
+    and cache keys."""
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(
+            self,
+            collection: str,
+            convert: Callable[[Mapping[str, Any]], T],
+            id_mapper: Callable[[T], str] = lambda t_obj: t_obj['id'],
+            policy: Optional[CachePolicy] = None) -> None:
+        if not collection:
+            raise ValueError('key_prefix is required')
+
+        self._collection = collection
+        self._convert = convert
+        self._id_mapper = id_mapper
+
+        self._mongo: AsyncMongoDB[T] = get_async_mongo()
+        self._cache = AsyncCache[T](self._collection, policy)
+        self._single_flight = AsyncSingleFlight[Optional[T | list[T]]]()
+
+    def _convert_to_type(self, value: RedisResult) -> T | list[T]:
+        if isinstance(value, list):
+            return [self._convert(item) for item in value]
+
+        return self._convert(value)
+
+    async def read(self,
+                   key: str,
+                   on_miss: MongoQuery) -> Optional[list[T]] | Optional[T]:
+        cached_result = await self._cache.get(key)
+        if cached_result == []:
+            return None
+        if cached_result:
+            sampled(self._log, 'cache hit: %s', key)
+            return self._convert_to_type(cached_result)
+
+        sampled(self._log, 'cache miss: %s', key)
+        result, shared = await self._single_flight.do(
+            key, lambda: self._refill(key, on_miss))
+        # The documents are mutable, and are not shared between requests.
+        return copy.deepcopy(result) if shared else result
+
+    async def _refill(self,
+                      key: str,
+                      on_miss: MongoQuery) -> Optional[list[T]] | Optional[T]:
+        async with self._cache.refill_lease(key) as leased:
+            if not leased:
+                self._log.info('waiting for refill: %s', key)
+                cached_result = await self._cache.wait_for(key)
+                if cached_result == []:
+                    return None
+                if cached_result:
+                    return self._convert_to_type(cached_result)
+
+            db_result = await self._mongo.find(self._collection, **on_miss)
+            if db_result:
+                result = [self._convert(document) for document in db_result]
+                await self._cache.put(key, result)
+                return result
+
+            self._log.debug('No result for: %s', key)
+            await self._cache.put_miss(key)
+
+    async def invalidate(self, *keys: str) -> None:
+        """Drops cached values, including cached misses, for the keys."""
+        await self._cache.delete(*keys)
+
+    async def read_many(
+            self,
+            keys: list[str],
+            on_miss: Callable[[list[str]], MongoQuery]) -> dict[str, Optional[T]]:
+        """Reads one document per key. See :py:meth:`CachedStore.read_many`."""
+        cached_results = await self._cache.get_many(keys)
+
+        results: dict[str, Optional[T]] = {}
+        missing: list[str] = []
+        for key in keys:
+            cached_result = cached_results[key]
+            if cached_result == []:
+                results[key] = None
+            elif isinstance(cached_result, list):
+                results[key] = self._convert(cached_result[0])
+            elif cached_result:
+                results[key] = self._convert(cached_result)
+            else:
+                missing.append(key)
+
+        if missing:
+            query = on_miss(missing)
+            query['limit'] = len(missing)
+            found = {
+                self._id_mapper(document): self._convert(document)
+                for document in await self._mongo.find(self._collection,
+                                                       **query)
+            }
+            await self._cache.put_many(found)
+            await self._cache.put_misses(
+                [key for key in missing if key not in found])
+            for key in missing:
+                results[key] = found.get(key)
+
+        return results
+
+    async def cache_many(self, values: list[T]) -> None:
+        """Caches each document under its id, without writing it to the DB."""
+        await self._cache.put_many({
+            self._id_mapper(value): value
+            for value in values
+        })
+
+    async def write_one(self, value: T, key: Optional[str] = None) -> str:
+        key = key or self._id_mapper(value)
+        object_id = await self._mongo.insert_one(self._collection, value)
+        await self._cache.put(key, value)
+        return str(object_id)
+
+    async def upsert(self, key: str, value: T, query: MongoQuery) -> str:
+        """Updates or inserts the document, and caches it."""
+        upsert_id = await self._mongo.upsert(
+            self._collection, query['filter'], value)
+        await self._cache.put(key, value)
+        return str(upsert_id)
@@ -0,0 +1,73 @@
+from typing import NotRequired, Optional, TypedDict
+
+import os
+
+__all__ = [
+    'CachePolicy',
+    'KEY_PATTERNS',
+    'NEGATIVE_TTL',
+    'get_policy',
+    'set_policy',
+]
+
+
+class CachePolicy(TypedDict):
+    """How long keys with a prefix live in Redis.
+
+    `ttl` is in seconds; keys with no TTL are never expired, and are not
+    evicted under the `volatile-*` maxmemory policies. With `sliding`, the TTL
+    is reset every time the key is read, so only idle keys expire.
+
+    `negative_ttl` is how long a lookup that found nothing is remembered.
+    Defaults to `NEGATIVE_TTL`; None disables negative caching.
+
+    With `local`, values are also kept in the in-process cache, if it is
+    enabled.
+    """
+    ttl: Optional[int]
+    sliding: bool
+    negative_ttl: NotRequired[Optional[int]]
+    local: NotRequired[bool]
+
+
+def _ttl(prefix: str, default: int) -> Optional[int]:
+    """TTL for the prefix from `CACHE_TTL_<PREFIX>`. 0 disables expiry."""
+    ttl = int(os.environ.get(f'CACHE_TTL_{prefix.upper()}', default))
+    return ttl or None
+
+
+NEGATIVE_TTL = _ttl('negative', 5)
+
+DEFAULT_POLICY = CachePolicy(ttl=_ttl('default', 3600), sliding=False)
+
+_policies: dict[str, CachePolicy] = {
+    'assistants': CachePolicy(ttl=_ttl('assistants', 3600), sliding=True,
+                              local=True),
+    'threads': CachePolicy(ttl=_ttl('threads', 3600), sliding=True,
+                           local=True),
+    'messages': CachePolicy(ttl=_ttl('messages', 600), sliding=False),
+    'run_status': CachePolicy(ttl=_ttl('run_status', 86400), sliding=False),
+    'last_sent': CachePolicy(ttl=_ttl('last_sent', 86400), sliding=False),
+    'synced': CachePolicy(ttl=_ttl('synced', 3600), sliding=False),
+    'thread_messages': CachePolicy(ttl=_ttl('thread_messages', 3600),
+                                   sliding=True),
+}
+
+# Key patterns per prefix, for stats. Run status keys are `{run_id}:status`.
+KEY_PATTERNS: dict[str, str] = {
+    'assistants': 'assistants:*',
+    'threads': 'threads:*',
+    'messages': 'messages:*',
+    'run_status': '*:status',
+    'last_sent': 'last_sent:*',
+    'synced': 'synced:*',
+    'thread_messages': 'thread_messages:*',
+}
+
+
+def get_policy(prefix: str) -> CachePolicy:
+    return _policies.get(prefix, DEFAULT_POLICY)
+
+
+def set_policy(prefix: str, policy: CachePolicy) -> None:
+    _policies[prefix] = policy
@@ -1,57 +1,256 @@
+from . import codecs
+from ..logs import payload, sampled
+from ..metrics import record_cache_lookup
+from .cache_policy import CachePolicy, KEY_PATTERNS, NEGATIVE_TTL, get_policy
+from .local_cache import LocalCache, get_local_cache
 from .mongodb.mongo_wrapper import MongoDB, get_mongo
 from .mongodb.mongo_query import MongoQuery
 from .redisdb.redisdb import get_redis
+from .single_flight import SingleFlight
+from contextlib import contextmanager
+from flask import current_app
 
+import copy
 import logging
 
 from typing import (
-    Any, Callable, Generic, Mapping, Optional, TypeVar, Union
+    Any, Callable, Generic, Iterator, Mapping, Optional, TypeVar, Union
 )
 
-import json
+import time
 
 T = TypeVar('T', bound=Mapping[str, Any])
 RedisResult = Union[dict[str, Any], list[dict[str, Any]]]
 
+# Prefix of values recording that a lookup found nothing. The rest of the
+# value is the time the record expires at.
+_TOMBSTONE = b'__miss__:'
+
+# How often a key being refilled by another worker is checked.
+_REFILL_POLL_SEC = 0.05
+
+
+def encode_value(value: Mapping[str, Any] | list[Any],
+                 codec: codecs.Codec) -> bytes:
+    """Encodes a cached document, or list of documents, without `_id`."""
+    def delete_object_id(obj: Mapping[str, Any]) -> Mapping[str, Any]:
+        if '_id' not in obj:
+            return obj
+        return {
+            key: val
+            for key, val in obj.items()
+            if key != '_id'
+        }
+
+    if isinstance(value, list):
+        values = [
+            delete_object_id(item)
+            for item in value
+        ]
+        return codecs.encode(values, codec)
+    else:
+        return codecs.encode(delete_object_id(value), codec)
+
+
+def decode_value(result: Optional[bytes]) -> Optional[RedisResult]:
+    """Decodes a cached value; a cached miss is an empty list."""
+    if result and result.startswith(_TOMBSTONE):
+        # The expiry is checked here, as a sliding read extends the TTL.
+        expires_at = float(result[len(_TOMBSTONE):])
+        return [] if time.time() < expires_at else None
+    if result:
+        return codecs.decode(result)
+
+
+def tombstone(ttl: int) -> bytes:
+    """Value recording a miss, for `ttl` seconds."""
+    return _TOMBSTONE + str(time.time() + ttl).encode()
+
 
 class Cache(Generic[T]):
 
     _log = logging.getLogger(__name__)
-    _redis = get_redis()
+    _redis = get_redis(binary=True)
 
-    def __init__(self, key_prefix: str) -> None:
+    def __init__(self, key_prefix: str,
+                 policy: Optional[CachePolicy] = None,
+                 codec: Optional[codecs.Codec] = None) -> None:
         self._key_prefix = key_prefix
+        self._policy = policy
+        self._local_cache = get_local_cache()
+        self._codec = codec \
+            or codecs.get_codec(current_app.config['CACHE_CODEC'])
+
+        config = current_app.config
+        self._refill_lock_ttl: Optional[float] = None
+        if config['CACHE_REFILL_LOCK_ENABLED']:
+            self._refill_lock_ttl = float(
+                config['CACHE_REFILL_LOCK_TTL'])  # type: ignore
+        self._refill_wait = float(config['CACHE_REFILL_WAIT'])  # type: ignore
+
+    @property
+    def policy(self) -> CachePolicy:
+        return self._policy or get_policy(self._key_prefix)
+
+    @property
+    def local_cache(self) -> Optional[LocalCache]:
+        if self._local_cache and self.policy.get('local', False):
+            return self._local_cache
 
     def _cache_key(self, key: str) -> str:
         return f'{self._key_prefix}:{key}'
 
+    def _read(self, cache_key: str) -> Optional[bytes]:
+        policy = self.policy
+        local_cache = self.local_cache
+        if local_cache:
+            result = local_cache.get(cache_key)
+            if result is not None:
+                return result
+
+        result = self._redis.read(cache_key,
+                                  ttl=policy['ttl'] if policy['sliding'] else None)
+        if local_cache and result is not None:
+            local_cache.put(cache_key, result, policy['ttl'])
+        return result
+
+    def _write(self, cache_key: str, data: bytes, ttl: Optional[int]) -> None:
+        self._redis.write(cache_key, data, ttl=ttl)
+        local_cache = self.local_cache
+        if local_cache:
+            local_cache.invalidate(cache_key)
+            local_cache.put(cache_key, data, ttl)
+
     def get(self, key: str) -> Optional[RedisResult]:
-        result = self._redis.read(self._cache_key(key))
-        if result:
-            return json.loads(result)
+        """Returns the cached value, or an empty list for a cached miss."""
+        result = decode_value(self._read(self._cache_key(key)))
+        record_cache_lookup(self._key_prefix, result)
+        return result
 
-    def put(self, key: str, value: T | list[T]) -> None:
-        def serialize(value: T | list[T]) -> str:
-            def delete_object_id(obj: T) -> dict[str, Any]:
-                return {
-                    key: val
-                    for key, val in obj.items()
-                    if key != '_id'
-                }
-
-            if isinstance(value, list):
-                values = [
-                    delete_object_id(item)
-                    for item in value
-                ]
-                return json.dumps(values)
-            else:
-                return json.dumps(delete_object_id(value))
+    def get_many(self, keys: list[str]) -> dict[str, Optional[RedisResult]]:
+        """Like `get`, for several keys, in one round trip."""
+        policy = self.policy
+        local_cache = self.local_cache
+        cache_keys = [self._cache_key(key) for key in keys]
+
+        results: dict[str, Optional[bytes]] = {}
+        if local_cache:
+            for cache_key in cache_keys:
+                result = local_cache.get(cache_key)
+                if result is not None:
+                    results[cache_key] = result
+
+        missing = [key for key in cache_keys if key not in results]
+        values = self._redis.read_many(
+            missing, ttl=policy['ttl'] if policy['sliding'] else None)
+        for cache_key, value in zip(missing, values):
+            results[cache_key] = value
+            if local_cache and value is not None:
+                local_cache.put(cache_key, value, policy['ttl'])
+
+        decoded: dict[str, Optional[RedisResult]] = {}
+        for key, cache_key in zip(keys, cache_keys):
+            decoded[key] = decode_value(results[cache_key])
+            record_cache_lookup(self._key_prefix, decoded[key])
+        return decoded
+
+    def put_miss(self, key: str) -> None:
+        """Records that there is no value for the key, for a short while."""
+        ttl = self.policy.get('negative_ttl', NEGATIVE_TTL)
+        if not ttl:
+            return
 
+        self._write(self._cache_key(key),
+                    tombstone(ttl), ttl)
+
+    def put_misses(self, keys: list[str]) -> None:
+        """Like `put_miss`, for several keys, in one round trip."""
+        ttl = self.policy.get('negative_ttl', NEGATIVE_TTL)
+        if not ttl or not keys:
+            return
+
+        data = tombstone(ttl)
+        cache_data = {self._cache_key(key): data for key in keys}
+        self._redis.write_many(cache_data, ttl=ttl)
+
+        local_cache = self.local_cache
+        if local_cache:
+            local_cache.invalidate(*cache_data.keys())
+            for cache_key in cache_data:
+                local_cache.put(cache_key, data, ttl)
+
+    def delete(self, *keys: str) -> None:
+        cache_keys = [self._cache_key(key) for key in keys]
+        self._redis.delete(*cache_keys)
+        local_cache = self.local_cache
+        if local_cache:
+            local_cache.invalidate(*cache_keys)
+
+    def put(self, key: str, value: T | list[T]) -> None:
         cache_key = self._cache_key(key)
-        cache_data = serialize(value)
-        self._log.info(f'cache write: {cache_key} -> {cache_data}')
-        self._redis.write(cache_key, cache_data)
+        cache_data = encode_value(value, self._codec)
+        self._log.debug('cache write: %s -> %s', cache_key, payload(value))
+        self._write(cache_key, cache_data, self.policy['ttl'])
+
+    def put_many(self, values: Mapping[str, T | list[T]]) -> None:
+        """Like `put`, for several keys, in one round trip."""
+        ttl = self.policy['ttl']
+        cache_data = {
+            self._cache_key(key): encode_value(value, self._codec)
+            for key, value in values.items()
+        }
+        self._log.debug('cache write: %d keys', len(cache_data))
+        self._redis.write_many(cache_data, ttl=ttl)
+
+        local_cache = self.local_cache
+        if local_cache and cache_data:
+            local_cache.invalidate(*cache_data.keys())
+            for cache_key, data in cache_data.items():
+                local_cache.put(cache_key, data, ttl)
+
+    @contextmanager
+    def refill_lease(self, key: str) -> Iterator[bool]:
+        """Holds the lease to refill the key, across workers.
+
+        Yields False if another worker holds it, and True otherwise, including
+        when refill locks are disabled. The lease expires after
+        `CACHE_REFILL_LOCK_TTL` seconds, in case its holder dies.
+        """
+        if self._refill_lock_ttl is None:
+            yield True
+            return
+
+        lock = self._redis.connection.lock(
+            f'lock:{self._cache_key(key)}', timeout=self._refill_lock_ttl)
+        if not lock.acquire(blocking=False):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            try:
+                lock.release()
+            except Exception as e:
+                # The lease expired, and may have been taken by another worker.
+                self._log.warning('Refill lease for %s not released: %s',
+                                  key, e)
+
+    def wait_for(self, key: str) -> Optional[RedisResult]:
+        """Waits up to `CACHE_REFILL_WAIT` seconds for the key to be filled.
+
+        Returns:
+            Optional[RedisResult]: Like `get`, or None if the key is still
+                empty.
+        """
+        deadline = time.monotonic() + self._refill_wait
+        while time.monotonic() < deadline:
+            time.sleep(_REFILL_POLL_SEC)
+            result = decode_value(self._read(self._cache_key(key)))
+            if result is not None:
+                return result
+
+    def stats(self) -> dict[str, Optional[int]]:
+        return self._redis.key_stats(self._cache_key('*'))
 
 
 class CachedStore(Generic[T]):
@@ -62,7 +261,8 @@ class CachedStore(Generic[T]):
             self,
             collection: str,
             convert: Callable[[Mapping[str, Any]], T],
-            id_mapper: Callable[[T], str] = lambda t_obj: t_obj['id']) -> None:
+            id_mapper: Callable[[T], str] = lambda t_obj: t_obj['id'],
+            policy: Optional[CachePolicy] = None) -> None:
         if not collection:
             raise ValueError('key_prefix is required')
 
@@ -71,7 +271,8 @@ class CachedStore(Generic[T]):
         self._id_mapper = id_mapper
 
         self._mongo: MongoDB[T] = get_mongo()
-        self._cache = Cache[T](self._collection)
+        self._cache = Cache[T](self._collection, policy)
+        self._single_flight = SingleFlight[Optional[T | list[T]]]()
 
     def _convert_to_type(self, value: RedisResult) -> T | list[T]:
         if isinstance(value, list):
@@ -83,23 +284,106 @@ class CachedStore(Generic[T]):
              key: str,
              on_miss: MongoQuery) -> Optional[list[T]] | Optional[T]:
         cached_result = self._cache.get(key)
+        if cached_result == []:
+            sampled(self._log, 'cache hit, no result: %s', key)
+            return None
         if cached_result:
-            self._log.info(f'cache hit: {key} -> {cached_result}')
+            sampled(self._log, 'cache hit: %s', key)
             if isinstance(cached_result, list):
                 return [self._convert(item) for item in cached_result]
             return self._convert(cached_result)
 
-        self._log.info(f'cache miss: {key}')
-        db_result = self._mongo.find(
-            self._collection, **on_miss)
-        if db_result:
-            self._log.info(f'DB hit: {key}')
-            result = [self._convert(result) for result in db_result]
-            self._cache.put(key, result)
-            self._log.info(f'cache write: {key}')
-            return result
+        sampled(self._log, 'cache miss: %s', key)
+        result, shared = self._single_flight.do(
+            key, lambda: self._refill(key, on_miss))
+        # The documents are mutable, and are not shared between requests.
+        return copy.deepcopy(result) if shared else result
+
+    def _refill(self,
+                key: str,
+                on_miss: MongoQuery) -> Optional[list[T]] | Optional[T]:
+        """Reads the key from the DB, and caches the result.
+
+        If another worker is already refilling the key, its result is waited
+        for instead, and the DB is only queried if it does not arrive in time.
+        """
+        with self._cache.refill_lease(key) as leased:
+            if not leased:
+                self._log.info('waiting for refill: %s', key)
+                cached_result = self._cache.wait_for(key)
+                if cached_result == []:
+                    return None
+                if cached_result:
+                    return self._convert_to_type(cached_result)
+
+            db_result = self._mongo.find(
+                self._collection, **on_miss)
+            if db_result:
+                self._log.debug('DB hit: %s', key)
+                result = [self._convert(result) for result in db_result]
+                self._cache.put(key, result)
+                return result
+
+            self._log.debug('No result for: %s', key)
+            self._cache.put_miss(key)
 
-        self._log.info(f'No result for: {key}')
+    def invalidate(self, *keys: str) -> None:
+        """Drops cached values, including cached misses, for the keys."""
+        self._cache.delete(*keys)
+
+    def read_many(self,
+                  keys: list[str],
+                  on_miss: Callable[[list[str]], MongoQuery]) -> dict[str, Optional[T]]:
+        """Reads one document per key.
+
+        The cached documents are read in one round trip. The rest are read
+        with one query, built from the missing keys by `on_miss`, and are
+        matched to their keys with the id mapper.
+        """
+        cached_results = self._cache.get_many(keys)
+
+        results: dict[str, Optional[T]] = {}
+        missing: list[str] = []
+        for key in keys:
+            cached_result = cached_results[key]
+            if cached_result == []:
+                results[key] = None
+            elif isinstance(cached_result, list):
+                results[key] = self._convert(cached_result[0])
+            elif cached_result:
+                results[key] = self._convert(cached_result)
+            else:
+                missing.append(key)
+
+        sampled(self._log, 'cache hits: %d of %d',
+                len(keys) - len(missing), len(keys))
+        if missing:
+            query = on_miss(missing)
+            query['limit'] = len(missing)
+            found = {
+                self._id_mapper(document): self._convert(document)
+                for document in self._mongo.find(self._collection, **query)
+            }
+            self._cache.put_many(found)
+            self._cache.put_misses(
+                [key for key in missing if key not in found])
+            for key in missing:
+                results[key] = found.get(key)
+
+        return results
+
+    def cache_many(self, values: list[T]) -> None:
+        """Caches each document under its id, without writing it to the DB."""
+        self._cache.put_many({
+            self._id_mapper(value): value
+            for value in values
+        })
+
+    def write_many(self, values: list[T]) -> list[str]:
+        """Inserts the documents, and caches each under its id."""
+        object_ids = self._mongo.insert(self._collection, values)
+        self.cache_many(values)
+        return [str(id) for id in object_ids]
 
     def write(self, key: str, values: list[T]) -> list[str]:
         object_ids = self._mongo.insert(self._collection, values)
@@ -124,5 +408,14 @@ class CachedStore(Generic[T]):
             self._collection, query['filter'], value)
         self._cache.put(key, value)
         upsert_id_str = str(upsert_id)
-        self._log.info(f'upsert: {key} -> {upsert_id_str}')
+        self._log.debug('upsert: %s -> %s', key, upsert_id_str)
         return upsert_id_str
+
+
+def cache_stats() -> dict[str, dict[str, Optional[int]]]:
+    """Key count and memory usage per key prefix."""
+    redis = get_redis()
+    return {
+        prefix: redis.key_stats(pattern)
+        for prefix, pattern in KEY_PATTERNS.items()
+    }
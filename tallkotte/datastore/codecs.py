@@ -0,0 +1,110 @@
+from abc import ABC, abstractmethod
+from typing import Any
+
+import json
+
+__all__ = [
+    'Codec',
+    'decode',
+    'encode',
+    'get_codec',
+]
+
+
+class Codec(ABC):
+    """Serializes cached values.
+
+    Encoded values start with the codec's id byte, so values written with
+    any codec can be read back, and the codec used for writes can be changed
+    without flushing the cache.
+    """
+    id: int
+    name: str
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        ...
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        ...
+
+
+class JsonCodec(Codec):
+    id = 1
+    name = 'json'
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, separators=(',', ':')).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    """JSON, with `orjson`. Requires the `orjson` package."""
+    id = 2
+    name = 'orjson'
+
+    def __init__(self) -> None:
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, value: Any) -> bytes:
+        return self._orjson.dumps(value)
+
+    def loads(self, data: bytes) -> Any:
+        return self._orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """MessagePack. Requires the `msgpack` package."""
+    id = 3
+    name = 'msgpack'
+
+    def __init__(self) -> None:
+        import msgpack
+        self._msgpack = msgpack
+
+    def dumps(self, value: Any) -> bytes:
+        return self._msgpack.packb(value)  # type: ignore[no-any-return]
+
+    def loads(self, data: bytes) -> Any:
+        return self._msgpack.unpackb(data)
+
+
+_CODEC_TYPES: dict[str, type[Codec]] = {
+    codec.name: codec for codec in [JsonCodec, OrjsonCodec, MsgpackCodec]
+}
+_codecs: dict[int, Codec] = {}
+
+
+def get_codec(name: str) -> Codec:
+    if name not in _CODEC_TYPES:
+        raise ValueError(f'Unknown codec: {name}')
+
+    codec_type = _CODEC_TYPES[name]
+    if codec_type.id not in _codecs:
+        try:
+            _codecs[codec_type.id] = codec_type()
+        except ImportError as e:
+            raise ValueError(f'Codec {name} is not available: {e}') from e
+    return _codecs[codec_type.id]
+
+
+def _codec_by_id(codec_id: int) -> Codec:
+    for codec_type in _CODEC_TYPES.values():
+        if codec_type.id == codec_id:
+            return get_codec(codec_type.name)
+    raise ValueError(f'Unknown codec id: {codec_id}')
+
+
+def encode(value: Any, codec: Codec) -> bytes:
+    return bytes([codec.id]) + codec.dumps(value)
+
+
+def decode(data: bytes) -> Any:
+    # Values written before codecs were introduced are plain JSON.
+    if data[:1] in (b'{', b'['):
+        return json.loads(data)
+    return _codec_by_id(data[0]).loads(data[1:])
@@ -0,0 +1,124 @@
+from ..clients import get_client
+from .redisdb.redisdb import RedisDB, get_redis
+from collections import OrderedDict
+from flask import current_app
+from typing import Any, Optional
+
+import json
+import logging
+import threading
+import time
+import uuid
+
+__all__ = [
+    'LocalCache',
+    'get_local_cache',
+]
+
+INVALIDATION_CHANNEL = 'cache:invalidate'
+
+
+class LocalCache:
+    """In-process LRU cache of Redis values, with a TTL per entry.
+
+    Writes are published on a Redis channel, and every process drops the keys
+    written by the others, so hot keys can be served from memory. Entries
+    can be stale for the time it takes the invalidation to arrive; if the
+    subscription is lost, the whole cache is cleared. The TTL bounds how long
+    an entry can be stale in any case.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self,
+                 redis: RedisDB,
+                 max_entries: int = 1024,
+                 ttl: int = 30,
+                 channel: str = INVALIDATION_CHANNEL) -> None:
+        self._redis = redis
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._channel = channel
+        self._origin = uuid.uuid4().hex
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._listener: Optional[threading.Thread] = None
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        self._start_listener()
+        ttl = min(ttl, self._ttl) if ttl else self._ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self, *keys: str) -> None:
+        """Drops the keys here, and in every other process."""
+        self.delete(*keys)
+        self._redis.publish(self._channel, json.dumps(
+            {'origin': self._origin, 'keys': list(keys)}))
+
+    def _start_listener(self) -> None:
+        if self._listener and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen,
+                                              name='local-cache-listener',
+                                              daemon=True)
+            self._listener.start()
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = self._redis.connection.pubsub(
+                    ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                # Invalidations may have been missed before subscribing.
+                self.clear()
+                for message in pubsub.listen():
+                    invalidation = json.loads(message['data'])
+                    if invalidation['origin'] != self._origin:
+                        self.delete(*invalidation['keys'])
+            except Exception as e:
+                self._logger.error(f'Invalidation subscription lost: {e}')
+                self.clear()
+                time.sleep(1)
+
+
+def get_local_cache() -> Optional[LocalCache]:
+    """Returns the process-wide local cache, or None if it is disabled."""
+    config = current_app.config
+    if not config['CACHE_LOCAL_ENABLED']:
+        return None
+
+    redis = get_redis()
+    return get_client('local_cache', lambda: LocalCache(
+        redis,
+        max_entries=int(config['CACHE_LOCAL_MAX_ENTRIES']),  # type: ignore
+        ttl=int(config['CACHE_LOCAL_TTL']),  # type: ignore
+    ))
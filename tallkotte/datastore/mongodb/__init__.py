@@ -10,4 +10,16 @@ mongo_config = {
     'MONGO_USERNAME': os.environ.get('MONGO_USERNAME', 'root'),
     'MONGO_PASSWORD': os.environ.get('MONGO_PASSWORD', 'toor'),
     'MONGO_DATABASE': os.environ.get('MONGO_DATABASE', 'cvassistant'),
+    'MONGO_MAX_POOL_SIZE': os.environ.get('MONGO_MAX_POOL_SIZE', 100),
+    'MONGO_MIN_POOL_SIZE': os.environ.get('MONGO_MIN_POOL_SIZE', 0),
+    'MONGO_SYNC_INDEXES': os.environ.get(
+        'MONGO_SYNC_INDEXES', 'true').lower() == 'true',
+    'MONGO_WRITE_BEHIND': os.environ.get(
+        'MONGO_WRITE_BEHIND', 'false').lower() == 'true',
+    'MONGO_WRITE_BEHIND_BATCH_SIZE': os.environ.get(
+        'MONGO_WRITE_BEHIND_BATCH_SIZE', 100),
+    'MONGO_WRITE_BEHIND_INTERVAL_SEC': os.environ.get(
+        'MONGO_WRITE_BEHIND_INTERVAL_SEC', 0.5),
+    'MONGO_WRITE_BEHIND_MAX_PENDING': os.environ.get(
+        'MONGO_WRITE_BEHIND_MAX_PENDING', 10000),
 }
@@ -0,0 +1,161 @@
+from ...clients import get_client
+from ...logs import payload
+from ...metrics import timed
+from .mongo_wrapper import MongoDB, insert_missing_op
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from quart import current_app
+from typing import Any, Generic, Mapping, Optional, Sequence, TypeVar
+
+import logging
+
+__all__ = [
+    'AsyncMongoDB',
+    'get_async_mongo',
+]
+
+T = TypeVar('T', bound=Mapping[str, Any])
+
+
+class AsyncMongoDB(Generic[T]):
+    """Async counterpart of :py:class:`MongoDB`, on Motor.
+
+    The client connects on first use, and is bound to the event loop it is
+    first used on.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self,
+                 host: str,
+                 username: str,
+                 password: str,
+                 db: str,
+                 retryWrites: str = 'true',
+                 writeConcern: str = 'majority',
+                 connection_string_format: str = 'standard',
+                 max_pool_size: int = 100,
+                 min_pool_size: int = 0) -> None:
+        prefix = 'mongodb+srv' \
+            if connection_string_format == 'srv' else 'mongodb'
+        connection_string = MongoDB.__CONNECTION_STRING__.format(
+            username=username,
+            password=password,
+            host=host,
+            retryWrites=retryWrites,
+            writeConcern=writeConcern,
+            prefix=prefix)
+
+        self._logger.info(f'Connecting to MongoDB: {host}')
+        self._client: AsyncIOMotorClient = AsyncIOMotorClient(
+            connection_string,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size)
+        self._db = self._client[db]
+
+    def close(self) -> None:
+        self._client.close()
+
+    def get_collection(self, collection_name: str) -> AsyncIOMotorCollection:
+        return self._db[collection_name]
+
+    @timed('mongodb')
+    async def insert(self, collection_name: str,
+                     documents: list[T]) -> list[ObjectId]:
+        if not documents:
+            self._logger.debug('No documents to insert')
+            return []
+
+        self._logger.debug('Inserting %d documents into %s',
+                           len(documents), collection_name)
+        result = await self.get_collection(collection_name).insert_many(
+            documents)
+        return result.inserted_ids
+
+    @timed('mongodb')
+    async def insert_one(self, collection_name: str, document: T) -> ObjectId:
+        self._logger.debug('Inserting 1 document into %s', collection_name)
+        result = await self.get_collection(collection_name).insert_one(
+            document)
+        return result.inserted_id
+
+    @timed('mongodb')
+    async def insert_missing(self,
+                             collection_name: str,
+                             documents: list[T],
+                             key: str = 'id',
+                             overwrite: Sequence[str] = ()) -> list[int]:
+        """Inserts the documents whose `key` is not in the collection.
+
+        See :py:meth:`MongoDB.insert_missing`.
+        """
+        if not documents:
+            self._logger.debug('No documents to insert')
+            return []
+
+        result = await self.get_collection(collection_name).bulk_write([
+            insert_missing_op(document, key, overwrite)
+            for document in documents
+        ], ordered=False)
+
+        self._logger.debug('Inserted %d of %d documents into %s',
+                           result.upserted_count, len(documents),
+                           collection_name)
+        return sorted(result.upserted_ids.keys())
+
+    @timed('mongodb')
+    async def find(self,
+                   collection_name: str,
+                   filter: Optional[dict[str, Any]] = None,
+                   projection: Optional[dict[str, Any]] = None,
+                   sort: Optional[dict[str, Any]] = None,
+                   limit: Optional[int] = None) -> list[T]:
+        limit = limit or 20
+        self._logger.debug('Finding documents in %s: %s, sort: %s, limit: %d',
+                           collection_name, payload(filter), sort, limit)
+        cursor = self.get_collection(collection_name).find(
+            filter=filter,
+            projection=projection,
+            sort=list(sort.items()) if sort else None,
+            limit=limit)
+        return await cursor.to_list(length=limit)
+
+    @timed('mongodb')
+    async def set_fields(self,
+                         collection_name: str,
+                         filter: dict[str, Any],
+                         fields: dict[str, Any]) -> bool:
+        """Sets the fields of the first matching document.
+
+        Returns:
+            bool: Whether a document matched.
+        """
+        result = await self.get_collection(collection_name).update_one(
+            filter, {'$set': fields})
+        return result.matched_count > 0
+
+    @timed('mongodb')
+    async def upsert(self,
+                     collection_name: str,
+                     filter: dict[str, Any],
+                     data: dict[str, Any] | Mapping[str, Any]) -> Any:
+        result = await self.get_collection(collection_name).update_one(
+            filter, {'$set': data}, upsert=True)
+        return result.upserted_id
+
+
+U = TypeVar('U', bound=Mapping[str, Any])
+
+
+def get_async_mongo() -> AsyncMongoDB[U]:  # type: ignore
+    """Returns the process-wide async MongoDB client."""
+    config = current_app.config
+
+    return get_client('async_mongodb', lambda: AsyncMongoDB[U](
+        host=config['MONGO_HOST'],  # type: ignore
+        username=config['MONGO_USERNAME'],  # type: ignore
+        password=config['MONGO_PASSWORD'],  # type: ignore
+        db=config['MONGO_DATABASE'],  # type: ignore
+        max_pool_size=int(config['MONGO_MAX_POOL_SIZE']),  # type: ignore
+        min_pool_size=int(config['MONGO_MIN_POOL_SIZE']),  # type: ignore
+    ))
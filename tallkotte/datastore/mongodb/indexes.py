@@ -0,0 +1,167 @@
+from .mongo_wrapper import MongoDB, get_mongo
+from flask.cli import with_appcontext
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+from typing import Any, Mapping, NotRequired, TypedDict
+
+import click
+import logging
+
+__all__ = [
+    'INDEXES',
+    'sync_indexes',
+    'sync_indexes_command',
+]
+
+_logger = logging.getLogger(__name__)
+
+
+class IndexSpec(TypedDict):
+    name: str
+    keys: list[tuple[str, int]]
+    unique: NotRequired[bool]
+
+
+class IndexReport(TypedDict):
+    created: list[str]
+    existing: list[str]
+    conflicting: list[str]
+    failed: list[str]
+    undeclared: list[str]
+    unused: list[str]
+    dropped: list[str]
+
+
+# Indexes required by the queries in the DAOs, per collection.
+INDEXES: dict[str, list[IndexSpec]] = {
+    'messages': [
+        # messages_dao.find_by_id
+        {'name': 'id_unique', 'keys': [('id', 1)], 'unique': True},
+        # messages_dao.find_by_run_id_and_role, find_by_run_id
+        {'name': 'run_id_role', 'keys': [('run_id', 1), ('role', 1)]},
+        # messages_dao pages of a thread, which sort on (created_at, seq).
+        # Renamed with seq added.
+        {'name': 'thread_id_created_at_seq',
+         'keys': [('thread_id', 1), ('created_at', -1), ('seq', -1)]},
+    ],
+    'threads': [
+        # AssistantThread._get
+        {'name': 'id_unique', 'keys': [('id', 1)], 'unique': True},
+        # assistant_service._find_threads, which pages on (created_at, _id).
+        # Renamed with _id added, so the old index is reported undeclared.
+        {'name': 'assistant_id_created_at_id',
+         'keys': [('assistant_id', 1), ('created_at', -1), ('_id', -1)]},
+    ],
+    'assistants': [
+        # assistants_dao.get
+        {'name': 'id_unique', 'keys': [('id', 1)], 'unique': True},
+    ],
+    'files': [
+        # files_dao.find_by_hash, and deduplication of uploads
+        {'name': 'sha256_unique', 'keys': [('sha256', 1)], 'unique': True},
+    ],
+}
+
+
+def _matches(spec: IndexSpec, info: Mapping[str, Any]) -> bool:
+    return [tuple(key) for key in info['key']] == spec['keys'] \
+        and bool(info.get('unique', False)) == spec.get('unique', False)
+
+
+def _unused_indexes(mongo: MongoDB[Any], collection_name: str) -> list[str]:
+    """Indexes with no recorded use since the server started."""
+    try:
+        stats = mongo.get_collection(collection_name).aggregate(
+            [{'$indexStats': {}}])
+        return [
+            stat['name']
+            for stat in stats
+            if stat['name'] != '_id_' and stat['accesses']['ops'] == 0
+        ]
+    except OperationFailure as e:
+        _logger.warning(f'Index stats not available for {collection_name}: {e}')
+        return []
+
+
+def _sync_collection(mongo: MongoDB[Any],
+                     collection_name: str,
+                     specs: list[IndexSpec],
+                     drop_undeclared: bool) -> IndexReport:
+    collection = mongo.get_collection(collection_name)
+    existing_indexes = collection.index_information()
+    declared = {spec['name'] for spec in specs}
+
+    report = IndexReport(created=[], existing=[], conflicting=[], failed=[],
+                         undeclared=[], unused=[], dropped=[])
+
+    missing: list[IndexModel] = []
+    for spec in specs:
+        info = existing_indexes.get(spec['name'])
+        if info is None:
+            missing.append(IndexModel(spec['keys'],
+                                      name=spec['name'],
+                                      unique=spec.get('unique', False)))
+        elif _matches(spec, info):
+            report['existing'].append(spec['name'])
+        else:
+            report['conflicting'].append(spec['name'])
+
+    for index in missing:
+        try:
+            report['created'] += collection.create_indexes([index])
+        except OperationFailure as e:
+            # E.g. duplicate values in existing documents for a unique index.
+            _logger.error(f'Index {index.document['name']} not created '
+                          f'on {collection_name}: {e}')
+            report['failed'].append(index.document['name'])
+
+    for name in existing_indexes:
+        if name != '_id_' and name not in declared:
+            report['undeclared'].append(name)
+            if drop_undeclared:
+                collection.drop_index(name)
+                report['dropped'].append(name)
+
+    report['unused'] = _unused_indexes(mongo, collection_name)
+    return report
+
+
+def sync_indexes(mongo: MongoDB[Any],
+                 *,
+                 drop_undeclared: bool = False) -> dict[str, IndexReport]:
+    """Creates the declared indexes that are missing. Safe to run repeatedly.
+
+    Existing indexes with the same name but a different definition are
+    reported as conflicting, and left as they are.
+
+    Args:
+        mongo (MongoDB): Database to sync.
+        drop_undeclared (bool): Drop indexes that are not in `INDEXES`.
+
+    Returns:
+        dict[str, IndexReport]: Report per collection.
+    """
+    reports: dict[str, IndexReport] = {}
+    for collection_name, specs in INDEXES.items():
+        report = _sync_collection(
+            mongo, collection_name, specs, drop_undeclared)
+        _logger.info(f'Indexes on {collection_name}: {report}')
+        if report['conflicting'] or report['failed']:
+            _logger.warning(f'Indexes not synced on {collection_name}: '
+                            f'{report['conflicting'] + report['failed']}')
+        reports[collection_name] = report
+    return reports
+
+
+@click.command('sync-indexes')
+@click.option('--drop-undeclared', is_flag=True, default=False,
+              help='Drop indexes that are not declared.')
+@with_appcontext
+def sync_indexes_command(drop_undeclared: bool) -> None:
+    """Create missing MongoDB indexes, and report unused ones."""
+    reports = sync_indexes(get_mongo(), drop_undeclared=drop_undeclared)
+    for collection_name, report in reports.items():
+        click.echo(collection_name)
+        for status, names in report.items():
+            if names:
+                click.echo(f'  {status}: {', '.join(names)}')  # type: ignore
@@ -1,8 +1,11 @@
+from ...clients import get_client
+from ...logs import payload
+from ...metrics import timed
 from bson.objectid import ObjectId
-from flask import current_app, g
-from pymongo import MongoClient
+from flask import current_app
+from pymongo import MongoClient, UpdateOne
 from pymongo.collection import Collection
-from typing import Any, Generic, Mapping, Optional, TypeVar
+from typing import Any, Generic, Mapping, Optional, Sequence, TypeVar
 
 import logging
 
@@ -10,6 +13,21 @@ import logging
 T = TypeVar('T', bound=Mapping[str, Any])
 
 
+def insert_missing_op(document: Mapping[str, Any],
+                      key: str = 'id',
+                      overwrite: Sequence[str] = ()) -> UpdateOne:
+    """Upsert inserting the document if no document has its `key`, and
+    otherwise setting only its `overwrite` fields."""
+    update: dict[str, Any] = {'$setOnInsert': {
+        field: value for field, value in document.items()
+        if field not in overwrite}}
+    fields = {field: document[field] for field in overwrite
+              if field in document}
+    if fields:
+        update['$set'] = fields
+    return UpdateOne({key: document[key]}, update, upsert=True)
+
+
 class MongoDB(Generic[T]):
     _logger = logging.getLogger(__name__)
 
@@ -22,7 +40,9 @@ class MongoDB(Generic[T]):
                  db: str,
                  retryWrites: str = 'true',
                  writeConcern: str = 'majority',
-                 connection_string_format: str = 'standard') -> None:
+                 connection_string_format: str = 'standard',
+                 max_pool_size: int = 100,
+                 min_pool_size: int = 0) -> None:
         prefix = 'mongodb+srv' \
             if connection_string_format == 'srv' else 'mongodb'
         connection_string = self.__CONNECTION_STRING__.format(
@@ -33,11 +53,15 @@ class MongoDB(Generic[T]):
             writeConcern=writeConcern,
             prefix=prefix)
 
-        self._logger.info(f'Connecting to MongoDB: {connection_string}')
-        self._client = MongoClient[T](connection_string)
+        # The connection string has the password.
+        self._logger.info('Connecting to MongoDB: %s', host)
+        self._client = MongoClient[T](connection_string,
+                                      maxPoolSize=max_pool_size,
+                                      minPoolSize=min_pool_size)
 
         server_info = self._client.server_info()
-        self._logger.info(f'Connected to MongoDB: {server_info}')
+        self._logger.info('Connected to MongoDB %s',
+                          server_info.get('version'))
 
         self._db = self._client[db]
 
@@ -47,25 +71,58 @@ class MongoDB(Generic[T]):
     def get_collection(self, collection_name: str) -> Collection[T]:
         return self._db[collection_name]
 
+    @timed('mongodb')
     def insert(self, collection_name: str, documents: list[T]) -> list[ObjectId]:
         if not documents:
-            self._logger.info('No documents to insert')
+            self._logger.debug('No documents to insert')
             return []
 
         collection = self.get_collection(collection_name)
 
-        self._logger.info(
-            f'Inserting {len(documents)} documents into {collection_name}')
+        self._logger.debug('Inserting %d documents into %s',
+                           len(documents), collection_name)
         result = collection.insert_many(documents)
         return result.inserted_ids
 
+    @timed('mongodb')
     def insert_one(self, collection_name: str, document: T) -> ObjectId:
-        self._logger.info(f'Inserting 1 document into {collection_name}')
         collection = self.get_collection(collection_name)
         result = collection.insert_one(document)
-        self._logger.info(f'inserted_id: {result.inserted_id}')
+        self._logger.debug('Inserted %s into %s',
+                           result.inserted_id, collection_name)
         return result.inserted_id
 
+    @timed('mongodb')
+    def insert_missing(self,
+                       collection_name: str,
+                       documents: list[T],
+                       key: str = 'id',
+                       overwrite: Sequence[str] = ()) -> list[int]:
+        """Inserts the documents whose `key` is not in the collection.
+
+        Done as a single unordered bulk write of upserts, so the cost is one
+        round trip regardless of the number of documents. Documents that exist
+        are not modified, except for their `overwrite` fields, which are set.
+
+        Returns:
+            list[int]: Positions in `documents` of the inserted documents.
+        """
+        if not documents:
+            self._logger.debug('No documents to insert')
+            return []
+
+        collection = self.get_collection(collection_name)
+        result = collection.bulk_write([
+            insert_missing_op(document, key, overwrite)
+            for document in documents
+        ], ordered=False)
+
+        self._logger.debug('Inserted %d of %d documents into %s',
+                           result.upserted_count, len(documents),
+                           collection_name)
+        return sorted(result.upserted_ids.keys())
+
+    @timed('mongodb')
     def find(self,
              collection_name: str,
              filter: Optional[dict[str, Any]] = None,
@@ -73,10 +130,9 @@ class MongoDB(Generic[T]):
              sort: Optional[dict[str, Any]] = None,
              limit: Optional[int] = None) -> list[T]:
         limit = limit or 20
-        self._logger.info(f'Finding documents in {collection_name}')
-        self._logger.info(f'filter: {filter}')
-        self._logger.info(f'projection: {projection}')
-        self._logger.info(f'sort: {sort}, limit: {limit}')
+        self._logger.debug('Finding documents in %s: %s, projection: %s, '
+                           'sort: %s, limit: %d', collection_name,
+                           payload(filter), projection, sort, limit)
         collection = self.get_collection(collection_name)
         result_cursor = collection.find(
             filter=filter,
@@ -85,6 +141,22 @@ class MongoDB(Generic[T]):
             limit=limit)
         return [document for document in result_cursor]
 
+    @timed('mongodb')
+    def set_fields(self,
+                   collection_name: str,
+                   filter: dict[str, Any],
+                   fields: dict[str, Any]) -> bool:
+        """Sets the fields of the first matching document, leaving the rest
+        of it as it is.
+
+        Returns:
+            bool: Whether a document matched.
+        """
+        collection = self.get_collection(collection_name)
+        result = collection.update_one(filter, {'$set': fields})
+        return result.matched_count > 0
+
+    @timed('mongodb')
     def upsert(self,
                collection_name: str,
                filter: dict[str, Any],
@@ -99,12 +171,18 @@ U = TypeVar('U', bound=Mapping[str, Any])
 
 
 def get_mongo() -> MongoDB[U]:  # type: ignore
-    if 'mongodb' not in g:
-        g.mongodb = MongoDB[U](
-            host=current_app.config['MONGO_HOST'],  # type: ignore
-            username=current_app.config['MONGO_USERNAME'],  # type: ignore
-            password=current_app.config['MONGO_PASSWORD'],  # type: ignore
-            db=current_app.config['MONGO_DATABASE']  # type: ignore
-        )
-
-    return g.mongodb
+    """Returns the process-wide MongoDB client.
+
+    The client is created on first use from the app config, and shared by all
+    requests and threads. MongoClient pools its own connections.
+    """
+    config = current_app.config
+
+    return get_client('mongodb', lambda: MongoDB[U](
+        host=config['MONGO_HOST'],  # type: ignore
+        username=config['MONGO_USERNAME'],  # type: ignore
+        password=config['MONGO_PASSWORD'],  # type: ignore
+        db=config['MONGO_DATABASE'],  # type: ignore
+        max_pool_size=int(config['MONGO_MAX_POOL_SIZE']),  # type: ignore
+        min_pool_size=int(config['MONGO_MIN_POOL_SIZE']),  # type: ignore
+    ))
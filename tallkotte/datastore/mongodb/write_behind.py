@@ -0,0 +1,176 @@
+from ...clients import get_client
+from .mongo_wrapper import MongoDB, get_mongo
+from flask import current_app
+from typing import Any, Callable, Generic, Mapping, Optional, Sequence, TypeVar
+
+import atexit
+import logging
+import threading
+
+__all__ = [
+    'WriteBehindBuffer',
+    'get_write_behind',
+]
+
+T = TypeVar('T', bound=Mapping[str, Any])
+
+
+class WriteBehindBuffer(Generic[T]):
+    """Buffers inserts into a collection, and writes them in batches.
+
+    Documents added by any thread are written by a background thread, as
+    unordered bulk upserts on `key` (see :py:meth:`MongoDB.insert_missing`),
+    when `batch_size` documents are pending, every `interval` seconds, and at
+    exit. As the upserts only insert missing documents, a batch can be
+    retried, and a document that was already saved is not modified, except
+    for its `overwrite` fields.
+
+    Buffered documents are lost if the process dies before they are written.
+    A batch that fails is kept and retried at the next flush; once
+    `max_pending` documents are pending, `add` writes them itself, and raises
+    if that fails.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self,
+                 mongo: MongoDB[T],
+                 collection_name: str,
+                 *,
+                 key: str = 'id',
+                 overwrite: Sequence[str] = (),
+                 batch_size: int = 100,
+                 interval: float = 0.5,
+                 max_pending: int = 10000,
+                 on_flush: Optional[Callable[[list[T]], Any]] = None) -> None:
+        self._mongo = mongo
+        self._collection_name = collection_name
+        self._key = key
+        self._overwrite = overwrite
+        self._batch_size = batch_size
+        self._interval = interval
+        self._max_pending = max_pending
+        self._on_flush = on_flush
+
+        self._condition = threading.Condition()
+        # Held while writing, so batches are written in the order added.
+        self._flush_lock = threading.Lock()
+        self._pending: list[T] = []
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+        atexit.register(self.close)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add(self, documents: list[T]) -> None:
+        if not documents:
+            return
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError(
+                    f'Write-behind for {self._collection_name} is closed')
+            self._pending.extend(documents)
+            pending = len(self._pending)
+            self._start()
+            if pending >= self._batch_size:
+                self._condition.notify()
+
+        if pending >= self._max_pending:
+            self._logger.warning(f'{pending} documents pending for '
+                                 f'{self._collection_name}, flushing')
+            self.flush(raise_errors=True)
+
+    def flush(self, *, raise_errors: bool = False) -> int:
+        """Writes all pending documents.
+
+        Returns:
+            int: Number of documents written.
+        """
+        with self._flush_lock:
+            with self._condition:
+                documents, self._pending = self._pending, []
+
+            written = 0
+            try:
+                for start in range(0, len(documents), self._batch_size):
+                    batch = documents[start:start + self._batch_size]
+                    self._mongo.insert_missing(
+                        self._collection_name, batch, self._key,
+                        self._overwrite)
+                    written += len(batch)
+            except Exception as e:
+                self._logger.error(f'Write-behind to {self._collection_name} '
+                                   f'failed, {len(documents) - written} '
+                                   f'documents pending: {e}')
+                with self._condition:
+                    self._pending[:0] = documents[written:]
+                if raise_errors:
+                    raise
+            finally:
+                if written and self._on_flush:
+                    self._notify_flushed(documents[:written])
+
+            return written
+
+    def _notify_flushed(self, documents: list[T]) -> None:
+        try:
+            self._on_flush(documents)  # type: ignore[misc]
+        except Exception as e:
+            self._logger.error(f'Write-behind callback failed: {e}')
+
+    def close(self) -> None:
+        """Writes the pending documents, and stops accepting new ones."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._pending:
+            self.flush()
+
+    def _start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._write_pending,
+            name=f'write-behind-{self._collection_name}',
+            daemon=True)
+        self._thread.start()
+
+    def _write_pending(self) -> None:
+        while True:
+            with self._condition:
+                if len(self._pending) < self._batch_size:
+                    self._condition.wait(self._interval)
+                if self._closed:
+                    return
+                if not self._pending:
+                    continue
+            try:
+                self.flush()
+            except Exception as e:
+                self._logger.error(f'Write-behind flush failed: {e}')
+
+
+def get_write_behind(
+        collection_name: str,
+        on_flush: Optional[Callable[[list[T]], Any]] = None,
+        overwrite: Sequence[str] = ()) -> Optional[WriteBehindBuffer[T]]:
+    """Returns the process-wide write-behind buffer for the collection, or None
+    if write-behind is disabled."""
+    config = current_app.config
+    if not config['MONGO_WRITE_BEHIND']:
+        return None
+
+    mongo = get_mongo()
+    return get_client(f'write_behind:{collection_name}', lambda: WriteBehindBuffer[T](
+        mongo,
+        collection_name,
+        overwrite=overwrite,
+        batch_size=int(config['MONGO_WRITE_BEHIND_BATCH_SIZE']),  # type: ignore
+        interval=float(config['MONGO_WRITE_BEHIND_INTERVAL_SEC']),  # type: ignore
+        max_pending=int(config['MONGO_WRITE_BEHIND_MAX_PENDING']),  # type: ignore
+        on_flush=on_flush,
+    ))
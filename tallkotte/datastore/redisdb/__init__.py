@@ -9,4 +9,16 @@ redis_config = {
     'REDIS_HOST': os.environ.get('REDIS_HOST', 'localhost'),
     'REDIS_PORT': os.environ.get('REDIS_PORT', 6379),
     'REDIS_DATABASE': os.environ.get('REDIS_DATABASE', 0),
+    'REDIS_MAX_CONNECTIONS': os.environ.get('REDIS_MAX_CONNECTIONS', 50),
+    'CACHE_CODEC': os.environ.get('CACHE_CODEC', 'json'),
+    'CACHE_LOCAL_ENABLED': os.environ.get(
+        'CACHE_LOCAL_ENABLED', 'false').lower() == 'true',
+    'CACHE_LOCAL_MAX_ENTRIES': os.environ.get('CACHE_LOCAL_MAX_ENTRIES', 1024),
+    'CACHE_LOCAL_TTL': os.environ.get('CACHE_LOCAL_TTL', 30),
+    'CACHE_REFILL_LOCK_ENABLED': os.environ.get(
+        'CACHE_REFILL_LOCK_ENABLED', 'false').lower() == 'true',
+    'CACHE_REFILL_LOCK_TTL': os.environ.get('CACHE_REFILL_LOCK_TTL', 5),
+    'CACHE_REFILL_WAIT': os.environ.get('CACHE_REFILL_WAIT', 1.0),
+    'CACHE_THREAD_MESSAGES_MAX': os.environ.get(
+        'CACHE_THREAD_MESSAGES_MAX', 200),
 }
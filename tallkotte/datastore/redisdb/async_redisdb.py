@@ -0,0 +1,169 @@
+from ...clients import get_client
+from ...metrics import timed
+from quart import current_app
+from redis.asyncio import ConnectionPool, Redis
+from redis.asyncio.client import Pipeline
+from typing import Any, Mapping, Optional
+
+import logging
+
+__all__ = [
+    'AsyncRedisDB',
+    'get_async_redis',
+]
+
+
+def _is_dict_key(value: Any) -> bool:
+    # Dicts are only written by clients that decode responses.
+    return isinstance(value, str) and value.startswith('__dict__')
+
+
+class AsyncRedisDB:
+    """Async counterpart of :py:class:`RedisDB`, on `redis.asyncio`.
+
+    Values are stored the same way, so both clients can read each other's
+    writes. The connection pool is bound to the event loop it is first used
+    on.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, host: str, port: int, db: int,
+                 max_connections: Optional[int] = None,
+                 decode_responses: bool = True):
+        self._host = host
+        self._port = port
+        self._pool = ConnectionPool(host=host, port=port, db=db,
+                                    max_connections=max_connections,
+                                    decode_responses=decode_responses)
+        self._connection = Redis(connection_pool=self._pool)
+        self._logger.info('Redis pool created [%s:%s]', host, port)
+
+    @property
+    def connection(self) -> Redis:
+        return self._connection
+
+    async def close(self) -> None:
+        await self._connection.aclose()  # type: ignore[attr-defined]
+        await self._pool.disconnect()
+
+    @timed('redis')
+    async def read(self, key: str, ttl: Optional[int] = None) -> Any | None:
+        """Reads the key. If `ttl` is given, the key's TTL is reset to it."""
+        c = self._connection
+        value = await c.getex(key, ex=ttl) if ttl else await c.get(key)
+
+        if _is_dict_key(value):
+            return await c.hgetall(value)  # type: ignore[misc]
+
+        return value
+
+    @timed('redis')
+    async def read_many(self, keys: list[str],
+                        ttl: Optional[int] = None) -> list[Any | None]:
+        """Reads the keys in one round trip. See :py:meth:`RedisDB.read_many`."""
+        if not keys:
+            return []
+
+        c = self._connection
+        if ttl:
+            pipeline = c.pipeline(transaction=False)
+            for key in keys:
+                pipeline.getex(key, ex=ttl)
+            values: list[Any] = await pipeline.execute()
+        else:
+            values = await c.mget(keys)
+
+        dict_keys = [value for value in values if _is_dict_key(value)]
+        if dict_keys:
+            pipeline = c.pipeline(transaction=False)
+            for dict_key in dict_keys:
+                pipeline.hgetall(dict_key)
+            dicts = dict(zip(dict_keys, await pipeline.execute()))
+            values = [
+                dicts[value] if value in dicts else value
+                for value in values
+            ]
+
+        return values
+
+    def _queue_write(self, pipeline: Pipeline,
+                     key: str, value: Any, ttl: Optional[int]) -> None:
+        if type(value) is dict:
+            dict_key = f'__dict__{key}'
+            pipeline.hset(dict_key, mapping=value)  # type: ignore
+            if ttl:
+                pipeline.expire(dict_key, ttl)
+            pipeline.set(key, dict_key, ex=ttl)
+        else:
+            pipeline.set(key, value, ex=ttl)
+
+    @timed('redis')
+    async def write_many(self,
+                         values: Mapping[str, Any],
+                         ttl: Optional[int] | Mapping[str, Optional[int]] = None,
+                         *,
+                         transaction: bool = False) -> bool:
+        """Writes the keys in one round trip. See :py:meth:`RedisDB.write_many`."""
+        if not values:
+            return True
+
+        pipeline = self._connection.pipeline(transaction=transaction)
+        # Positions of the SETs. HSET returns the number of new fields, which
+        # is 0 when a dict overwrites the same fields.
+        sets: list[int] = []
+        for key, value in values.items():
+            key_ttl = ttl.get(key) if isinstance(ttl, Mapping) else ttl
+            self._queue_write(pipeline, key, value, key_ttl)
+            sets.append(len(pipeline) - 1)
+
+        results = await pipeline.execute()
+        self._logger.debug('Written %d keys', len(values))
+        return all(results[i] for i in sets)
+
+    async def write(self, key: str, value: Any,
+                    ttl: Optional[int] = None) -> bool:
+        """Writes the key, expiring it after `ttl` seconds if given."""
+        return await self.write_many({key: value}, ttl,
+                                     transaction=type(value) is dict)
+
+    @timed('redis')
+    async def delete(self, *keys: str) -> int:
+        if not keys:
+            return 0
+        deleted = await self._connection.delete(*keys)
+        self._logger.debug('Deleted %d of %d keys', deleted, len(keys))
+        return deleted
+
+    @timed('redis')
+    async def publish(self, channel: str, message: str) -> int:
+        return await self._connection.publish(channel, message)
+
+    @timed('redis')
+    async def publish_many(self, messages: list[tuple[str, str]]) -> None:
+        """Publishes the messages in one round trip. See
+        :py:meth:`RedisDB.publish_many`."""
+        if not messages:
+            return
+        pipeline = self._connection.pipeline(transaction=False)
+        for channel, message in messages:
+            pipeline.publish(channel, message)
+        await pipeline.execute()
+
+
+def get_async_redis(*, binary: bool = False) -> AsyncRedisDB:
+    """Returns the process-wide async Redis client.
+
+    With `binary`, the client returns values as bytes instead of str.
+    """
+    config = current_app.config
+
+    return get_client(
+        'async_redis_binary' if binary else 'async_redis',
+        lambda: AsyncRedisDB(
+            host=config['REDIS_HOST'],  # type: ignore
+            port=int(config['REDIS_PORT']),  # type: ignore
+            db=int(config['REDIS_DATABASE']),  # type: ignore
+            max_connections=int(config['REDIS_MAX_CONNECTIONS']),  # type: ignore
+            decode_responses=not binary
+        ))
@@ -0,0 +1,197 @@
+from .redisdb import RedisDB
+from typing import Any, Mapping, Optional, TypedDict
+
+import json
+import logging
+import os
+import socket
+import uuid
+
+__all__ = [
+    'Job',
+    'JobQueue',
+]
+
+
+class Job(TypedDict):
+    # Stream entry ID, used to acknowledge the job.
+    id: str
+    # Jobs with the same key are not queued twice.
+    key: str
+    data: dict[str, Any]
+    # Number of times the job was delivered, including this one.
+    attempts: int
+
+
+class JobQueue:
+    """Durable job queue, on a Redis stream with a consumer group.
+
+    Jobs stay pending in the group until they are acknowledged. A job that
+    is not acknowledged within `claim_idle_sec`, because its worker died or
+    is stuck, is claimed by another worker. A job is delivered at most
+    `max_attempts` times; it is then moved to the `<name>:dead` stream.
+
+    Any number of workers, in any number of processes and hosts, can receive
+    from the same queue; each job is delivered to one of them at a time.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self,
+                 redis: RedisDB,
+                 name: str,
+                 *,
+                 group: str = 'workers',
+                 consumer: Optional[str] = None,
+                 claim_idle_sec: float = 120,
+                 max_attempts: int = 3) -> None:
+        self._redis = redis
+        self._name = name
+        self._group = group
+        self._consumer = consumer \
+            or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._claim_idle_ms = int(claim_idle_sec * 1000)
+        self._max_attempts = max_attempts
+        self._group_created = False
+
+    @property
+    def dead_letters(self) -> str:
+        return f'{self._name}:dead'
+
+    def _dedup_key(self, key: str) -> str:
+        return f'{self._name}:key:{key}'
+
+    def _ensure_group(self) -> None:
+        if self._group_created:
+            return
+        try:
+            self._redis.connection.xgroup_create(
+                self._name, self._group, id='0', mkstream=True)
+        except Exception as e:
+            # BUSYGROUP: created by another worker.
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_created = True
+
+    def enqueue(self, key: str, data: Mapping[str, Any]) -> Optional[str]:
+        """Adds a job, unless a job with the same key is queued or running.
+
+        Returns:
+            Optional[str]: ID of the job, or None if it was already queued.
+        """
+        self._ensure_group()
+        # The dedup key outlives a lost job, at most by the time it would
+        # have taken to be claimed and retried.
+        ttl_ms = self._claim_idle_ms * (self._max_attempts + 1)
+        if not self._redis.connection.set(self._dedup_key(key), 1,
+                                          nx=True, px=ttl_ms):
+            self._logger.info(f'Job {key} is already queued in {self._name}')
+            return None
+
+        job_id = self._redis.connection.xadd(
+            self._name, {'key': key, 'data': json.dumps(data)})
+        self._logger.info(f'Job {key} queued in {self._name}: {job_id}')
+        return job_id  # type: ignore[return-value]
+
+    def _to_job(self, entry_id: str, fields: Mapping[str, str],
+                deliveries: int) -> Job:
+        # Attempts before a retry are carried over in the new entry.
+        return Job(id=entry_id,
+                   key=fields['key'],
+                   data=json.loads(fields['data']),
+                   attempts=int(fields.get('attempts', 0)) + deliveries)
+
+    def _claim_stale(self, count: int) -> list[Job]:
+        """Claims jobs whose worker has not acknowledged them in time."""
+        # Redis 7 adds the IDs of deleted entries to the reply, which Redis
+        # 6.2 returns as nil entries instead.
+        reply = self._redis.connection.xautoclaim(
+            self._name, self._group, self._consumer,
+            min_idle_time=self._claim_idle_ms, start_id='0-0', count=count)
+        entries = [
+            (entry_id, fields)
+            for entry_id, fields in reply[1]  # type: ignore[index]
+            if entry_id is not None
+        ]
+        if not entries:
+            return []
+
+        pending = self._redis.connection.xpending_range(
+            self._name, self._group, min=entries[0][0], max=entries[-1][0],
+            count=len(entries))
+        deliveries = {
+            info['message_id']: info['times_delivered']
+            for info in pending  # type: ignore
+        }
+
+        jobs: list[Job] = []
+        for entry_id, fields in entries:
+            if not fields:
+                # Deleted from the stream.
+                self._redis.connection.xack(self._name, self._group, entry_id)
+                continue
+            job = self._to_job(entry_id, fields, deliveries.get(entry_id, 1))
+            if job['attempts'] > self._max_attempts:
+                self.fail(job, 'Worker did not finish the job')
+            else:
+                self._logger.warning(f'Claimed job {job['key']} '
+                                     f'(attempt {job['attempts']})')
+                jobs.append(job)
+        return jobs
+
+    def receive(self, count: int = 1, block_sec: float = 5) -> list[Job]:
+        """Receives up to `count` jobs, waiting up to `block_sec` for one.
+
+        Stale jobs of other workers are received first.
+        """
+        self._ensure_group()
+        jobs = self._claim_stale(count)
+        if jobs:
+            return jobs
+
+        response = self._redis.connection.xreadgroup(
+            self._group, self._consumer, {self._name: '>'},
+            count=count, block=int(block_sec * 1000))
+        return [
+            self._to_job(entry_id, fields, 1)
+            for _, entries in response or []  # type: ignore
+            for entry_id, fields in entries
+        ]
+
+    def ack(self, job: Job) -> None:
+        """Marks the job as done."""
+        pipeline = self._redis.connection.pipeline(transaction=True)
+        pipeline.xack(self._name, self._group, job['id'])
+        pipeline.xdel(self._name, job['id'])
+        pipeline.delete(self._dedup_key(job['key']))
+        pipeline.execute()
+
+    def retry(self, job: Job, error: str) -> None:
+        """Queues the job again, or moves it to the dead letters if it was
+        attempted `max_attempts` times."""
+        if job['attempts'] >= self._max_attempts:
+            self.fail(job, error)
+            return
+
+        self._logger.warning(f'Retrying job {job['key']} '
+                             f'(attempt {job['attempts']}): {error}')
+        pipeline = self._redis.connection.pipeline(transaction=True)
+        pipeline.xack(self._name, self._group, job['id'])
+        pipeline.xdel(self._name, job['id'])
+        pipeline.xadd(self._name, {'key': job['key'],
+                                   'data': json.dumps(job['data']),
+                                   'attempts': job['attempts']})
+        pipeline.execute()
+
+    def fail(self, job: Job, error: str) -> None:
+        """Moves the job to the dead letters."""
+        self._logger.error(f'Job {job['key']} failed after '
+                           f'{job['attempts']} attempts: {error}')
+        pipeline = self._redis.connection.pipeline(transaction=True)
+        pipeline.xadd(self.dead_letters, {'key': job['key'],
+                                          'data': json.dumps(job['data']),
+                                          'error': error})
+        pipeline.xack(self._name, self._group, job['id'])
+        pipeline.xdel(self._name, job['id'])
+        pipeline.delete(self._dedup_key(job['key']))
+        pipeline.execute()
@@ -1,31 +1,47 @@
-from flask import current_app, g
-from redis import Redis
-from typing import Any, Optional
+from ...clients import get_client
+from ...logs import payload
+from ...metrics import timed
+from flask import current_app
+from redis import ConnectionPool, Redis
+from redis.client import Pipeline
+from redis.exceptions import ResponseError
+from typing import Any, Mapping, Optional
 
 import logging
 
+_logger = logging.getLogger(__name__)
+
+
+def _is_dict_key(value: Any) -> bool:
+    # Dicts are only written by clients that decode responses.
+    return isinstance(value, str) and value.startswith('__dict__')
+
 
 class RedisDB:
     _connection: Optional[Redis] = None
     _is_connected: bool = False
 
-    def __init__(self, host: str, port: int, db: int):
+    def __init__(self, host: str, port: int, db: int,
+                 max_connections: Optional[int] = None,
+                 decode_responses: bool = True):
         self._host = host
         self._port = port
         self._db = db
+        self._pool = ConnectionPool(host=host, port=port, db=db,
+                                    max_connections=max_connections,
+                                    decode_responses=decode_responses)
 
         self.connect()
 
     def connect(self):
-        logging.info(f'Connecting to Redis [{self._host}:{self._port}]')
-        self._connection = Redis(
-            self._host, self._port, self._db, decode_responses=True)
+        _logger.info('Connecting to Redis [%s:%s]', self._host, self._port)
+        self._connection = Redis(connection_pool=self._pool)
 
         if not self._connection.ping():  # type: ignore
             raise RuntimeError('Redis connection failed')
 
         self._is_connected = True
-        logging.info('Redis connection established')
+        _logger.info('Redis connection established')
 
     @property
     def connection(self) -> Redis:
@@ -34,58 +50,189 @@ class RedisDB:
 
         return self._connection  # type: ignore[return-value]
 
-    def read(self, key: str) -> Any | None:
+    @timed('redis')
+    def read(self, key: str, ttl: Optional[int] = None) -> Any | None:
+        """Reads the key. If `ttl` is given, the key's TTL is reset to it."""
         c = self.connection
-        value = c.get(key)  # type: ignore[no-any-return]
+        value = c.getex(key, ex=ttl) if ttl \
+            else c.get(key)  # type: ignore[no-any-return]
 
-        logging.debug(f'Read: {key} -> {type(value)} {value}')  # type: ignore
+        _logger.debug('Read: %s -> %s', key, payload(value))
 
-        if value is not None and value.startswith('__dict__'):  # type: ignore
+        if _is_dict_key(value):
             return self.h_read(value)  # type: ignore[no-any-return]
 
         return value  # type: ignore[return-value]
 
-    def write(self, key: str, value: Any) -> bool:
-        if value is None:
-            logging.warning('Value is None, ignoring.')
+    @timed('redis')
+    def read_many(self, keys: list[str],
+                  ttl: Optional[int] = None) -> list[Any | None]:
+        """Reads the keys in one round trip, with MGET.
+
+        If `ttl` is given, the keys' TTLs are reset to it, with a pipeline of
+        GETEX. Dict values take one more round trip for all of them.
+        """
+        if not keys:
+            return []
 
         c = self.connection
+        if ttl:
+            pipeline = c.pipeline(transaction=False)
+            for key in keys:
+                pipeline.getex(key, ex=ttl)
+            values: list[Any] = pipeline.execute()
+        else:
+            values = c.mget(keys)  # type: ignore
+
+        _logger.debug('Read %d keys', len(keys))
+
+        dict_keys = [value for value in values if _is_dict_key(value)]
+        if dict_keys:
+            pipeline = c.pipeline(transaction=False)
+            for dict_key in dict_keys:
+                pipeline.hgetall(dict_key)
+            dicts = dict(zip(dict_keys, pipeline.execute()))
+            values = [
+                dicts[value] if value in dicts else value
+                for value in values
+            ]
+
+        return values
+
+    def _queue_write(self, pipeline: Pipeline,
+                     key: str, value: Any, ttl: Optional[int]) -> None:
         if type(value) is dict:
             dict_key = f'__dict__{key}'
-            self.h_set(dict_key, value)  # type: ignore
-            set_successful = c.set(key, dict_key)  # type: ignore
+            pipeline.hset(dict_key, mapping=value)  # type: ignore
+            if ttl:
+                pipeline.expire(dict_key, ttl)
+            pipeline.set(key, dict_key, ex=ttl)
+        else:
+            pipeline.set(key, value, ex=ttl)
+
+    @timed('redis')
+    def write_many(self,
+                   values: Mapping[str, Any],
+                   ttl: Optional[int] | Mapping[str, Optional[int]] = None,
+                   *,
+                   transaction: bool = False) -> bool:
+        """Writes the keys in one round trip, with a pipeline.
+
+        Args:
+            values (Mapping[str, Any]): Values by key.
+            ttl (int | Mapping[str, int], optional): TTL for all the keys, or
+                by key.
+            transaction (bool): Apply the writes atomically, with MULTI/EXEC.
+
+        Returns:
+            bool: Whether all the writes succeeded.
+        """
+        if not values:
+            return True
+
+        pipeline = self.connection.pipeline(transaction=transaction)
+        # Positions of the SETs. HSET returns the number of new fields, which
+        # is 0 when a dict overwrites the same fields.
+        sets: list[int] = []
+        for key, value in values.items():
+            key_ttl = ttl.get(key) if isinstance(ttl, Mapping) else ttl
+            self._queue_write(pipeline, key, value, key_ttl)
+            sets.append(len(pipeline) - 1)
+
+        results = pipeline.execute()
+        _logger.debug('Written %d keys', len(values))
+        return all(results[i] for i in sets)
+
+    @timed('redis')
+    def write(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """Writes the key, expiring it after `ttl` seconds if given."""
+        if value is None:
+            _logger.warning('Value of %s is None, ignoring.', key)
+
+        c = self.connection
+        if type(value) is dict:
+            # HSET and SET in one round trip, applied together.
+            pipeline = c.pipeline(transaction=True)
+            self._queue_write(pipeline, key, value, ttl)
+            set_successful = pipeline.execute()[-1]
         else:
-            set_successful = c.set(key, value)  # type: ignore
+            set_successful = c.set(key, value, ex=ttl)  # type: ignore
 
         if set_successful:
-            logging.info('Written: {} -> {}'.format(key, value))  # type: ignore
+            _logger.debug('Written: %s -> %s', key, payload(value))
         else:
-            logging.warning(
-                'Write failed: {} -> {}'.format(key, value))  # type: ignore
+            _logger.warning('Write failed: %s -> %s', key, payload(value))
 
         return set_successful  # type: ignore[return-value]
 
+    @timed('redis')
+    def delete(self, *keys: str) -> int:
+        if not keys:
+            return 0
+        deleted = self.connection.delete(*keys)  # type: ignore
+        _logger.debug('Deleted %d of %d keys', deleted, len(keys))
+        return deleted  # type: ignore[return-value]
+
+    @timed('redis')
+    def publish(self, channel: str, message: str) -> int:
+        return self.connection.publish(channel, message)  # type: ignore
+
+    @timed('redis')
+    def publish_many(self, messages: list[tuple[str, str]]) -> None:
+        """Publishes the messages on their channels in one round trip."""
+        if not messages:
+            return
+        pipeline = self.connection.pipeline(transaction=False)
+        for channel, message in messages:
+            pipeline.publish(channel, message)
+        pipeline.execute()
+
     def h_read(self, key: str) -> dict[Any, Any] | None:
-        logging.info('Reading dict: {}'.format(key))
         dict_value = self.connection.hgetall(key)  # type: ignore[no-any-return]
-        logging.info('h_read: {} -> ({}) {}'.format(key,
-                     type(dict_value), dict_value))  # type: ignore
+        _logger.debug('h_read: %s -> %s', key, payload(dict_value))
+        return dict_value  # type: ignore[return-value]
 
     def h_set(self, key: str, value: dict[Any, Any]) -> bool:
-        logging.info(
-            'Setting dict: {} -> ({}) {}'.format(key, type(value), value))
         hset_response = self.connection.hset(  # type: ignore[no-any-return]
             key, mapping=value)
-        logging.info('h_set: {} -> ({}) {}'.format(key,
-                     type(hset_response), hset_response))
+        _logger.debug('h_set: %s -> %s: %s', key, payload(value),
+                      hset_response)
         return hset_response  # type: ignore[return-value]
 
-
-def get_redis() -> RedisDB:
-    if 'redis' not in g:
-        g.redis = RedisDB(
-            host=current_app.config['REDIS_HOST'],  # type: ignore
-            port=current_app.config['REDIS_PORT'],  # type: ignore
-            db=current_app.config['REDIS_DATABASE']  # type: ignore
-        )
-    return g.redis
+    def key_stats(self, pattern: str) -> dict[str, Optional[int]]:
+        """Counts the keys matching the pattern, and their memory usage.
+
+        Uses SCAN, so this does not block Redis, but it is O(N) in the total
+        number of keys. Meant for monitoring, not for the request path.
+        `memory_bytes` is None if the server does not allow MEMORY USAGE.
+        """
+        keys: list[str] = list(
+            self.connection.scan_iter(match=pattern, count=1000))  # type: ignore
+        memory = 0
+        try:
+            for start in range(0, len(keys), 1000):
+                pipeline = self.connection.pipeline(transaction=False)
+                for key in keys[start:start + 1000]:
+                    pipeline.memory_usage(key)
+                memory += sum(usage or 0 for usage in pipeline.execute())
+        except ResponseError as e:
+            _logger.warning('Memory usage not available: %s', e)
+            return {'keys': len(keys), 'memory_bytes': None}
+
+        return {'keys': len(keys), 'memory_bytes': memory}
+
+
+def get_redis(*, binary: bool = False) -> RedisDB:
+    """Returns the process-wide Redis client, backed by a connection pool.
+
+    With `binary`, the client returns values as bytes instead of str.
+    """
+    config = current_app.config
+
+    return get_client('redis_binary' if binary else 'redis', lambda: RedisDB(
+        host=config['REDIS_HOST'],  # type: ignore
+        port=int(config['REDIS_PORT']),  # type: ignore
+        db=int(config['REDIS_DATABASE']),  # type: ignore
+        max_connections=int(config['REDIS_MAX_CONNECTIONS']),  # type: ignore
+        decode_responses=not binary
+    ))
@@ -0,0 +1,85 @@
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Generic, TypeVar
+
+import asyncio
+import threading
+
+__all__ = [
+    'AsyncSingleFlight',
+    'SingleFlight',
+]
+
+R = TypeVar('R')
+
+
+class SingleFlight(Generic[R]):
+    """Coalesces concurrent calls for the same key.
+
+    The first caller for a key runs the function; callers that arrive while it
+    runs wait for it, and get the same result, or exception.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future[R]] = {}
+
+    def do(self, key: str, fn: Callable[[], R]) -> tuple[R, bool]:
+        """Runs `fn`, unless a call for the key is already running.
+
+        Returns:
+            tuple[R, bool]: The result, and whether it is shared with the
+                caller that ran `fn`.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                leader = False
+            else:
+                leader = True
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight(Generic[R]):
+    """Like :py:class:`SingleFlight`, for coroutines on one event loop."""
+
+    def __init__(self) -> None:
+        self._calls: dict[str, asyncio.Future[R]] = {}
+
+    async def do(self, key: str,
+                 fn: Callable[[], Awaitable[R]]) -> tuple[R, bool]:
+        future = self._calls.get(key)
+        if future is not None:
+            # Shielded, so a cancelled waiter does not cancel the call.
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved, so it is not reported if nobody was waiting.
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
@@ -0,0 +1,282 @@
+from . import codecs
+from ..logs import sampled
+from ..metrics import CACHE_LOOKUPS
+from .cache_policy import CachePolicy, get_policy
+from .redisdb.redisdb import get_redis
+from flask import current_app
+from redis.asyncio import Redis as AsyncRedis
+from typing import Any, Callable, Generic, Literal, Mapping, Optional, TypeVar
+
+import logging
+
+__all__ = [
+    'AsyncSortedCache',
+    'SortedCache',
+]
+
+T = TypeVar('T', bound=Mapping[str, Any])
+
+# Hash field recording that older documents were trimmed, or not loaded. It is
+# set when the cache is filled, so a cache without it holds only appends.
+_TRUNCATED = '__truncated__'
+
+# Members of the sorted sets are the tiebreak, zero-padded so that members
+# with the same score sort by it, then the id.
+_TIEBREAK_DIGITS = 20
+
+# Adds the documents, and trims the oldest beyond the maximum length. A
+# document added again with another tiebreak replaces its previous member.
+# KEYS: scores, documents, members. ARGV: max length, ttl, truncated ('' to
+# keep), then score, id, member and document of each document.
+_ADD_SCRIPT = f'''
+for i = 4, #ARGV, 4 do
+    local id, member = ARGV[i + 1], ARGV[i + 2]
+    local previous = redis.call('HGET', KEYS[3], id)
+    if previous and previous ~= member then
+        redis.call('ZREM', KEYS[1], previous)
+        redis.call('HDEL', KEYS[2], previous)
+    end
+    redis.call('ZADD', KEYS[1], ARGV[i], member)
+    redis.call('HSET', KEYS[2], member, ARGV[i + 3])
+    redis.call('HSET', KEYS[3], id, member)
+end
+if ARGV[3] == '1' or (ARGV[3] == '0'
+        and redis.call('HEXISTS', KEYS[2], '{_TRUNCATED}') == 0) then
+    redis.call('HSET', KEYS[2], '{_TRUNCATED}', ARGV[3])
+end
+local excess = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[1])
+if excess > 0 then
+    local members = redis.call('ZRANGE', KEYS[1], 0, excess - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, excess - 1)
+    redis.call('HDEL', KEYS[2], unpack(members))
+    local ids = {{}}
+    for j, member in ipairs(members) do
+        ids[j] = string.sub(member, {_TIEBREAK_DIGITS + 2})
+    end
+    redis.call('HDEL', KEYS[3], unpack(ids))
+    if redis.call('HEXISTS', KEYS[2], '{_TRUNCATED}') == 1 then
+        redis.call('HSET', KEYS[2], '{_TRUNCATED}', '1')
+    end
+end
+if tonumber(ARGV[2]) > 0 then
+    for _, key in ipairs(KEYS) do
+        redis.call('EXPIRE', key, ARGV[2])
+    end
+end
+'''
+
+# Returns whether the list is truncated, its length, and the ranks of the
+# documents with ids ARGV[1] and ARGV[2] ('' for none), renewing the TTL of
+# the list if ARGV[3] is positive. KEYS: scores, documents, members.
+_RANKS_SCRIPT = f'''
+local function rank(id)
+    if id == '' then
+        return false
+    end
+    local member = redis.call('HGET', KEYS[3], id)
+    if not member then
+        return false
+    end
+    return redis.call('ZRANK', KEYS[1], member)
+end
+if tonumber(ARGV[3]) > 0 then
+    for _, key in ipairs(KEYS) do
+        redis.call('EXPIRE', key, ARGV[3])
+    end
+end
+return {{redis.call('HGET', KEYS[2], '{_TRUNCATED}'),
+        redis.call('ZCARD', KEYS[1]), rank(ARGV[1]), rank(ARGV[2])}}
+'''
+
+# Returns the documents with ranks ARGV[1] to ARGV[2], in ascending order.
+_RANGE_SCRIPT = '''
+local ids = redis.call('ZRANGE', KEYS[1], ARGV[1], ARGV[2])
+if #ids == 0 then
+    return {}
+end
+return redis.call('HMGET', KEYS[2], unpack(ids))
+'''
+
+
+class SortedCache(Generic[T]):
+    """Ordered lists of documents in Redis, such as the messages of a thread.
+
+    Each list is a sorted set of documents, ordered by score, then by
+    tiebreak and id, with a hash of the documents and a hash of their
+    members by id. Lists are capped at `max_length` documents; the oldest are
+    trimmed.
+
+    A list can be read once it has been filled from the database, and is
+    kept up to date by appending new documents to it. Appends to a list that
+    was not filled are kept, but the list is not read until it is filled.
+    """
+
+    _log = logging.getLogger(__name__)
+    _redis = get_redis(binary=True)
+
+    def __init__(self,
+                 key_prefix: str,
+                 score: Callable[[T], float],
+                 tiebreak: Callable[[T], int] = lambda t_obj: 0,
+                 id_mapper: Callable[[T], str] = lambda t_obj: t_obj['id'],
+                 max_length: int = 200,
+                 policy: Optional[CachePolicy] = None,
+                 codec: Optional[codecs.Codec] = None) -> None:
+        self._key_prefix = key_prefix
+        self._score = score
+        self._tiebreak = tiebreak
+        self._id_mapper = id_mapper
+        self._max_length = max_length
+        self._policy = policy
+        self._codec = codec \
+            or codecs.get_codec(current_app.config['CACHE_CODEC'])
+
+        self._add_script = self._redis.connection.register_script(_ADD_SCRIPT)
+        self._range_script = self._redis.connection.register_script(
+            _RANGE_SCRIPT)
+        self._ranks_script = self._redis.connection.register_script(
+            _RANKS_SCRIPT)
+
+    @property
+    def max_length(self) -> int:
+        return self._max_length
+
+    @property
+    def policy(self) -> CachePolicy:
+        return self._policy or get_policy(self._key_prefix)
+
+    def _keys(self, key: str) -> list[str]:
+        return [f'{self._key_prefix}:{key}',
+                f'{self._key_prefix}:{key}:docs',
+                f'{self._key_prefix}:{key}:members']
+
+    def _member(self, value: T) -> str:
+        return f'{self._tiebreak(value):0{_TIEBREAK_DIGITS}d}:' \
+            f'{self._id_mapper(value)}'
+
+    def add_args(self, key: str, values: list[T],
+                 truncated: str = '') -> tuple[list[str], list[Any]]:
+        """Keys and arguments of the script adding the documents to the
+        list, for clients running it on another connection.
+
+        Args:
+            key (str): List to add to.
+            values (list[T]): Documents to add.
+            truncated (str): '1' or '0' to record whether there are older
+                documents, when filling the list, or '' to keep it.
+        """
+        args: list[Any] = [self._max_length, self.policy['ttl'] or 0, truncated]
+        for value in values:
+            args += [self._score(value),
+                     self._id_mapper(value),
+                     self._member(value),
+                     codecs.encode({k: v for k, v in value.items() if k != '_id'},
+                                   self._codec)]
+        return self._keys(key), args
+
+    def _add(self, key: str, values: list[T], truncated: str) -> None:
+        keys, args = self.add_args(key, values, truncated)
+        self._add_script(keys=keys, args=args)
+
+    def append(self, key: str, values: list[T]) -> None:
+        """Adds documents to the list."""
+        if values:
+            self._add(key, values, '')
+
+    def fill(self, key: str, values: list[T], truncated: bool) -> None:
+        """Adds the latest documents from the database to the list.
+
+        Args:
+            key (str): List to fill.
+            values (list[T]): Latest documents, up to `max_length`.
+            truncated (bool): Whether there are documents older than these.
+        """
+        self._add(key, values, '1' if truncated else '0')
+
+    def page(self,
+             key: str,
+             *,
+             after: Optional[str] = None,
+             before: Optional[str] = None,
+             limit: int = 20,
+             sort: Literal['asc', 'desc'] = 'desc') -> Optional[list[Any]]:
+        """Reads a page of the list, with the semantics of
+        :py:func:`messages_dao.find_page`.
+
+        Returns:
+            Optional[list]: The decoded documents, or None if the page is not
+                entirely in the cache: the list was not filled, a cursor is
+                not in it, or the page reaches past its oldest document.
+        """
+        values = self._page(key, after, before, limit, sort)
+        CACHE_LOOKUPS.inc(self._key_prefix, 'miss' if values is None else 'hit')
+        return values
+
+    def _page(self,
+              key: str,
+              after: Optional[str],
+              before: Optional[str],
+              limit: int,
+              sort: Literal['asc', 'desc']) -> Optional[list[Any]]:
+        keys = self._keys(key)
+        # Ranks are ascending. In descending order, `after` is older.
+        lower, upper = (before, after) if sort == 'desc' else (after, before)
+
+        policy = self.policy
+        ttl = policy['ttl'] if policy['sliding'] else None
+        truncated, length, lower_rank, upper_rank = self._ranks_script(
+            keys=keys, args=[lower or '', upper or '', ttl or 0])
+
+        if truncated is None \
+                or (lower and lower_rank is None) \
+                or (upper and upper_rank is None):
+            return None
+
+        lower_rank = -1 if lower_rank is None else lower_rank
+        upper_rank = length if upper_rank is None else upper_rank
+
+        # A page before the cursor is the one adjacent to it.
+        reverse = bool(before and not after)
+        if (sort == 'desc') != reverse:
+            start = max(lower_rank + 1, upper_rank - limit)
+            stop = upper_rank - 1
+            # A full page is cached, even if it ends at the oldest document.
+            reaches_start = upper_rank - limit < 0
+        else:
+            start = lower_rank + 1
+            stop = min(upper_rank - 1, lower_rank + limit)
+            reaches_start = True
+
+        if start == 0 and reaches_start and truncated == b'1':
+            return None
+        if start > stop:
+            return []
+
+        documents = self._range_script(keys=keys, args=[start, stop])
+        if None in documents:
+            # Trimmed since the ranks were read.
+            return None
+
+        values = [codecs.decode(document) for document in documents]
+        if sort == 'desc':
+            values.reverse()
+        sampled(self._log, 'sorted cache hit: %s [%s, %s]', key, start, stop)
+        return values
+
+    def is_filled(self, key: str) -> bool:
+        return bool(self._redis.connection.hexists(self._keys(key)[1],
+                                                   _TRUNCATED))
+
+
+class AsyncSortedCache(Generic[T]):
+    """Appends to the lists of a :py:class:`SortedCache` from async code."""
+
+    def __init__(self, cache: SortedCache[T], redis: AsyncRedis) -> None:
+        self._cache = cache
+        self._add_script = redis.register_script(_ADD_SCRIPT)
+
+    async def append(self, key: str, values: list[T]) -> None:
+        """Adds documents to the list."""
+        if values:
+            keys, args = self._cache.add_args(key, values)
+            await self._add_script(keys=keys, args=args)  # type: ignore
@@ -0,0 +1,140 @@
+from collections.abc import Mapping
+from typing import Any
+
+import logging
+import os
+import threading
+import time
+
+__all__ = [
+    'configure_logging',
+    'payload',
+    'sampled',
+]
+
+LOG_LEVEL: str = os.environ.get('LOG_LEVEL') or 'INFO'
+# Levels per logger, e.g. `tallkotte.datastore=WARNING,werkzeug=ERROR`.
+LOG_LEVELS: str = os.environ.get('LOG_LEVELS', '')
+# Characters of a logged document kept, and keys whose values are not logged.
+LOG_PAYLOAD_MAX_CHARS: int = int(os.environ.get('LOG_PAYLOAD_MAX_CHARS', 200))
+LOG_REDACT_KEYS: frozenset[str] = frozenset(
+    key.strip() for key in
+    os.environ.get('LOG_REDACT_KEYS', 'content,instructions').split(',')
+    if key.strip())
+# A sampled event is logged at most once per interval, per logger.
+LOG_SAMPLE_INTERVAL_SEC: float = float(
+    os.environ.get('LOG_SAMPLE_INTERVAL_SEC', 10))
+
+LOG_FORMAT = ('%(asctime)s %(threadName)s %(filename)s:%(lineno)d %(levelname)s - '
+              '%(message)s')
+
+
+def configure_logging() -> None:
+    """Sets the root level to `LOG_LEVEL`, and the levels of `LOG_LEVELS`."""
+    logging.basicConfig(level=logging.getLevelName(LOG_LEVEL.upper()),
+                        format=LOG_FORMAT)
+    for entry in LOG_LEVELS.split(','):
+        if '=' in entry:
+            name, level = entry.split('=', 1)
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+
+def _write(value: Any, parts: list[str], budget: list[int]) -> None:
+    """Appends the repr of the value to `parts`, until `budget` characters
+    have been written, without formatting the rest."""
+    if hasattr(value, 'model_dump'):
+        # OpenAI objects
+        value = value.model_dump()
+
+    if isinstance(value, Mapping):
+        parts.append('{')
+        for i, (key, item) in enumerate(value.items()):
+            if budget[0] <= 0:
+                break
+            parts.append(f'{", " if i else ""}{key!r}: ')
+            if key in LOG_REDACT_KEYS:
+                parts.append('<redacted>')
+            else:
+                _write(item, parts, budget)
+        parts.append('}')
+    elif isinstance(value, (list, tuple)):
+        parts.append('[')
+        for i, item in enumerate(value):
+            if budget[0] <= 0:
+                break
+            if i:
+                parts.append(', ')
+            _write(item, parts, budget)
+        parts.append(']')
+    else:
+        if isinstance(value, (str, bytes)):
+            value = value[:budget[0] + 1]
+        parts.append(repr(value))
+    budget[0] -= len(parts[-1])
+
+
+class _Payload:
+    """Formats a document only when the record is emitted."""
+
+    __slots__ = ('_value',)
+
+    def __init__(self, value: Any) -> None:
+        self._value = value
+
+    def __str__(self) -> str:
+        parts: list[str] = []
+        _write(self._value, parts, [LOG_PAYLOAD_MAX_CHARS])
+        text = ''.join(parts)
+        if len(text) <= LOG_PAYLOAD_MAX_CHARS:
+            return text
+        return f'{text[:LOG_PAYLOAD_MAX_CHARS]}...'
+
+
+def payload(value: Any) -> _Payload:
+    """Wraps a document, or a list of them, to be logged as a `%s` argument.
+
+    Values of `LOG_REDACT_KEYS`, such as the text of messages, are left out,
+    and the text is cut at `LOG_PAYLOAD_MAX_CHARS`.
+    """
+    return _Payload(value)
+
+
+class _Sampler:
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # Per logger and message: when it was last logged, and how many
+        # times it was not logged since.
+        self._events: dict[tuple[str, str], list[float]] = {}
+
+    def take(self, logger: logging.Logger, msg: str) -> int:
+        """Returns the number of events suppressed since the last one
+        logged, or -1 if this one is suppressed too."""
+        now = time.monotonic()
+        with self._lock:
+            event = self._events.get((logger.name, msg))
+            if event and now - event[0] < LOG_SAMPLE_INTERVAL_SEC:
+                event[1] += 1
+                return -1
+            self._events[(logger.name, msg)] = [now, 0]
+            return int(event[1]) if event else 0
+
+
+_sampler = _Sampler()
+
+
+def sampled(logger: logging.Logger, msg: str, *args: Any,
+            level: int = logging.INFO) -> None:
+    """Logs a frequent event, such as a cache hit, at most once per
+    `LOG_SAMPLE_INTERVAL_SEC` for the same logger and message.
+
+    The record logged says how many were suppressed before it.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    suppressed = _sampler.take(logger, msg)
+    if suppressed < 0:
+        return
+    if suppressed:
+        msg += f' ({suppressed} similar suppressed)'
+    logger.log(level, msg, *args, stacklevel=2)
@@ -0,0 +1,254 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import wraps
+from typing import Any, Callable, Iterable, Optional, TypeVar
+
+import inspect
+import math
+import threading
+import time
+
+__all__ = [
+    'Counter',
+    'Histogram',
+    'record_cache_lookup',
+    'render',
+    'timed',
+]
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+# Upper bounds in seconds, from a Redis read to a slow OpenAI call.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...],
+                   extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    type: str
+
+    def __init__(self, name: str, help: str,
+                 label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _samples(self) -> Iterable[str]:
+        ...
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} {self.type}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Monotonic count per label values."""
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str,
+                 label_names: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def items(self) -> list[tuple[tuple[str, ...], float]]:
+        with self._lock:
+            return list(self._values.items())
+
+    def _samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.items()):
+            yield (f'{self.name}{_format_labels(self.label_names, labels)} '
+                   f'{_format_value(value)}')
+
+
+class Histogram(_Metric):
+    """Distribution of observed values per label values, in fixed buckets.
+
+    An observation is a binary search and three additions under a lock, so it
+    can be recorded on every call.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str,
+                 label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, label_names)
+        self._buckets = buckets
+        # Per label values: count per bucket, with +Inf last, and sum.
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = (
+                    [0] * (len(self._buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def counts(self) -> dict[tuple[str, ...], int]:
+        """Number of observations per label values."""
+        with self._lock:
+            return {labels: sum(counts)
+                    for labels, (counts, _) in self._series.items()}
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            series = sorted(
+                (labels, list(counts), total[0])
+                for labels, (counts, total) in self._series.items())
+
+        bounds = [_format_value(bound) for bound in self._buckets] + ['+Inf']
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names, labels,
+                                               f'le="{bound}"')
+                yield f'{self.name}_bucket{bucket_labels} {cumulative}'
+            series_labels = _format_labels(self.label_names, labels)
+            yield f'{self.name}_sum{series_labels} {_format_value(total)}'
+            yield f'{self.name}_count{series_labels} {cumulative}'
+
+
+EXTERNAL_CALL_SECONDS = Histogram(
+    'tallkotte_external_call_seconds',
+    'Latency of calls to OpenAI, MongoDB and Redis.',
+    ('service', 'operation'))
+EXTERNAL_CALL_ERRORS = Counter(
+    'tallkotte_external_call_errors_total',
+    'Calls to OpenAI, MongoDB and Redis that raised an exception.',
+    ('service', 'operation'))
+CACHE_LOOKUPS = Counter(
+    'tallkotte_cache_lookups_total',
+    'Cache lookups per key prefix. `negative` is a cached miss.',
+    ('prefix', 'result'))
+
+_METRICS: list[_Metric] = [
+    EXTERNAL_CALL_SECONDS,
+    EXTERNAL_CALL_ERRORS,
+    CACHE_LOOKUPS,
+]
+
+
+def timed(service: str, operation: Optional[str] = None) -> Callable[[F], F]:
+    """Records the latency, and errors, of each call of the function.
+
+    Works on plain and async functions, and on generators, which are timed
+    until they are exhausted or closed.
+
+    Args:
+        service (str): External service called, e.g. `openai`.
+        operation (str, optional): Defaults to the function name.
+    """
+    def decorator(func: F) -> F:
+        labels = (service, operation or func.__name__)
+
+        def finish(started_at: float, failed: bool) -> None:
+            EXTERNAL_CALL_SECONDS.observe(time.perf_counter() - started_at,
+                                          *labels)
+            if failed:
+                EXTERNAL_CALL_ERRORS.inc(*labels)
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                started_at = time.perf_counter()
+                failed = True
+                try:
+                    result = await func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    finish(started_at, failed)
+            return async_wrapper  # type: ignore[return-value]
+
+        if inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def generator_wrapper(*args: Any, **kwargs: Any) -> Any:
+                started_at = time.perf_counter()
+                failed = True
+                try:
+                    yield from func(*args, **kwargs)
+                    failed = False
+                except GeneratorExit:
+                    # Closed by the caller, which is not an error.
+                    failed = False
+                    raise
+                finally:
+                    finish(started_at, failed)
+            return generator_wrapper  # type: ignore[return-value]
+
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started_at = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                finish(started_at, failed)
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def record_cache_lookup(prefix: str, result: Optional[Any]) -> None:
+    """Counts a lookup by the result of `Cache.get`: None is a miss, and an
+    empty list a cached miss."""
+    CACHE_LOOKUPS.inc(prefix, 'miss' if result is None
+                      else 'negative' if result == [] else 'hit')
+
+
+def _cache_hit_ratios() -> str:
+    lookups: dict[str, list[float]] = {}
+    for (prefix, result), count in CACHE_LOOKUPS.items():
+        totals = lookups.setdefault(prefix, [0, 0])
+        totals[1] += count
+        if result != 'miss':
+            totals[0] += count
+
+    name = 'tallkotte_cache_hit_ratio'
+    lines = [f'# HELP {name} Share of cache lookups that did not read the '
+             f'database, since the process started.',
+             f'# TYPE {name} gauge']
+    for prefix, (hits, total) in sorted(lookups.items()):
+        lines.append(f'{name}{_format_labels(("prefix",), (prefix,))} '
+                     f'{_format_value(hits / total)}')
+    return '\n'.join(lines)
+
+
+def render() -> str:
+    """The metrics of this process, in the Prometheus text format."""
+    return '\n'.join([metric.render() for metric in _METRICS]
+                     + [_cache_hit_ratios()]) + '\n'
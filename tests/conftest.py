@@ -0,0 +1,66 @@
+from flask import Flask
+from tallkotte.assistant.openai import openai_config
+from tallkotte.clients import get_client, reset_clients
+from tallkotte.datastore.mongodb import mongo_config
+from tallkotte.datastore.mongodb.mongo_wrapper import MongoDB, get_mongo
+from tallkotte.datastore.redisdb import redis_config
+from tallkotte.datastore.redisdb.redisdb import RedisDB, get_redis
+from typing import Any, Iterator
+
+import fakeredis
+import mongomock
+import pytest
+
+# Pushed for the whole session, as datastore modules create their clients on
+# import, in the app context.
+_app_context: Any = None
+
+
+class _MockMongoDB(MongoDB):
+    def __init__(self) -> None:
+        self._client = mongomock.MongoClient()
+        self._db = self._client['tallkotte']
+
+
+class _FakeRedisDB(RedisDB):
+    def __init__(self, server: fakeredis.FakeServer,
+                 decode_responses: bool) -> None:
+        self._connection = fakeredis.FakeRedis(
+            server=server, decode_responses=decode_responses)
+        self._is_connected = True
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    global _app_context
+    server = fakeredis.FakeServer()
+    get_client('mongodb', _MockMongoDB)
+    get_client('redis', lambda: _FakeRedisDB(server, True))
+    get_client('redis_binary', lambda: _FakeRedisDB(server, False))
+
+    app = Flask('tallkotte')
+    app.config.from_mapping({**openai_config, **mongo_config, **redis_config,
+                             'OPENAI_API_KEY': 'sk-test',
+                             'OPENAI_CASSETTE': '',
+                             'MONGO_SYNC_INDEXES': False})
+    _app_context = app.app_context()
+    _app_context.push()
+
+
+def pytest_unconfigure(config: pytest.Config) -> None:
+    _app_context.pop()
+    reset_clients()
+
+
+@pytest.fixture(autouse=True)
+def redis() -> Iterator[RedisDB]:
+    redis = get_redis(binary=True)
+    redis.connection.flushall()
+    yield redis
+
+
+@pytest.fixture
+def mongo() -> Iterator[MongoDB]:
+    mongo = get_mongo()
+    for name in mongo._db.list_collection_names():
+        mongo._db.drop_collection(name)
+    yield mongo
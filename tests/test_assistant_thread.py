@@ -0,0 +1,87 @@
+from tallkotte.assistant import assistant_thread
+from tallkotte.assistant.assistant_thread import AssistantThread
+from tallkotte.assistant.dao import messages_dao
+from tallkotte.assistant.openai.datatypes.message import Message
+
+import pytest
+import time
+
+THREAD = 'thread_1'
+
+
+def _message(number: int) -> Message:
+    return {'id': f'msg_{number:02}', 'role': 'user', 'created_at': number,
+            'run_id': '', 'thread_id': THREAD, 'content': [str(number)]}
+
+
+class _OpenAI:
+    """Lists the messages of the thread, oldest first, like OpenAI."""
+
+    def __init__(self, messages: list[Message]) -> None:
+        self.messages = messages
+        self.calls: list[dict] = []
+
+    def list_messages(self, thread, *, after=None, before=None, limit=20,
+                      sort='desc', completed_only=False) -> list[Message]:
+        self.calls.append({'after': after, 'before': before, 'limit': limit})
+        messages = self.messages if sort == 'asc' else self.messages[::-1]
+        ids = [message['id'] for message in messages]
+        if after in ids:
+            messages = messages[ids.index(after) + 1:]
+        if before in ids:
+            messages = messages[:ids.index(before)]
+        return [dict(message) for message in messages[:limit]]  # type: ignore
+
+
+@pytest.fixture
+def thread(mongo) -> AssistantThread:
+    mongo.get_collection('threads').insert_one(
+        {'id': THREAD, 'assistant_id': 'asst_1', 'created_at': 0})
+    return AssistantThread('asst_1', THREAD)
+
+
+@pytest.fixture
+def openai(monkeypatch) -> _OpenAI:
+    openai = _OpenAI([_message(number) for number in range(5)])
+    monkeypatch.setattr(assistant_thread, 'openai', openai)
+    return openai
+
+
+def _ids(messages: list[Message]) -> list[str]:
+    return [message['id'] for message in messages]
+
+
+def test_history_with_unsaved_cursor_is_read_from_openai(thread, openai):
+    messages_dao.save([_message(number) for number in range(3)])
+    # Synced just now, so msg_03 and msg_04 are not saved yet.
+    assistant_thread.redis.write(f'synced:{THREAD}', time.time())
+
+    assert _ids(thread.get_history(after='msg_04', limit=2)) == [
+        'msg_03', 'msg_02']
+    assert openai.calls == [{'after': 'msg_04', 'before': None, 'limit': 2}]
+
+
+def _saved_ids(mongo) -> list[str]:
+    return sorted(message['id'] for message in
+                  mongo.get_collection('messages').find({}))
+
+
+def test_sync_reads_all_pages_and_older_messages(thread, openai, mongo,
+                                                 monkeypatch):
+    monkeypatch.setattr(assistant_thread, 'SYNC_PAGE_SIZE', 2)
+    # Saved when sent, before the older messages are synced.
+    messages_dao.save([_message(4)])
+
+    thread._sync_messages()
+
+    assert _saved_ids(mongo) == [f'msg_{number:02}' for number in range(5)]
+    assert [call['after'] for call in openai.calls] == [
+        None, 'msg_01', 'msg_03']
+
+    openai.messages.append(_message(5))
+    openai.calls.clear()
+
+    thread._sync_messages()
+
+    assert _saved_ids(mongo)[-1] == 'msg_05'
+    assert [call['after'] for call in openai.calls] == ['msg_04']
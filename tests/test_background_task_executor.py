@@ -0,0 +1,143 @@
+from tallkotte.assistant import background_task_executor
+from tallkotte.assistant.background_task_executor import (
+    BackgroundTaskExecutor,
+    RejectedTaskError,
+)
+from tallkotte.assistant.run_watcher import RunWatcher
+
+import pytest
+import threading
+import time
+
+
+@pytest.fixture
+def gate():
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+def _full_executor(gate: threading.Event, **kwargs) -> BackgroundTaskExecutor:
+    """An executor whose only worker waits for the gate, with no queue."""
+    executor = BackgroundTaskExecutor(max_workers=1, max_queue=0, **kwargs)
+    executor.submit(gate.wait, 5)
+    return executor
+
+
+def test_submit_runs_task_and_resolves_future():
+    executor = BackgroundTaskExecutor(max_workers=2)
+
+    assert executor.submit(lambda a, b: a + b, 1, b=2).result(5) == 3
+    assert executor.stats()['completed'] == 1
+
+
+def test_task_exception_is_set_on_future():
+    executor = BackgroundTaskExecutor(max_workers=1)
+
+    def fail() -> None:
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        executor.submit(fail).result(5)
+    assert executor.stats()['failed'] == 1
+
+
+def test_tasks_with_same_key_are_deduplicated(gate):
+    executor = BackgroundTaskExecutor(max_workers=1)
+
+    first = executor.submit(gate.wait, 5, dedup_key='key')
+    second = executor.submit(gate.wait, 5, dedup_key='key')
+    gate.set()
+
+    assert second is first
+    assert first.result(5) is True
+    assert executor.stats()['deduplicated'] == 1
+    # Submitted again once done.
+    assert executor.submit(lambda: 'again', dedup_key='key').result(5) \
+        == 'again'
+
+
+def test_reject_policy_raises_when_full(gate):
+    executor = _full_executor(gate, rejection_policy='reject')
+
+    with pytest.raises(RejectedTaskError):
+        executor.submit(lambda: None)
+    assert executor.stats()['rejected'] == 1
+
+
+def test_block_policy_waits_for_room(gate):
+    executor = _full_executor(gate, rejection_policy='block',
+                              block_timeout=5)
+
+    threading.Timer(0.05, gate.set).start()
+
+    assert executor.submit(lambda: 'ran').result(5) == 'ran'
+
+
+def test_block_policy_rejects_after_timeout(gate):
+    executor = _full_executor(gate, rejection_policy='block',
+                              block_timeout=0.05)
+
+    with pytest.raises(RejectedTaskError):
+        executor.submit(lambda: None)
+
+
+def test_caller_runs_policy_runs_task_in_caller(gate):
+    executor = _full_executor(gate, rejection_policy='caller_runs')
+
+    future = executor.submit(lambda: threading.current_thread())
+
+    assert future.result(0) is threading.current_thread()
+    assert executor.stats()['caller_runs'] == 1
+
+
+@pytest.mark.parametrize('policy', ['block', 'caller_runs'])
+def test_try_submit_never_waits_or_runs_in_caller(gate, policy):
+    executor = _full_executor(gate, rejection_policy=policy, block_timeout=5)
+
+    started_at = time.monotonic()
+    with pytest.raises(RejectedTaskError):
+        executor.try_submit(lambda: None)
+
+    assert time.monotonic() - started_at < 1
+    assert executor.stats()['caller_runs'] == 0
+
+
+@pytest.mark.parametrize('policy', ['block', 'reject', 'caller_runs'])
+def test_watcher_retries_dispatch_until_there_is_room(gate, monkeypatch,
+                                                      policy):
+    executor = _full_executor(gate, rejection_policy=policy, block_timeout=5)
+    monkeypatch.setattr(background_task_executor, 'get_executor',
+                        lambda: executor)
+    watcher = RunWatcher(lambda run_id, thread_id: 'completed',
+                         min_delay=0.05, max_delay=0.1)
+
+    future = watcher.watch('run_1', 'thread_1',
+                           lambda status: threading.current_thread().name)
+    time.sleep(0.3)
+
+    assert not future.done()
+    assert watcher.pending == 1
+
+    gate.set()
+
+    assert future.result(5).startswith('background')
+    assert watcher.pending == 0
+
+
+def test_watcher_reports_terminal_status_if_never_dispatched(gate,
+                                                              monkeypatch):
+    executor = _full_executor(gate, rejection_policy='block')
+    monkeypatch.setattr(background_task_executor, 'get_executor',
+                        lambda: executor)
+    watcher = RunWatcher(lambda run_id, thread_id: 'completed',
+                         min_delay=0.01, max_delay=0.02)
+    statuses: list[str] = []
+
+    future = watcher.watch('run_1', 'thread_1', lambda status: status,
+                           on_status=statuses.append)
+
+    with pytest.raises(RejectedTaskError):
+        future.result(5)
+    assert statuses == ['completed']
+    assert watcher.pending == 0
@@ -0,0 +1,38 @@
+from tallkotte.datastore.cachedstore import CachedStore
+from tallkotte.datastore.mongodb.mongo_query import MongoQueryBuilder
+
+
+def _by_ids(ids: list[str]) -> dict:
+    query = MongoQueryBuilder(id={'$in': ids}).build()
+    query['projection'] = {'_id': 0}
+    return query
+
+
+def test_read_many_caches_found_and_missing(mongo, monkeypatch):
+    mongo.get_collection('test_items').insert_one({'id': 'item_1'})
+    store = CachedStore[dict]('test_items', dict)
+    finds = []
+    find = mongo.find
+
+    def counted_find(*args, **kwargs):
+        finds.append(1)
+        return find(*args, **kwargs)
+
+    monkeypatch.setattr(mongo, 'find', counted_find)
+
+    expected = {'item_1': {'id': 'item_1'}, 'item_2': None}
+    assert store.read_many(['item_1', 'item_2'], _by_ids) == expected
+    assert len(finds) == 1
+
+    assert store.read_many(['item_1', 'item_2'], _by_ids) == expected
+    assert len(finds) == 1
+
+
+def test_invalidate_drops_cached_miss(mongo):
+    store = CachedStore[dict]('test_items', dict)
+    assert store.read_many(['item_1'], _by_ids) == {'item_1': None}
+
+    mongo.get_collection('test_items').insert_one({'id': 'item_1'})
+    store.invalidate('item_1')
+
+    assert store.read_many(['item_1'], _by_ids) == {'item_1': {'id': 'item_1'}}
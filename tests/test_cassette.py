@@ -0,0 +1,153 @@
+from tallkotte.assistant.openai.cassette import Cassette, CassetteError
+
+import asyncio
+import gzip
+import httpx
+import json
+import pytest
+
+URL = 'https://api.openai.test/v1'
+
+
+def _interactions(path) -> list[dict]:
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+class _Chunks(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """A response body sent in several chunks, like a server-sent stream."""
+
+    def __init__(self, *chunks: bytes) -> None:
+        self._chunks = chunks
+
+    def __iter__(self):
+        yield from self._chunks
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+def _handler(request: httpx.Request) -> httpx.Response:
+    if request.url.path.endswith('/stream'):
+        return httpx.Response(200, headers={'content-type': 'text/event-stream'},
+                              stream=_Chunks(b'data: 1\n\n', b'data: 2\n\n'))
+    if request.url.path.endswith('/gzip'):
+        return httpx.Response(200, headers={'content-encoding': 'gzip'},
+                              content=gzip.compress(b'{"zipped": true}'))
+    return httpx.Response(200, json={'path': request.url.path},
+                          headers={'x-request-id': 'req_1', 'server': 'x'})
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / 'cassette.jsonl'
+
+
+@pytest.fixture
+def recorder(path) -> httpx.Client:
+    cassette = Cassette(str(path), mode='record')
+    return httpx.Client(
+        base_url=URL, transport=cassette.transport(httpx.MockTransport(_handler)))
+
+
+def test_record_appends_response(recorder, path):
+    response = recorder.post('/threads', json={'a': 1},
+                             params={'b': '2', 'a': '1'})
+
+    assert response.json() == {'path': '/v1/threads'}
+    assert response.elapsed.total_seconds() >= 0
+    [interaction] = _interactions(path)
+    assert interaction['method'] == 'POST'
+    assert interaction['url'] == '/v1/threads?a=1&b=2'
+    assert interaction['request'] == '{"a": 1}'
+    assert json.loads(interaction['response']) == {'path': '/v1/threads'}
+    assert interaction['headers'] == {'content-type': 'application/json',
+                                      'x-request-id': 'req_1'}
+
+
+def test_record_decodes_content_encoding(recorder, path):
+    assert recorder.get('/gzip').json() == {'zipped': True}
+
+    assert _interactions(path)[0]['response'] == '{"zipped": true}'
+
+
+def test_streamed_response_is_recorded_once_read(recorder, path):
+    with recorder.stream('GET', '/stream') as response:
+        chunks = response.iter_bytes()
+
+        assert next(chunks) == b'data: 1\n\n'
+        assert _interactions(path) == []
+        assert list(chunks) == [b'data: 2\n\n']
+
+    [interaction] = _interactions(path)
+    assert interaction['response'] == 'data: 1\n\ndata: 2\n\n'
+
+
+def test_response_closed_early_is_not_recorded(recorder, path):
+    with recorder.stream('GET', '/stream') as response:
+        next(response.iter_bytes())
+
+    assert _interactions(path) == []
+
+
+def test_async_record(path):
+    cassette = Cassette(str(path), mode='record')
+
+    async def main() -> tuple:
+        async with httpx.AsyncClient(
+                base_url=URL, transport=cassette.async_transport(
+                    httpx.MockTransport(_handler))) as client:
+            response = await client.get('/stream')
+            return response.text, response.elapsed
+
+    text, elapsed = asyncio.run(main())
+
+    assert text == 'data: 1\n\ndata: 2\n\n'
+    assert elapsed.total_seconds() >= 0
+    assert _interactions(path)[0]['response'] == text
+
+
+def _replayer(path) -> httpx.Client:
+    cassette = Cassette(str(path), mode='replay', latency_scale=0)
+
+    def not_called(request: httpx.Request) -> httpx.Response:
+        raise AssertionError(f'{request.url} was sent')
+
+    return httpx.Client(
+        base_url=URL,
+        transport=cassette.transport(httpx.MockTransport(not_called)))
+
+
+def test_replay_serves_responses_in_order_then_the_last(path):
+    lines = [
+        {'method': 'GET', 'url': '/v1/runs/run_1', 'request': None,
+         'status': 200, 'headers': {'content-type': 'application/json'},
+         'response': json.dumps({'status': status}), 'elapsed': 0.5,
+         'recorded_at': 0}
+        for status in ('queued', 'in_progress', 'completed')
+    ]
+    path.write_text(''.join(json.dumps(line) + '\n' for line in lines))
+    client = _replayer(path)
+
+    statuses = [client.get('/runs/run_1').json()['status'] for _ in range(4)]
+
+    assert statuses == ['queued', 'in_progress', 'completed', 'completed']
+    with pytest.raises(CassetteError):
+        client.get('/runs/run_2')
+
+
+def test_recorded_responses_replay(recorder, path):
+    recorder.post('/threads', json={})
+    recorder.get('/stream').read()
+
+    client = _replayer(path)
+
+    assert client.post('/threads', json={}).json() == {'path': '/v1/threads'}
+    assert client.get('/stream').text == 'data: 1\n\ndata: 2\n\n'
+
+
+def test_unknown_mode_is_rejected(path):
+    with pytest.raises(ValueError):
+        Cassette(str(path), mode='rewind')  # type: ignore[arg-type]
@@ -0,0 +1,80 @@
+from tallkotte.assistant.dao import messages_dao
+from tallkotte.assistant.openai.datatypes.message import Message
+from tallkotte.assistant.thread_events import thread_channel
+from tallkotte.datastore.mongodb.write_behind import WriteBehindBuffer
+from tallkotte.datastore.redisdb.redisdb import get_redis
+
+import json
+import pytest
+
+THREAD = 'thread_1'
+
+
+def _message(id: str, created_at: int) -> Message:
+    return {'id': id, 'role': 'user', 'created_at': created_at, 'run_id': '',
+            'thread_id': THREAD, 'content': [id]}
+
+
+def _ids(messages: list[Message]) -> list[str]:
+    return [message['id'] for message in messages]
+
+
+@pytest.fixture
+def saved(mongo) -> None:
+    # Created in the same second, and listed by OpenAI in this order.
+    messages_dao.save([_message('msg_c', 1), _message('msg_b', 2),
+                       _message('msg_a', 2)])
+    messages_dao.save([_message('msg_0', 2)])
+
+
+@pytest.mark.parametrize('cached', [True, False])
+@pytest.mark.parametrize('kwargs, expected', [
+    ({}, ['msg_0', 'msg_a', 'msg_b', 'msg_c']),
+    ({'sort': 'asc'}, ['msg_c', 'msg_b', 'msg_a', 'msg_0']),
+    ({'after': 'msg_a'}, ['msg_b', 'msg_c']),
+    ({'before': 'msg_b', 'sort': 'asc'}, ['msg_c']),
+    ({'after': 'msg_b', 'sort': 'asc', 'limit': 1}, ['msg_a']),
+])
+def test_same_second_messages_keep_saved_order(saved, redis, cached, kwargs,
+                                               expected):
+    if not cached:
+        redis.connection.flushall()
+        # Not refilled, so the page is read from the DB.
+        messages_dao.thread_cache.fill(THREAD, [], truncated=True)
+
+    assert _ids(messages_dao.find_page(THREAD, **kwargs)) == expected
+
+
+@pytest.fixture
+def write_behind(mongo, monkeypatch):
+    buffers: list[WriteBehindBuffer] = []
+
+    def get_write_behind(collection_name, on_flush=None, overwrite=()):
+        if not buffers:
+            buffers.append(WriteBehindBuffer[Message](
+                mongo, collection_name, on_flush=on_flush,
+                overwrite=overwrite, interval=60))
+            # Flushed by the test only.
+            monkeypatch.setattr(buffers[0], '_start', lambda: None)
+        return buffers[0]
+
+    monkeypatch.setattr(messages_dao, 'get_write_behind', get_write_behind)
+    yield buffers
+    for buffer in buffers:
+        buffer.close()
+
+
+def test_buffered_messages_are_published_once_written(write_behind, redis):
+    subscriber = get_redis().connection.pubsub()
+    subscriber.subscribe(thread_channel(THREAD))
+    assert subscriber.get_message(timeout=1)['type'] == 'subscribe'
+
+    messages_dao.save([_message('msg_a', 1)])
+
+    assert subscriber.get_message(timeout=0.1) is None
+
+    messages_dao.flush()
+
+    event = subscriber.get_message(timeout=1)
+    assert json.loads(event['data'])['data']['id'] == 'msg_a'
+    subscriber.close()
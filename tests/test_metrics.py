@@ -0,0 +1,114 @@
+from tallkotte import metrics
+from tallkotte.metrics import Counter, Histogram
+
+import asyncio
+import pytest
+
+
+def test_counter_renders_samples_sorted_by_labels():
+    counter = Counter('test_total', 'Test counter.', ('service', 'result'))
+    counter.inc('redis', 'ok')
+    counter.inc('mongo', 'ok', amount=2)
+    counter.inc('redis', 'ok')
+
+    assert counter.render() == '\n'.join([
+        '# HELP test_total Test counter.',
+        '# TYPE test_total counter',
+        'test_total{service="mongo",result="ok"} 2',
+        'test_total{service="redis",result="ok"} 2',
+    ])
+
+
+def test_label_values_are_escaped():
+    counter = Counter('test_total', 'Test counter.', ('path',))
+    counter.inc('a"b\\c\nd')
+
+    assert counter.render().splitlines()[-1] == \
+        'test_total{path="a\\"b\\\\c\\nd"} 1'
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('test_seconds', 'Test histogram.', ('service',),
+                          buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, 'redis')
+
+    assert histogram.render() == '\n'.join([
+        '# HELP test_seconds Test histogram.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{service="redis",le="0.1"} 2',
+        'test_seconds_bucket{service="redis",le="1.0"} 3',
+        'test_seconds_bucket{service="redis",le="+Inf"} 4',
+        'test_seconds_sum{service="redis"} 2.65',
+        'test_seconds_count{service="redis"} 4',
+    ])
+    assert histogram.counts() == {('redis',): 4}
+
+
+def test_metric_without_samples_is_abstract():
+    with pytest.raises(TypeError):
+        metrics._Metric('test', 'Test.')  # type: ignore[abstract]
+
+
+def _observed(operation: str) -> int:
+    return metrics.EXTERNAL_CALL_SECONDS.counts().get(
+        ('test', operation), 0)
+
+
+def _errors(operation: str) -> float:
+    return dict(metrics.EXTERNAL_CALL_ERRORS.items()).get(
+        ('test', operation), 0)
+
+
+def test_timed_records_calls_and_errors():
+    @metrics.timed('test', 'call')
+    def call(fail: bool) -> str:
+        if fail:
+            raise ValueError('failed')
+        return 'ok'
+
+    observed, errors = _observed('call'), _errors('call')
+
+    assert call(False) == 'ok'
+    with pytest.raises(ValueError):
+        call(True)
+
+    assert _observed('call') == observed + 2
+    assert _errors('call') == errors + 1
+
+
+def test_timed_records_coroutines():
+    @metrics.timed('test', 'coroutine')
+    async def coroutine() -> str:
+        return 'ok'
+
+    observed = _observed('coroutine')
+
+    assert asyncio.run(coroutine()) == 'ok'
+    assert _observed('coroutine') == observed + 1
+
+
+def test_timed_records_closed_generators_as_successful():
+    @metrics.timed('test', 'generator')
+    def generator():
+        yield 1
+        yield 2
+
+    observed, errors = _observed('generator'), _errors('generator')
+
+    events = generator()
+    assert next(events) == 1
+    events.close()
+
+    assert _observed('generator') == observed + 1
+    assert _errors('generator') == errors
+
+
+def test_render_includes_cache_hit_ratio():
+    for result in ('hit', 'negative', 'miss', 'miss'):
+        metrics.CACHE_LOOKUPS.inc('test_prefix', result)
+
+    rendered = metrics.render()
+
+    assert rendered.endswith('\n')
+    assert 'tallkotte_cache_hit_ratio{prefix="test_prefix"} 0.5' in rendered
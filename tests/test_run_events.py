@@ -0,0 +1,130 @@
+from concurrent.futures import TimeoutError
+from tallkotte.assistant import assistant_service, assistant_thread
+from tallkotte.assistant.assistant_service import AssistantService
+from tallkotte.assistant.assistant_thread import (
+    AssistantThread,
+    RunFailedError,
+    claim_run,
+    run_lease_key,
+)
+from tallkotte.assistant.dao import messages_dao
+from tallkotte.assistant.run_events import get_run_events
+
+import pytest
+import threading
+
+RUN = 'run_1'
+
+
+@pytest.fixture
+def thread(mongo) -> AssistantThread:
+    mongo.get_collection('threads').insert_one(
+        {'id': 'thread_1', 'assistant_id': 'asst_1', 'created_at': 0})
+    return AssistantThread('asst_1', 'thread_1')
+
+
+def _publish_later(run_id: str, status: str, delay: float = 0.05) -> None:
+    threading.Timer(delay, get_run_events().publish,
+                    (run_id, status)).start()
+
+
+def test_subscriber_gets_published_status():
+    run_events = get_run_events()
+    done = run_events.subscribe(RUN)
+    try:
+        _publish_later(RUN, 'completed')
+
+        assert done.result(5) == 'completed'
+    finally:
+        run_events.unsubscribe(RUN, done)
+
+
+def test_subscriber_does_not_get_other_runs():
+    run_events = get_run_events()
+    done = run_events.subscribe(RUN)
+    try:
+        _publish_later('run_2', 'completed')
+
+        with pytest.raises(TimeoutError):
+            done.result(0.3)
+    finally:
+        run_events.unsubscribe(RUN, done)
+
+
+def test_claim_run_is_exclusive(redis):
+    assert claim_run(RUN)
+    assert not claim_run(RUN)
+    assert redis.connection.ttl(run_lease_key(RUN)) > 0
+
+
+def test_wait_for_response_collects_unwatched_run(thread, redis):
+    redis.connection.set(f'{RUN}:status', 'in_progress')
+    collected = []
+
+    def collect() -> None:
+        collected.append(RUN)
+        _publish_later(RUN, 'failed')
+
+    with pytest.raises(RunFailedError):
+        thread.wait_for_response(RUN, 'msg_1', 5, collect=collect)
+    assert collected == [RUN]
+
+
+def test_wait_for_response_leaves_watched_run(thread, redis):
+    redis.connection.set(f'{RUN}:status', 'in_progress')
+    # Renewed by the process watching the run.
+    assistant_thread._renew_lease(RUN)
+    collected = []
+
+    assert thread.wait_for_response(RUN, 'msg_1', 0.1,
+                                    collect=lambda: collected.append(RUN)) \
+        is None
+    assert collected == []
+
+
+def test_wait_for_response_returns_once_published(thread, redis):
+    redis.connection.set(f'{RUN}:status', 'in_progress')
+    assistant_thread._renew_lease(RUN)
+    _publish_later(RUN, 'cancelled')
+
+    with pytest.raises(RunFailedError, match='cancelled'):
+        thread.wait_for_response(RUN, 'msg_1', 5, collect=lambda: None)
+
+
+def test_watch_response_takes_and_renews_lease(thread, redis, monkeypatch):
+    watched = {}
+
+    class _Watcher:
+        def watch(self, run_id, thread_id, on_done, **callbacks):
+            watched.update(callbacks)
+
+    monkeypatch.setattr(assistant_thread, 'get_run_watcher', _Watcher)
+
+    thread.watch_response(RUN, 'msg_1')
+
+    assert not claim_run(RUN)
+    redis.connection.delete(run_lease_key(RUN))
+    watched['on_check']()
+    assert not claim_run(RUN)
+
+
+def test_queued_response_is_waited_for_not_watched(thread, mongo, redis,
+                                                    monkeypatch):
+    mongo.get_collection('assistants').insert_one(
+        {'id': 'asst_1', 'name': None, 'instructions': None, 'tools': [],
+         'active_thread': 'thread_1'})
+    messages_dao.save([{'id': 'msg_1', 'role': 'user', 'created_at': 0,
+                        'run_id': RUN, 'thread_id': 'thread_1',
+                        'content': ['hi']}])
+    redis.connection.set(f'{RUN}:status', 'in_progress')
+    # Renewed by the response worker watching the run.
+    assistant_thread._renew_lease(RUN)
+    monkeypatch.setattr(assistant_service, 'RESPONSE_QUEUE_ENABLED', True)
+    monkeypatch.setattr(assistant_service, 'RESPONSE_WAIT_MAX_SEC', 0.1)
+
+    def watch_response(*args):
+        raise AssertionError('watched')
+
+    monkeypatch.setattr(AssistantThread, 'watch_response', watch_response)
+
+    assert AssistantService('asst_1').get_response('msg_1') is None
@@ -0,0 +1,141 @@
+from concurrent.futures import ThreadPoolExecutor
+from tallkotte.datastore.cachedstore import CachedStore
+from tallkotte.datastore.mongodb.mongo_query import MongoQueryBuilder
+from tallkotte.datastore.single_flight import AsyncSingleFlight, SingleFlight
+
+import asyncio
+import pytest
+import threading
+import time
+
+CALLERS = 8
+# Time for the other callers to join a call, before it returns.
+JOIN_SEC = 0.1
+
+
+def _run_together(fn, callers: int = CALLERS) -> list:
+    with ThreadPoolExecutor(callers) as executor:
+        futures = [executor.submit(fn) for _ in range(callers)]
+        return [future.result() for future in futures]
+
+
+def test_concurrent_calls_share_one_call():
+    single_flight = SingleFlight[int]()
+    calls = []
+
+    def load() -> int:
+        calls.append(1)
+        time.sleep(JOIN_SEC)
+        return 42
+
+    results = _run_together(lambda: single_flight.do('key', load))
+
+    assert len(calls) == 1
+    assert sorted(results) == [(42, False)] + [(42, True)] * (CALLERS - 1)
+
+
+def test_exception_is_shared():
+    single_flight = SingleFlight[int]()
+    calls = []
+
+    def load() -> int:
+        calls.append(1)
+        time.sleep(JOIN_SEC)
+        raise ValueError('not found')
+
+    def call() -> str:
+        with pytest.raises(ValueError) as e:
+            single_flight.do('key', load)
+        return str(e.value)
+
+    assert _run_together(call) == ['not found'] * CALLERS
+    assert len(calls) == 1
+
+
+def test_calls_after_return_run_again():
+    single_flight = SingleFlight[int]()
+    results = iter([1, 2])
+
+    assert single_flight.do('key', lambda: next(results)) == (1, False)
+    assert single_flight.do('key', lambda: next(results)) == (2, False)
+
+
+def test_keys_are_not_shared():
+    single_flight = SingleFlight[str]()
+    release = threading.Event()
+
+    def load(key: str) -> str:
+        release.wait(5)
+        return key
+
+    with ThreadPoolExecutor(2) as executor:
+        first = executor.submit(single_flight.do, 'a', lambda: load('a'))
+        second = executor.submit(single_flight.do, 'b', lambda: load('b'))
+        release.set()
+
+        assert first.result() == ('a', False)
+        assert second.result() == ('b', False)
+
+
+def test_async_concurrent_calls_share_one_call():
+    single_flight = AsyncSingleFlight[int]()
+    calls = []
+
+    async def load() -> int:
+        calls.append(1)
+        await asyncio.sleep(JOIN_SEC)
+        return 42
+
+    async def main() -> list:
+        return await asyncio.gather(*(single_flight.do('key', load)
+                                      for _ in range(CALLERS)))
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert results == [(42, False)] + [(42, True)] * (CALLERS - 1)
+
+
+def test_async_cancelled_waiter_does_not_cancel_call():
+    single_flight = AsyncSingleFlight[int]()
+
+    async def load() -> int:
+        await asyncio.sleep(JOIN_SEC)
+        return 42
+
+    async def main() -> tuple:
+        leader = asyncio.create_task(single_flight.do('key', load))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(single_flight.do('key', load))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        return await leader, waiter
+
+    result, waiter = asyncio.run(main())
+
+    assert result == (42, False)
+    assert waiter.cancelled()
+
+
+def test_cached_store_coalesces_refills(mongo, monkeypatch):
+    mongo.get_collection('test_items').insert_one({'id': 'item_1', 'tags': []})
+    store = CachedStore[dict]('test_items', dict)
+    finds = []
+    find = mongo.find
+
+    def slow_find(*args, **kwargs):
+        finds.append(1)
+        time.sleep(JOIN_SEC)
+        return find(*args, **kwargs)
+
+    monkeypatch.setattr(mongo, 'find', slow_find)
+    query = MongoQueryBuilder(id='item_1').build()
+    query['projection'] = {'_id': 0}
+
+    results = _run_together(lambda: store.read('item_1', query))
+
+    assert len(finds) == 1
+    assert results == [[{'id': 'item_1', 'tags': []}]] * CALLERS
+    # Each caller gets its own copy.
+    results[0][0]['tags'].append('edited')
+    assert all(result[0]['tags'] == [] for result in results[1:])
@@ -0,0 +1,159 @@
+from tallkotte.datastore.sorted_cache import AsyncSortedCache, SortedCache
+from typing import Any, Optional
+
+import asyncio
+import fakeredis
+import pytest
+
+THREAD = 'thread_1'
+
+
+def _message(number: int, created_at: Optional[int] = None,
+             **fields) -> dict[str, Any]:
+    return {'id': f'msg_{number:02}',
+            'created_at': number if created_at is None else created_at,
+            **fields}
+
+
+def _ids(page: Optional[list[Any]]) -> Optional[list[str]]:
+    return None if page is None else [value['id'] for value in page]
+
+
+@pytest.fixture
+def cache() -> SortedCache[dict[str, Any]]:
+    return SortedCache[dict[str, Any]](
+        'test_messages', score=lambda message: message['created_at'],
+        tiebreak=lambda message: message.get('seq', 0), max_length=5)
+
+
+@pytest.fixture
+def filled(cache: SortedCache[dict[str, Any]]) -> SortedCache[dict[str, Any]]:
+    cache.fill(THREAD, [_message(number) for number in range(5)],
+               truncated=False)
+    return cache
+
+
+def test_page_is_none_until_filled(cache):
+    cache.append(THREAD, [_message(0)])
+
+    assert not cache.is_filled(THREAD)
+    assert cache.page(THREAD) is None
+
+    cache.fill(THREAD, [_message(1)], truncated=False)
+
+    assert cache.is_filled(THREAD)
+    assert _ids(cache.page(THREAD)) == ['msg_01', 'msg_00']
+
+
+@pytest.mark.parametrize('sort, after, before, limit, expected', [
+    ('desc', None, None, 2, ['msg_04', 'msg_03']),
+    ('desc', 'msg_03', None, 2, ['msg_02', 'msg_01']),
+    # A page before the cursor is the one adjacent to it.
+    ('desc', None, 'msg_00', 2, ['msg_02', 'msg_01']),
+    ('desc', 'msg_04', 'msg_00', 20, ['msg_03', 'msg_02', 'msg_01']),
+    ('asc', None, None, 2, ['msg_00', 'msg_01']),
+    ('asc', 'msg_01', None, 2, ['msg_02', 'msg_03']),
+    ('asc', None, 'msg_04', 2, ['msg_02', 'msg_03']),
+    ('asc', 'msg_00', 'msg_04', 20, ['msg_01', 'msg_02', 'msg_03']),
+    ('desc', 'msg_00', None, 2, []),
+    ('asc', 'msg_04', None, 2, []),
+])
+def test_page(filled, sort, after, before, limit, expected):
+    page = filled.page(THREAD, after=after, before=before, limit=limit,
+                       sort=sort)
+
+    assert _ids(page) == expected
+
+
+def test_page_with_cursor_not_cached_is_none(filled):
+    assert filled.page(THREAD, after='msg_99') is None
+    assert filled.page(THREAD, before='msg_99') is None
+
+
+def test_page_past_truncated_start_is_none(cache):
+    cache.fill(THREAD, [_message(number) for number in range(5, 10)],
+               truncated=True)
+
+    assert _ids(cache.page(THREAD, limit=3)) == ['msg_09', 'msg_08', 'msg_07']
+    assert _ids(cache.page(THREAD, after='msg_07', limit=2)) == [
+        'msg_06', 'msg_05']
+    # Older messages may be in the database only.
+    assert cache.page(THREAD, after='msg_07', limit=3) is None
+    assert cache.page(THREAD, sort='asc') is None
+
+
+def test_page_past_trimmed_start_is_none(filled):
+    filled.append(THREAD, [_message(5)])
+
+    assert _ids(filled.page(THREAD, limit=5)) == [
+        'msg_05', 'msg_04', 'msg_03', 'msg_02', 'msg_01']
+    # msg_00 was trimmed, so the start of the list is no longer cached.
+    assert filled.page(THREAD, limit=6) is None
+    assert filled.page(THREAD, sort='asc') is None
+    assert filled.page(THREAD, after='msg_00') is None
+
+
+def test_out_of_order_appends_are_sorted_by_score(filled):
+    filled.append(THREAD, [_message(7, created_at=20)])
+    filled.append(THREAD, [_message(6, created_at=10)])
+    # Same score and tiebreak as msg_06, so ordered by id.
+    filled.append(THREAD, [_message(5, created_at=10)])
+
+    assert _ids(filled.page(THREAD, limit=4)) == [
+        'msg_07', 'msg_06', 'msg_05', 'msg_04']
+    assert _ids(filled.page(THREAD, after='msg_06', limit=2)) == [
+        'msg_05', 'msg_04']
+
+
+def test_append_does_not_duplicate(filled):
+    filled.append(THREAD, [{**_message(4), 'content': 'edited'}])
+
+    page = filled.page(THREAD, limit=20)
+
+    assert _ids(page) == ['msg_04', 'msg_03', 'msg_02', 'msg_01', 'msg_00']
+    assert page[0]['content'] == 'edited'
+
+
+def test_object_id_is_not_cached(cache):
+    cache.fill(THREAD, [{**_message(0), '_id': 'object-id'}], truncated=False)
+
+    assert cache.page(THREAD) == [_message(0)]
+
+
+def test_same_score_is_ordered_by_tiebreak(filled):
+    filled.append(THREAD, [_message(6, created_at=10, seq=1),
+                           _message(5, created_at=10, seq=2)])
+
+    assert _ids(filled.page(THREAD, limit=3)) == ['msg_05', 'msg_06', 'msg_04']
+    assert _ids(filled.page(THREAD, after='msg_05', limit=2)) == [
+        'msg_06', 'msg_04']
+    assert _ids(filled.page(THREAD, after='msg_04', sort='asc')) == [
+        'msg_06', 'msg_05']
+
+
+def test_append_with_new_tiebreak_moves_document(filled):
+    filled.append(THREAD, [_message(6, created_at=10, seq=1),
+                           _message(5, created_at=10, seq=2)])
+    filled.append(THREAD, [_message(6, created_at=10, seq=3)])
+
+    assert _ids(filled.page(THREAD, limit=4)) == [
+        'msg_06', 'msg_05', 'msg_04', 'msg_03']
+
+
+def test_trimmed_documents_are_dropped(filled, redis):
+    filled.append(THREAD, [_message(5), _message(6)])
+
+    members = redis.connection.hkeys(f'test_messages:{THREAD}:members')
+    assert sorted(members) == [
+        b'msg_02', b'msg_03', b'msg_04', b'msg_05', b'msg_06']
+    assert filled.page(THREAD, before='msg_01') is None
+
+
+def test_async_append(filled, redis):
+    server = redis.connection.connection_pool.connection_kwargs['server']
+    async_cache = AsyncSortedCache(
+        filled, fakeredis.aioredis.FakeRedis(server=server))
+
+    asyncio.run(async_cache.append(THREAD, [_message(5)]))
+
+    assert _ids(filled.page(THREAD, limit=2)) == ['msg_05', 'msg_04']
@@ -0,0 +1,142 @@
+from tallkotte.datastore.mongodb.write_behind import WriteBehindBuffer
+
+import pytest
+import time
+
+COLLECTION = 'test_messages'
+
+
+def _message(number: int, **fields) -> dict:
+    return {'id': f'msg_{number:02}', 'run_id': None, **fields}
+
+
+def _saved(mongo) -> list[dict]:
+    return list(mongo.get_collection(COLLECTION).find(
+        {}, {'_id': 0}, sort=[('id', 1)]))
+
+
+def _wait_for(condition, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def flushed(mongo) -> list[list[dict]]:
+    return []
+
+
+@pytest.fixture
+def buffer(mongo, flushed):
+    buffer = WriteBehindBuffer[dict](mongo, COLLECTION, overwrite=('run_id',),
+                                     batch_size=3, interval=60,
+                                     max_pending=10, on_flush=flushed.append)
+    yield buffer
+    buffer.close()
+
+
+def test_flush_writes_pending(mongo, buffer, flushed):
+    buffer.add([_message(1), _message(2)])
+
+    assert buffer.pending == 2
+    assert _saved(mongo) == []
+
+    assert buffer.flush() == 2
+
+    assert buffer.pending == 0
+    assert _saved(mongo) == [_message(1), _message(2)]
+    assert flushed == [[_message(1), _message(2)]]
+
+
+def test_full_batch_is_written_in_background(mongo, buffer):
+    buffer.add([_message(number) for number in range(3)])
+
+    assert _wait_for(lambda: len(_saved(mongo)) == 3)
+    assert buffer.pending == 0
+
+
+def test_pending_are_written_every_interval(mongo):
+    buffer = WriteBehindBuffer[dict](mongo, COLLECTION, batch_size=100,
+                                     interval=0.05)
+    try:
+        buffer.add([_message(1)])
+
+        assert _wait_for(lambda: _saved(mongo) == [_message(1)])
+    finally:
+        buffer.close()
+
+
+def test_saved_documents_keep_all_but_overwrite_fields(mongo, buffer):
+    mongo.get_collection(COLLECTION).insert_one(
+        _message(1, content='synced'))
+
+    buffer.add([_message(1, run_id='run_1', content='sent'), _message(2)])
+    buffer.flush()
+
+    assert _saved(mongo) == [_message(1, run_id='run_1', content='synced'),
+                             _message(2)]
+
+
+def test_failed_batch_is_retried(mongo, buffer, flushed, monkeypatch):
+    insert_missing = mongo.insert_missing
+    failures = iter([ConnectionError('down')])
+
+    def flaky_insert_missing(*args, **kwargs):
+        error = next(failures, None)
+        if error:
+            raise error
+        return insert_missing(*args, **kwargs)
+
+    monkeypatch.setattr(mongo, 'insert_missing', flaky_insert_missing)
+    # Flushed here only.
+    monkeypatch.setattr(buffer, '_start', lambda: None)
+    buffer.add([_message(1), _message(2)])
+
+    assert buffer.flush() == 0
+    assert buffer.pending == 2
+    assert flushed == []
+
+    buffer.add([_message(3)])
+
+    assert buffer.flush() == 3
+    assert _saved(mongo) == [_message(1), _message(2), _message(3)]
+    # Written in the order added.
+    assert flushed == [[_message(1), _message(2), _message(3)]]
+
+
+def test_add_writes_once_max_pending(mongo, buffer, monkeypatch):
+    monkeypatch.setattr(buffer, '_start', lambda: None)
+
+    buffer.add([_message(number) for number in range(9)])
+    assert buffer.pending == 9
+
+    buffer.add([_message(9)])
+
+    assert buffer.pending == 0
+    assert len(_saved(mongo)) == 10
+
+
+def test_add_raises_if_write_fails_at_max_pending(mongo, buffer, monkeypatch):
+    monkeypatch.setattr(buffer, '_start', lambda: None)
+
+    def failing_insert_missing(*args, **kwargs):
+        raise ConnectionError('down')
+
+    monkeypatch.setattr(mongo, 'insert_missing', failing_insert_missing)
+
+    with pytest.raises(ConnectionError):
+        buffer.add([_message(number) for number in range(10)])
+    assert buffer.pending == 10
+
+
+def test_close_writes_pending_and_rejects_adds(mongo, buffer):
+    buffer.add([_message(1)])
+
+    buffer.close()
+
+    assert _saved(mongo) == [_message(1)]
+    with pytest.raises(RuntimeError):
+        buffer.add([_message(2)])